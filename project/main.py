@@ -2,6 +2,7 @@ from sys import argv
 
 from pep2path.spectra.spectraMain import main as spectra_main
 from pep2path.spectra.drawSpectra import main as graph_main
+from pep2path.spectra.SpectralLibrary import SpectralLibrary
 
 from pep2path.experiment import intersection_experiment, simple_experiment, p2p_experiment
 from pep2path.ripp2path import test_ripp2path
@@ -15,6 +16,13 @@ from pep2path.tests import ripp_tests
 def spectra(args): spectra_main()
 def graph(args): graph_main()
 
+def pack(args):
+	if(len(args) < 2):
+		print("Usage: pack <directory> <library file> [file name patterns...]")
+		return
+	library = SpectralLibrary.pack(args[0], args[1], patterns=(args[2:] if len(args) > 2 else None))
+	print(library)
+
 def tests(args):
 	spectra_tests()
 	genbank_tests()
@@ -40,6 +48,7 @@ def testripp(args):
 	
 modes = {"spectra" : spectra,
 		 "graph" : graph,
+		 "pack" : pack,
 		 "tests" : tests,
 		 "experiment" : experiment,
 		 "comparisons" : comparisons,
@@ -42,6 +42,14 @@ def normalise_gbk(gbk):
 def score_unique_components(spectrum, gbk):
 	return len(set(spectrum) & set(gbk)) / len(set(spectrum) | set(gbk))
 	
+'''Given an iterable of sequence tags (such as the generator from MassSpectrum's iter_sequence_tags), returns a list of the unique components across all of them.
+	Tags are consumed one at a time and only the components seen so far are kept, so the tags never have to be held in memory together.'''
+def stream_unique_components(tags):
+	components = set()
+	for tag in tags:
+		components.update(tag.decompose_tag())
+	return list(components)
+	
 '''Given a nested list where internal lists represent a mass spectrum and their contents are their unique components,
 	and a nested list where internal lists represent genbank files and their contents are their unique components,
 	and two lists of names where the names correspond to the files in each of these lists
@@ -9,7 +9,9 @@ from .spectra.MassSpectrum import MassSpectrum
 from .spectra.Tag import Tag
 from .spectra.SpectrumTags import SpectrumTags
 
-from .genbank.gbkParser import parse_genbank
+from .genbank.gbkParser import load_genbanks
+from .genbank import genbankLoading
+from .genbank.GenbankCache import GenbankCache
 from .genbank.CDSPrediction import CDSPrediction
 from .genbank.GenbankFile import GenbankFile
 
@@ -21,13 +23,24 @@ from . import comparisons as compare
 def only_AAs(ls):
 	return [component for component in ls if (component[0].upper() + component[1:].lower()) in AA_names]
 
-'''Read according to antiSMASH format all genbank files contained within the specified directory matching a name in filenames_path.'''
+'''Read according to antiSMASH format all genbank files contained within the specified directory matching a name in filenames_path.
+	Parsed files are kept in a GenbankCache (the default one if cache is True, or another GenbankCache), so later runs don't parse them again; cache can also be False to always parse them.
+	Files that aren't in the cache are parsed by a pool of worker processes (see gbkParser's load_genbanks), and any that can't be parsed are reported and left out.'''
 def get_gbks(path=os.path.join(os.path.join(os.path.join(os.path.dirname(__file__), "genbank"), "justin-20181022")),
-				filenames_path=os.path.join(os.path.dirname(__file__), "dataset.out")):
+				filenames_path=os.path.join(os.path.dirname(__file__), "dataset.out"), cache=True, workers=None):
+	if(cache is True):
+		cache = GenbankCache()
+	elif(cache is False):
+		cache = None
 	gbk_dataset = open(filenames_path, 'r')
 	gbk_names = [gbk_name.strip() for gbk_name in gbk_dataset]
-	gbk_files = [parse_genbank(path, gbk_name) for gbk_name in gbk_names]
 	gbk_dataset.close()
+	
+	gbk_files, failures = load_genbanks(path, gbk_names, cache=cache, workers=workers)
+	genbankLoading.report_failures(gbk_names, failures)
+	
+	gbk_names = [gbk_name for gbk_name, gbk_file in zip(gbk_names, gbk_files) if gbk_file is not None]
+	gbk_files = [gbk_file for gbk_file in gbk_files if gbk_file is not None]
 	return gbk_files, gbk_names	
 	
 '''Shuffles the contents about between Genbank files and CDSes then compares the unique components of these random Genbank files to spectra as a baseline
@@ -144,15 +157,16 @@ def experiment(shuffled_iters, random_iters, comparator, printer, table_printer,
 
 	outs = ["matching_0.01Mass_0.05Inten", "matching_0.001Mass_0.005Inten", "matching_0.00001ppmMass_0.05Inten", 
 												"matching_0.01Mass_0.005Inten", "matching_0.001Mass_0.05Inten"]
-	zipped = zip(mass_tolerance_modes, mass_thresholds, intensity_thresholds, outs)
+	configurations = list(zip(mass_tolerance_modes, mass_thresholds, intensity_thresholds))[:len(outs)]
+	
+	#every configuration's tags are found from the same edges, with each configuration's intensity threshold relative to the spectrum's max intensity
+	swept_tags = msagg.sweep_sequence_tags(configurations, relative_intensity=True)
 		
 	path = os.path.join("spectra", "spectraData")
 	table_data = []
-	for mass_tolerance_mode, mass_threshold, intensity_threshold, out in zipped:
+	for spectra, out in zip(swept_tags, outs):
 		
 		spectra_names = [str(spectrum.id) for spectrum in msagg.spectra]
-		msagg.filter_intensity_local(intensity_thresholds=[intensity_threshold*mint for mint in msagg.max_intensity_local()])
-		spectra = msagg.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)
 		spectra = preprocess_s(spectra)
 		
 		counts = []
@@ -1,10 +1,17 @@
-from Bio import SeqIO
 import os
 from glob import glob
 from collections import Counter
 from genbank.aanames import AA_names
+from genbank import featureCatalog
 
-'''Provides methods to select antiSMASH-generated Genbank files based on certain properties.'''
+'''Provides methods to select antiSMASH-generated Genbank files based on certain properties.
+	main selects datasets by filtering the rows of a catalog of the files (see genbank's featureCatalog) rather than scanning every file for every property.'''
+
+#Product types counted as RiPPs
+RIPP_CLASSES = ["ripp", "lantipeptide", "bottromycin", "cyanobactin", "glycocin", "lassopeptide", "linaridin", "linearazol",
+					"microcin", "sactipeptide", "thiopeptide", "auto_inducing_peptide", "comx", "bacterial_head_to_tail_cyclized"]
+#Name of the catalog kept in the directory of the Genbank files
+CATALOG_NAME = "catalog.tsv"
 				
 '''Given a prediction as string, checks it isn't empty and only contains components from the keys of the given table of component names.'''
 def components_in_dict(pred, table):
@@ -12,10 +19,10 @@ def components_in_dict(pred, table):
 	components = itertools.chain.from_iterable([c.split('|') for c in pred.split('-')])
 	return all([c in table.keys() for c in components])
 
-'''Given a SeqRecord object returns the combined product types of all clusters.'''
+'''Given a SeqRecord object returns the combined product types of all clusters (in alphabetical order, so the same types always give the same string).'''
 def get_product_class(seq_rec):	
 	products = [feature.qualifiers["product"][0] for feature in seq_rec.features if feature.type == "cluster"]
-	return "/".join(list(set(products)))
+	return "/".join(sorted(set(products)))
 	
 '''Checks all clusters have the product type NRPS.'''
 def is_nrps(seq_rec):
@@ -23,9 +30,7 @@ def is_nrps(seq_rec):
 
 '''Checks all clusters have the product type RiPP.'''	
 def is_ripp(seq_rec):
-	subclasses = ["ripp", "lantipeptide", "bottromycin", "cyanobactin", "glycocin", "lassopeptide", "linaridin", "linearazol", 
-					"microcin", "sactipeptide", "thiopeptide", "auto_inducing_peptide", "comx", "bacterial_head_to_tail_cyclized"]
-	return get_product_class(seq_rec).lower() in subclasses 
+	return get_product_class(seq_rec).lower() in RIPP_CLASSES
 
 '''Given a SeqRecord object and a length n returns whether it contains predictions of total length greater than or equal to n.'''
 def has_long_predictions(seq_rec, n):
@@ -47,27 +52,34 @@ def product_class_freqs(seq_recs):
 '''Given a SeqRecord object returns whether it has a lanc_like pfam domain.'''	
 def has_lanclike(seq_rec):
 	return any(["lanc_like" in map(lambda x: x.lower(), feature.qualifiers.get("domain", [])) for feature in seq_rec.features])
+
+'''Given a catalog row (see genbank's featureCatalog), checks the file has exactly one cluster, of product type NRPS, with predictions of total length greater than or equal to n.'''
+def is_nrps_candidate(row, n=3):
+	return row["clusters"] == 1 and row["product_class"].lower() == "nrps" and row["prediction_length"] >= n
+
+'''Given a catalog row, checks the file has exactly one cluster, of a RiPP product type, and a lanc_like pfam domain.'''
+def is_ripp_candidate(row):
+	return row["clusters"] == 1 and row["product_class"].lower() in RIPP_CLASSES and row["lanclike"]
 	
-def main():
+def main(workers=None, catalog_path=None):
 	path = os.path.join(os.path.join(os.getcwd(), "genbank"), "justin-20181022")
 	outpath = os.getcwd()
+	catalog_path = os.path.join(path, CATALOG_NAME) if catalog_path is None else catalog_path
 	
 	names = [name for name in glob(os.path.join(path, "*.gbk")) if (not "final" in os.path.basename(name))]
-	gbks = [(os.path.basename(pattern), SeqIO.read(pattern, "genbank")) for pattern in names]
+	rows = featureCatalog.update_catalog(names, catalog_path, workers=workers)
 	
-	print("\n".join(sorted(["%s : %d" % (name, count) for name, count in product_class_freqs([gbk for name, gbk in gbks]).items()])))
+	print("\n".join(sorted(["%s : %d" % (name, count) for name, count in Counter([row["product_class"] for row in rows]).items()])))
 
 	#find files with one cluster with class NRPS and has predictions > length two
-	nrps_gbks = [(name, file) for name, file in gbks if (has_one_cluster(file) and is_nrps(file) and has_long_predictions(file, 3))]
-	
 	with open(os.path.join(outpath, "dataset.out"), 'w') as out:
-		out.write("\n".join([name for name, file in nrps_gbks]))
+		out.write("\n".join(featureCatalog.select(rows, is_nrps_candidate)))
 	
 	#find files with one cluster with class RiPP
-	ripp_gbks = [(name, file) for name, file in gbks if (has_one_cluster(file) and is_ripp(file) and has_lanclike(file))]
+	ripp_rows = [row for row in rows if is_ripp_candidate(row)]
 	
 	with open(os.path.join(outpath, "ripp_dataset.out"), 'w') as out:
-		out.write("\n".join([name + " " + str(get_product_class(file)) for name, file in ripp_gbks]))
+		out.write("\n".join([row["name"] + " " + row["product_class"] for row in ripp_rows]))
 	
 if __name__ == "__main__":
 
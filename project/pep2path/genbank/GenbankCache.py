@@ -0,0 +1,100 @@
+import os
+import pickle
+
+from . import fileSaving
+from .CDSPrediction import CDSPrediction
+from .GenbankFile import GenbankFile
+
+'''Class for a persistent on-disk cache of parsed Genbank files, so a corpus only has to be parsed once rather than on every run.
+	Every entry is kept in one pickle file (so a whole corpus is loaded with a single read), under the kind of parse and the absolute path of its source,
+	along with the source's fingerprint (absolute path, size and modification time). An entry whose fingerprint no longer matches its source is stale and is replaced.
+	
+	Entries hold the contents of a GenbankFile as plain tuples rather than the objects themselves, so the file stays compact and doesn't depend on the classes' layout.
+	New entries are only written to the file by save.'''
+class GenbankCache():
+	
+	#Default path of the cache file
+	DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "genbankCache", "genbank.cache")
+	#Version of the layout of the cache file (files with any other are ignored)
+	VERSION = 1
+	
+	def __init__(self, path=None):
+		#String containing the path of the cache file (which is created, along with its directory, when it's first saved)
+		self.path = GenbankCache.DEFAULT_PATH if path is None else path
+		#Dictionary of (fingerprint, contents) under (kind, absolute path of the source)
+		self.entries = self.read_entries()
+		#Whether any entries have changed since the file was read
+		self.changed = False
+	
+	def __str__(self):
+		return "GenbankCache of %d files in %s" % (len(self), self.path)
+	
+	def __len__(self):
+		return len(self.entries)
+	
+	'''Returns the contents of a GenbankFile as a list of tuples of the overall prediction and domain predictions of each CDSPrediction.'''
+	@staticmethod
+	def pack(gbk_file):
+		return [(cds.overall_prediction, cds.predictions) for cds in gbk_file.predictions]
+	
+	'''Returns a new GenbankFile from contents given by pack.'''
+	@staticmethod
+	def unpack(contents):
+		return GenbankFile([CDSPrediction(overall_prediction, predictions) for overall_prediction, predictions in contents])
+	
+	'''Returns the dictionary of entries in the cache file, or an empty one if there isn't a (readable, current) cache file.'''
+	def read_entries(self):
+		try:
+			with open(self.path, 'rb') as file:
+				version, entries = pickle.load(file)
+			if(version == GenbankCache.VERSION):
+				return entries
+		except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+			pass
+		return {}
+	
+	'''Returns the GenbankFile of the source file at path, from its entry if there's an up to date one, otherwise by calling parse (a function taking no arguments
+		which parses the file as the given kind, e.g. "antismash") and keeping the result as a new entry.'''
+	def load(self, path, kind, parse):
+		
+		gbk_file = self.get(path, kind)
+		if(gbk_file is not None):
+			return gbk_file
+		
+		gbk_file = parse()
+		self.store(path, kind, gbk_file)
+		return gbk_file
+	
+	'''Returns the GenbankFile of the source file at path parsed as the given kind from its entry, or None if there isn't an up to date one (or the file can't be found).'''
+	def get(self, path, kind):
+		
+		entry = self.entries.get((kind, os.path.abspath(path)))
+		if(entry is None):
+			return None
+		try:
+			fingerprint = fileSaving.fingerprint(path)
+		except OSError:
+			return None
+		return GenbankCache.unpack(entry[1]) if entry[0] == fingerprint else None
+	
+	'''Keeps a GenbankFile as the entry for the source file at path parsed as the given kind, replacing any entry it already has.'''
+	def store(self, path, kind, gbk_file):
+		self.entries[(kind, os.path.abspath(path))] = (fileSaving.fingerprint(path), GenbankCache.pack(gbk_file))
+		self.changed = True
+	
+	'''Writes the entries to the cache file (see fileSaving's atomic_write) if any have changed.'''
+	def save(self):
+		
+		if(not self.changed):
+			return
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		with fileSaving.atomic_write(self.path, 'wb') as file:
+			pickle.dump((GenbankCache.VERSION, self.entries), file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.changed = False
+	
+	'''Removes every entry, and the cache file.'''
+	def clear(self):
+		self.entries = {}
+		self.changed = False
+		if(os.path.exists(self.path)):
+			os.remove(self.path)
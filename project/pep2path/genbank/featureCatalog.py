@@ -0,0 +1,111 @@
+import os
+
+from . import featureScanner
+from . import fileSaving
+from . import genbankLoading
+
+'''Summarises the features of antiSMASH Genbank files in one pass over each, and keeps the summaries in a catalog: a table with a row per file
+(saved as a tab-separated file with a header line), so selecting files for a dataset (see fileFinder) is a filter over the rows rather than a scan of every file.
+Every row records the size and modification time of its file, and rows are only made again for files that have changed since.
+Files that can't be scanned get a row too, holding the error, so they aren't scanned again until they change.'''
+
+#Columns of the catalog, in order
+COLUMNS = ["name", "size", "mtime_ns", "clusters", "product_class", "prediction_length", "lanclike", "missing_product", "error"]
+#Columns holding ints and bools (the rest hold strings)
+INT_COLUMNS = ["size", "mtime_ns", "clusters", "prediction_length"]
+BOOL_COLUMNS = ["lanclike", "missing_product"]
+#Summary given to files that can't be scanned (along with their error)
+FAILED_SUMMARY = {"clusters" : 0, "product_class" : "", "prediction_length" : 0, "lanclike" : False, "missing_product" : False}
+
+#####################
+###Summary Methods###
+#####################
+
+'''Given a SeqRecord (or featureScanner's ScannedRecord), returns a dictionary summarising its features in one pass:
+	the number of 'cluster' features, the combined product types of the clusters (as fileFinder's get_product_class), the total length of the aSProdPred predictions
+	(as counted by fileFinder's has_long_predictions), whether any feature has a lanc_like domain and whether any cluster is missing its 'product' qualifier.'''
+def summarise(seq_rec):
+	
+	clusters, products, prediction_length, lanclike, missing_product = 0, [], 0, False, False
+	for feature in seq_rec.features:
+		qualifiers = feature.qualifiers
+		if(feature.type == "cluster"):
+			clusters += 1
+			if("product" in qualifiers):
+				products.append(qualifiers["product"][0])
+			else:
+				missing_product = True
+		if("aSProdPred" in qualifiers):
+			prediction = qualifiers["aSProdPred"][0]
+			prediction_length += prediction.count("-") + 1 if prediction.strip() != "" else 0
+		if(not lanclike and "domain" in qualifiers):
+			lanclike = "lanc_like" in [domain.lower() for domain in qualifiers["domain"]]
+	
+	return {"clusters" : clusters, "product_class" : "/".join(sorted(set(products))), "prediction_length" : prediction_length,
+				"lanclike" : lanclike, "missing_product" : missing_product}
+
+'''Scans the Genbank file at path (see featureScanner) and returns its summary. This is at module level so that it can be sent to a pool of worker processes.'''
+def summarise_file(path):
+	return summarise(featureScanner.scan_genbank(path, ["aSProdPred", "product", "domain"]))
+
+#####################
+###Catalog Methods###
+#####################
+
+'''Returns a dictionary of the rows of the catalog at catalog_path (dictionaries of its COLUMNS) under their names, or an empty one if there isn't a (readable) catalog.'''
+def read_catalog(catalog_path):
+	
+	rows = {}
+	try:
+		with open(catalog_path, 'r') as file:
+			if(file.readline().rstrip("\n").split("\t") != COLUMNS): #a catalog with other columns is made again
+				return {}
+			for line in file:
+				row = dict(zip(COLUMNS, line.rstrip("\n").split("\t")))
+				if(len(row) != len(COLUMNS)):
+					continue
+				for column in INT_COLUMNS:
+					row[column] = int(row[column])
+				for column in BOOL_COLUMNS:
+					row[column] = row[column] == "1"
+				rows[row["name"]] = row
+	except (OSError, ValueError):
+		return {}
+	return rows
+
+'''Writes a list of rows to a catalog at catalog_path (see fileSaving's atomic_write).'''
+def write_catalog(catalog_path, rows):
+	with fileSaving.atomic_write(catalog_path) as file:
+		file.write("\t".join(COLUMNS) + "\n")
+		for row in rows:
+			file.write("\t".join([("1" if row[column] else "0") if column in BOOL_COLUMNS else str(row[column]) for column in COLUMNS]) + "\n")
+
+'''Returns a list of the catalog rows of the Genbank files at the given paths (in the same order), and saves them as the catalog at catalog_path if any have changed.
+	Rows are taken from the saved catalog for files that haven't changed since, and the rest are summarised by a pool of worker processes (see genbankLoading's load_genbanks);
+	files that can't be scanned are reported (when they're scanned) and left out of the rows returned, but are kept in the catalog with their error.'''
+def update_catalog(paths, catalog_path, workers=None):
+	
+	saved = read_catalog(catalog_path)
+	rows = []
+	for path in paths:
+		stat = os.stat(path)
+		row = saved.get(os.path.basename(path))
+		fresh = row is not None and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns
+		rows.append(row if fresh else {"name" : os.path.basename(path), "size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns})
+	
+	missing = [index for index, row in enumerate(rows) if len(row) < len(COLUMNS)]
+	summaries, failures = genbankLoading.load_genbanks([(paths[index],) for index in missing], summarise_file, workers=workers)
+	genbankLoading.report_failures([paths[index] for index in missing], failures)
+	for index, summary in zip(missing, summaries):
+		if(summary is not None):
+			rows[index].update(summary, error="")
+	for index, error in failures:
+		rows[missing[index]].update(FAILED_SUMMARY, error=" ".join(error.split())) #kept on one line of its column
+	
+	if(len(missing) > 0 or len(rows) != len(saved)):
+		write_catalog(catalog_path, rows)
+	return [row for row in rows if row["error"] == ""]
+
+'''Returns a list of the names of the rows for which the predicate (a function taking a row) is true, in the order of the rows.'''
+def select(rows, predicate):
+	return [row["name"] for row in rows if predicate(row)]
@@ -0,0 +1,203 @@
+from Bio.SeqFeature import Location, LocationParserError
+
+'''Scans the feature tables of GenBank files without building the rest of the record: the header is skipped (apart from the LOCUS line),
+the features are read line by line keeping only the qualifiers asked for, and the file is closed as soon as the sequence (ORIGIN) is reached,
+so the nucleotide sequence is never read. Features and qualifiers come out as Biopython's SeqIO.read(path, "genbank") would give them
+(with the same rules for wrapped locations, quoted and unquoted qualifiers, valueless qualifiers like /pseudo and escaped quotes),
+and locations are parsed by Biopython the first time they're used.
+
+Only the first record of a file is scanned (SeqIO.read would reject a file with several).'''
+
+#Qualifiers kept by default, which are all the ones read from antiSMASH files in pep2path
+DEFAULT_QUALIFIERS = ["aSProdPred", "specificity", "product", "domain"]
+#Column the locations and qualifiers of features start at, and the indentation of lines continuing a feature
+QUALIFIER_INDENT = 21
+QUALIFIER_SPACER = " " * QUALIFIER_INDENT
+#Headers marking the end of the feature table, after which is the sequence (as Biopython's GenBank scanner has them)
+SEQUENCE_HEADERS = ["CONTIG", "ORIGIN", "BASE COUNT", "WGS", "TSA", "TLS"]
+
+'''Class for a feature read by the scanner, with the type, location and qualifiers of Biopython's SeqFeature (qualifiers only holding those asked for).'''
+class ScannedFeature():
+	
+	def __init__(self, type, location_text, qualifiers, length=None, circular=False, stranded=True):
+		#String containing the feature's key (e.g. "CDS")
+		self.type = type
+		#String containing the feature's location as it was written in the file (without whitespace)
+		self.location_text = location_text
+		#Dictionary of the qualifiers that were asked for, under their names, as lists of values in the order they were found
+		self.qualifiers = qualifiers
+		#Length of the record and whether it's circular and stranded, which Biopython needs to parse locations spanning the origin
+		self.length = length
+		self.circular = circular
+		self.stranded = stranded
+		#Biopython location, parsed the first time it's needed
+		self.__location = None
+		self.__parsed = False
+	
+	def __str__(self):
+		return "ScannedFeature %s at %s" % (self.type, self.location_text)
+	
+	'''The feature's location as a Biopython SimpleLocation or CompoundLocation (or None if Biopython couldn't parse it, as SeqIO would give it).'''
+	@property
+	def location(self):
+		if(not self.__parsed):
+			try:
+				self.__location = Location.fromstring(self.location_text, self.length, self.circular, self.stranded)
+			except LocationParserError:
+				self.__location = None
+			self.__parsed = True
+		return self.__location
+
+'''Class for the feature table of a GenBank record, with the name and features of Biopython's SeqRecord.'''
+class ScannedRecord():
+	
+	def __init__(self, name, length, features):
+		#String containing the LOCUS name of the record
+		self.name = name
+		#Int of the length of the record's sequence (from its LOCUS line), or None if it isn't given
+		self.length = length
+		#List of ScannedFeatures in the order of the file
+		self.features = features
+	
+	def __str__(self):
+		return "ScannedRecord %s with %d features" % (self.name, len(self.features))
+
+'''Scans the GenBank file at path and returns a ScannedRecord of its features, keeping only the given qualifiers (DEFAULT_QUALIFIERS if None).'''
+def scan_genbank(path, qualifiers=None):
+	with open(path, 'r') as file:
+		return scan_file(file, qualifiers)
+
+'''Scans an open GenBank file (or any iterable of its lines) as scan_genbank does, stopping at the start of the sequence.
+	Raises ValueError for files Biopython would reject for the same reasons (no LOCUS line, or a feature table that isn't finished).'''
+def scan_file(file, qualifiers=None):
+	
+	qualifiers = set(DEFAULT_QUALIFIERS if qualifiers is None else qualifiers)
+	lines = iter(file)
+	
+	name, length, circular, stranded = None, None, False, True
+	for line in lines:
+		if(line.startswith("LOCUS")):
+			fields = line.split()
+			name = fields[1] if len(fields) > 1 else ""
+			for index, field in enumerate(fields[2:], 2):
+				if(field in ["bp", "aa"] and fields[index-1].isdigit()):
+					length, stranded = int(fields[index-1]), field == "bp"
+			circular = "circular" in fields
+			break
+	else:
+		raise ValueError("No LOCUS line found")
+	
+	features = []
+	for line in lines:
+		if(line[:12].rstrip() in SEQUENCE_HEADERS or line.startswith("//")): #no feature table
+			return ScannedRecord(name, length, features)
+		if(line.startswith("FEATURES")):
+			break
+	else:
+		raise ValueError("Premature end of file before features table")
+	
+	key, feature_lines = None, []
+	for line in lines:
+		if(line.startswith(QUALIFIER_SPACER)): #continuation of the current feature, which is most lines, so it's checked first
+			if(key is not None):
+				line = line.strip()
+				if(line != ""):
+					feature_lines.append(line)
+			continue
+		if(line[:12].rstrip() in SEQUENCE_HEADERS):
+			break
+		if(line.startswith("//")):
+			raise ValueError("Premature end of features table, marker '//' found")
+		if(line[:QUALIFIER_INDENT].strip() == ""): #a blank line, or one continuing the current feature with too little indentation
+			if(key is not None and line.strip() != ""):
+				feature_lines.append(line[QUALIFIER_INDENT:].strip())
+			continue
+		if(key is not None):
+			features.append(parse_feature(key, feature_lines, qualifiers, length, circular, stranded))
+			key = None
+		if(len(line.rstrip()) <= QUALIFIER_INDENT): #too short to hold a feature, so it's skipped (and so is anything up to the next feature)
+			continue
+		if(line[QUALIFIER_INDENT] != " " and " " in line[QUALIFIER_INDENT:].strip()): #over-indented feature with a key too long for its column
+			key, rest = line[2:].strip().split(None, 1)
+			feature_lines = [rest.strip()]
+		else:
+			key, feature_lines = line[2:QUALIFIER_INDENT].strip(), [line[QUALIFIER_INDENT:].strip()]
+	else:
+		raise ValueError("Premature end of line during features table")
+	
+	if(key is not None):
+		features.append(parse_feature(key, feature_lines, qualifiers, length, circular, stranded))
+	return ScannedRecord(name, length, features)
+
+'''Returns a ScannedFeature from the key of a feature and the lines of its location and qualifiers (with their indentation removed),
+	keeping only the given set of qualifiers. Wrapped values are joined by spaces, as SeqIO does.'''
+def parse_feature(key, lines, qualifiers, length=None, circular=False, stranded=True):
+	
+	lines = [line for line in lines if line]
+	if(len(lines) == 0):
+		raise ValueError("Problem with '%s' feature: no location" % key)
+	
+	location, line_number = lines[0], 1
+	while(location.endswith(",") or location.count("(") > location.count(")")): #location wrapped over several lines
+		if(line_number >= len(lines)):
+			raise ValueError("Problem with '%s' feature: unfinished location" % key)
+		location += lines[line_number]
+		line_number += 1
+	if(line_number < len(lines) and lines[line_number].startswith(")")): #extra wrapping of the closing parentheses
+		location += lines[line_number]
+		line_number += 1
+	location = "".join(location.split())
+	if("replace" in location):
+		location = location[8:location.find(",")]
+	
+	values = {}
+	name, value_lines = None, None
+	while(line_number < len(lines)):
+		line = lines[line_number]
+		line_number += 1
+		if(line.startswith("/")):
+			name, value_lines = read_qualifier(line, lines, line_number)
+			line_number += 0 if value_lines is None else len(value_lines) - 1
+			if(name in qualifiers):
+				add_qualifier(values, name, value_lines)
+		elif(name is None or value_lines is None): #unquoted continuation of nothing
+			raise ValueError("Problem with '%s' feature: unexpected line %s" % (key, line))
+		else: #unquoted continuation
+			value_lines = value_lines + [line]
+			if(name in qualifiers):
+				values[name][-1] = clean_value(name, value_lines)
+	
+	return ScannedFeature(key, location, values, length, circular, stranded)
+
+'''Helper to read a qualifier starting on the given line: returns its name and the lines of its value (None if it has no value, like /pseudo).'''
+def read_qualifier(line, lines, line_number):
+	
+	if('=' not in line):
+		return line[1:], None
+	name, value = line[1:line.find('=')], line[line.find('=')+1:]
+	if(value.startswith(" ") and value.lstrip().startswith('"')):
+		value = value.lstrip()
+	
+	value_lines = [value]
+	if(len(value) > 1 and value[0] == '"'): #quoted values run until a line ending in a quote
+		while(value_lines[-1][-1] != '"'):
+			if(line_number >= len(lines)):
+				raise ValueError("Unfinished quoted value of qualifier %s" % name)
+			value_lines.append(lines[line_number])
+			line_number += 1
+	return name, value_lines
+
+'''Helper to add the value of a qualifier to the dictionary of a feature's qualifiers, as Biopython's GenBank parser does.'''
+def add_qualifier(values, name, value_lines):
+	if(value_lines is None): #valueless qualifiers only give an empty string if they're the first of their name
+		values.setdefault(name, [""])
+	else:
+		values.setdefault(name, []).append(clean_value(name, value_lines))
+
+'''Helper to join the lines of the value of a qualifier, removing its enclosing quotes and undoing escaped quotes.'''
+def clean_value(name, value_lines):
+	value = " ".join(value_lines)
+	if(len(value) > 1 and value[0] == '"' and value[-1] == '"'):
+		value = value[1:-1]
+	value = value.replace('""', '"')
+	return "".join(value.split()) if name == "translation" else value
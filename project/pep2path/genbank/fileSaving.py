@@ -0,0 +1,27 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+'''Helpers for the files pep2path keeps alongside its inputs (caches, indices and catalogs of both spectra and Genbank files):
+fingerprints of the source files they were made from, and writing them so they're never seen half-written.
+This lives in genbank (rather than above it) so that scripts run from pep2path, like fileFinder, can still import the genbank package on its own.'''
+
+'''Returns the fingerprint of a source file, as a dictionary of its absolute path, size and modification time (in nanoseconds).'''
+def fingerprint(path):
+	stat = os.stat(path)
+	return {"path" : os.path.abspath(path), "size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns}
+
+'''Context manager giving a file opened with the given mode under a temporary name in the directory of path, which is moved into place at path
+	once the block finishes, so readers never see half of one. If the block (or the move) raises, the temporary file is removed instead.'''
+@contextmanager
+def atomic_write(path, mode='w'):
+	
+	descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+	try:
+		with os.fdopen(descriptor, mode) as file:
+			yield file
+		os.replace(temporary_path, path)
+	except BaseException:
+		if(os.path.exists(temporary_path)):
+			os.remove(temporary_path)
+		raise
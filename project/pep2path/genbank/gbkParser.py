@@ -1,13 +1,61 @@
-from Bio import SeqIO
 import os
+import heapq
 
+from . import featureScanner
+from . import genbankLoading
 from .CDSPrediction import CDSPrediction
 from .GenbankFile import GenbankFile
 
+'''Returns a list of lists of the indices of the intervals (pairs of start and end, half-open like Biopython's locations) containing each of the positions.
+	Both are sorted by start and swept through once, keeping a heap of the intervals that have started, by end, rather than checking every interval for every position.'''
+def containing_intervals(intervals, positions):
+	
+	containing = [[] for position in positions]
+	interval_order = sorted(range(len(intervals)), key=lambda index: intervals[index][0])
+	open_intervals = [] #heap of (end, index) of the intervals started at or before the current position
+	next_interval = 0
+	
+	for position_index in sorted(range(len(positions)), key=lambda index: positions[index]):
+		position = positions[position_index]
+		while(next_interval < len(interval_order) and intervals[interval_order[next_interval]][0] <= position):
+			interval_index = interval_order[next_interval]
+			heapq.heappush(open_intervals, (intervals[interval_index][1], interval_index))
+			next_interval += 1
+		while(len(open_intervals) > 0 and open_intervals[0][0] <= position): #positions only increase, so ended intervals are done with
+			heapq.heappop(open_intervals)
+		containing[position_index] = [interval_index for _, interval_index in open_intervals]
+	
+	return containing
+
+'''Groups domain features by the CDS features they're a subsection of: returns a list of lists (one per CDS, in order) of the domains whose start and end
+	are both in the CDS's location, in their original order. This is the same as checking "domain.location.start in feature.location and domain.location.end in feature.location"
+	for every pair, where a position is in a compound (join) location if it's in any of its parts, but it's done with one sweep (see containing_intervals).'''
+def group_domains(CDS, aSDomains):
+	
+	intervals, owners = [], []
+	for CDS_index, feature in enumerate(CDS):
+		for part in feature.location.parts:
+			intervals.append((int(part.start), int(part.end)))
+			owners.append(CDS_index)
+	
+	positions = []
+	for aSDomain in aSDomains:
+		positions += [int(aSDomain.location.start), int(aSDomain.location.end)]
+	containing = containing_intervals(intervals, positions)
+	
+	grouped = [[] for feature in CDS]
+	for domain_index, aSDomain in enumerate(aSDomains):
+		start_owners = set([owners[interval_index] for interval_index in containing[2*domain_index]])
+		end_owners = set([owners[interval_index] for interval_index in containing[2*domain_index+1]])
+		for CDS_index in sorted(start_owners & end_owners):
+			grouped[CDS_index].append(aSDomain)
+	
+	return grouped
+
 '''Parses a single Genbank file in antiSMASH format into a GenbankFile object.'''
 def parse_genbank(path, file):
 	
-	features = SeqIO.read(os.path.join(path, file), "genbank").features
+	features = featureScanner.scan_genbank(os.path.join(path, file), ["aSProdPred", "specificity"]).features
 
 	#find all the features with a non-empty antismash prediction
 	CDS = [feature for feature in features if "aSProdPred" in feature.qualifiers.keys()]
@@ -17,13 +65,7 @@ def parse_genbank(path, file):
 	aSDomains = [feature for feature in features if "specificity" in feature.qualifiers.keys()]
 	
 	#Gives a list of lists, where internal lists contain asDomain predictions, grouped by the CDS they are a subsection of
-	grouped_aSDomains = []
-	for feature in CDS:
-		aSDomainGroup = []
-		for aSDomain in aSDomains:
-			if(aSDomain.location.start in feature.location and aSDomain.location.end in feature.location):
-				aSDomainGroup.append(aSDomain)
-		grouped_aSDomains.append(aSDomainGroup)
+	grouped_aSDomains = group_domains(CDS, aSDomains)
 		
 	gbk_file = []
 	for zipped_CDS, zipped_aSDs in zip(CDS, grouped_aSDomains):
@@ -33,4 +75,23 @@ def parse_genbank(path, file):
 		predictions = [{(" ".join(prediction.split(' ')[:-1])).strip(':') : prediction.split(' ')[-1] for prediction in asD} for asD in zipped_aSDs]
 		gbk_file.append(CDSPrediction(overall_prediction[0], predictions))
 	
-	return GenbankFile(gbk_file)
\ No newline at end of file
+	return GenbankFile(gbk_file)
+
+'''Returns a pair of (a list of the GenbankFiles of the Genbank files in antiSMASH format with the given names in the directory at path, in the same order,
+	with None for any that couldn't be parsed, and a list of tuples of (index into names, error message) of those, as genbankLoading's load_genbanks gives them).
+	Files with an up to date entry in a GenbankCache, if one is given, are taken from it; the rest are parsed by a pool of worker processes (see load_genbanks)
+	and kept in the cache, which is then saved.'''
+def load_genbanks(path, names, cache=None, workers=None):
+	
+	gbk_files = [None if cache is None else cache.get(os.path.join(path, name), "antismash") for name in names]
+	missing = [index for index, gbk_file in enumerate(gbk_files) if gbk_file is None]
+	parsed, failures = genbankLoading.load_genbanks([(path, names[index]) for index in missing], parse_genbank, workers=workers)
+	
+	for index, gbk_file in zip(missing, parsed):
+		gbk_files[index] = gbk_file
+		if(cache is not None and gbk_file is not None):
+			cache.store(os.path.join(path, names[index]), "antismash", gbk_file)
+	if(cache is not None):
+		cache.save()
+	
+	return gbk_files, [(missing[index], error) for index, error in failures]
\ No newline at end of file
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+'''Loads many Genbank files at once with a pool of worker processes, for gbkParser's load_genbanks (used by experiment's get_gbks) and featureCatalog.
+Results always come back in the order the files were given, and a file that can't be parsed (e.g. one SeqIO would reject as malformed)
+is reported as a failure in its place rather than stopping the whole load.'''
+
+#Default number of files sent to a worker process at a time
+DEFAULT_CHUNKSIZE = 4
+
+#############
+###Workers###
+#############
+
+'''Calls parse with a tuple of arguments, given as one tuple (parse function, arguments), and returns a pair of (result, None),
+	or (None, error message) if it raised an exception. This needs to be at module level so that it can be sent to a pool of worker processes.'''
+def parse_arguments(task):
+	parse, arguments = task
+	try:
+		return parse(*arguments), None
+	except Exception as e:
+		return None, "%s: %s" % (type(e).__name__, e)
+
+#####################
+###Loading Methods###
+#####################
+
+'''Returns a pair of (a list of the results of parse(*arguments) for every tuple of arguments, in the same order, with None for any that failed,
+	and a list of tuples of (index into arguments, error message) of the ones that failed), where parse is a module-level function such as gbkParser's parse_genbank
+	or featureScanner's scan_genbank. Files are parsed by a pool of worker processes (os.cpu_count() of them if workers is None),
+	or one after another in this process if workers is 1 (or there's only one file).'''
+def load_genbanks(arguments, parse, workers=None, chunksize=DEFAULT_CHUNKSIZE):
+	
+	arguments = list(arguments)
+	workers = (os.cpu_count() or 1) if workers is None else max(workers, 1)
+	tasks = [(parse, task_arguments) for task_arguments in arguments]
+	
+	if(workers == 1 or len(tasks) < 2):
+		loaded = [parse_arguments(task) for task in tasks]
+	else:
+		with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+			loaded = list(pool.map(parse_arguments, tasks, chunksize=chunksize))
+	
+	results = [result for result, error in loaded]
+	failures = [(index, error) for index, (result, error) in enumerate(loaded) if error is not None]
+	return results, failures
+
+'''Prints a line for every failure given by load_genbanks, naming the file with the name at the same index in names.'''
+def report_failures(names, failures):
+	for index, error in failures:
+		print("Couldn't load %s (%s)" % (names[index], error))
@@ -1,6 +1,6 @@
-from Bio import SeqIO
 import os
 
+from . import featureScanner
 from .CDSPrediction import CDSPrediction
 from .GenbankFile import GenbankFile
 
@@ -9,7 +9,7 @@ from .aanames import AA_names
 def parse_genbank(path, filename):
 				
 	#collect all CDS predictions
-	CDS = [feature.qualifiers["product"] for feature in SeqIO.read(os.path.join(path, filename), "genbank").features if "product" in feature.qualifiers.keys()]
+	CDS = [feature.qualifiers["product"] for feature in featureScanner.scan_genbank(os.path.join(path, filename), ["product"]).features if "product" in feature.qualifiers.keys()]
 	#filter the ones with amino acids
 	CDS = [[AA_names[AA] for AA in AA_names if (AA in product)] for product in CDS]
 	
@@ -1,11 +1,24 @@
+import os
+import io
 import random
+import shutil
+import tempfile
 import itertools
 from collections import Counter
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from Bio.SeqFeature import SeqFeature, SimpleLocation, CompoundLocation
 
 from .aanames import AA_alphabet
 
 from .CDSPrediction import CDSPrediction
 from .GenbankFile import GenbankFile
+from . import gbkParser
+from . import featureScanner
+from . import genbankLoading
+from . import featureCatalog
+from .GenbankCache import GenbankCache
 
 '''Helper to generate a list of lists of random components.'''
 def generate_comp_lists(alphabet):
@@ -56,7 +69,249 @@ def test_unique_components(alphabet=AA_alphabet):
 	file = GenbankFile(preds)
 	assert set(file.unique_components()) == set(itertools.chain.from_iterable(uniques)), "GenbankFile's unique_components doesn't match components of pregenerated predictions!"
 
+'''Helper to generate a random location, joined from up to three parts.'''
+def generate_location(length):
+	parts = []
+	for part in range(random.randint(1, 3)):
+		start = random.randint(0, length)
+		parts.append(SimpleLocation(start, start + random.randint(0, 50), strand=1))
+	return parts[0] if len(parts) == 1 else CompoundLocation(parts)
+
+def test_domain_assignment():
+	
+	for trial in range(20):
+		length = random.randint(50, 2000)
+		CDS = [SeqFeature(generate_location(length), type="CDS") for number in range(random.randint(0, 40))]
+		aSDomains = [SeqFeature(generate_location(length), type="aSDomain") for number in range(random.randint(0, 80))]
+		
+		expected = [[aSDomain for aSDomain in aSDomains if aSDomain.location.start in feature.location and aSDomain.location.end in feature.location] for feature in CDS]
+		grouped = gbkParser.group_domains(CDS, aSDomains)
+		assert len(grouped) == len(expected), "group_domains doesn't give one group per CDS!"
+		for group, expected_group in zip(grouped, expected):
+			assert [id(aSDomain) for aSDomain in group] == [id(aSDomain) for aSDomain in expected_group], "group_domains doesn't match checking every CDS against every domain!"
+	
+	intervals, positions = [(0, 10), (5, 15), (20, 30)], [10, 0, 25, 30, 5]
+	assert [sorted(c) for c in gbkParser.containing_intervals(intervals, positions)] == [[1], [0], [2], [], [0, 1]], "containing_intervals doesn't treat intervals as half-open!"
+
+'''Helper to generate an antiSMASH-like SeqRecord, with CDS features holding aSProdPred predictions and aSDomain features holding specificities.'''
+def generate_antismash_record(length=3000, alphabet=AA_alphabet):
+	
+	record = SeqRecord(Seq("".join(random.choice("ACGT") for base in range(length))), id="generated", name="generated", annotations={"molecule_type" : "DNA"})
+	record.features.append(SeqFeature(SimpleLocation(0, length, strand=1), type="cluster", qualifiers={"product" : ["nrps"], "note" : ["Cluster number: 1"]}))
+	for number in range(random.randint(5, 15)):
+		prediction = "-".join(random.choice(list(alphabet)) for component in range(random.randint(0, 6)))
+		record.features.append(SeqFeature(generate_location(length - 60), type="CDS",
+									qualifiers={"aSProdPred" : [prediction], "product" : ["generated peptide synthetase " * random.randint(1, 4)], "translation" : ["M" * random.randint(50, 200)]}))
+	for number in range(random.randint(10, 30)):
+		specificities = ["%s: %s" % (random.choice(["NRPSpredictor2 SVM", "Stachelhaus code", "Minowa"]), random.choice(list(alphabet))) for method in range(3)]
+		record.features.append(SeqFeature(generate_location(length - 60), type="aSDomain", qualifiers={"specificity" : specificities, "domain" : ["AMP-binding"]}))
+	return record
+
+def test_feature_scanner():
+	
+	record = generate_antismash_record()
+	text = io.StringIO()
+	SeqIO.write(record, text, "genbank")
+	text = text.getvalue()
+	
+	expected = SeqIO.read(io.StringIO(text), "genbank")
+	scanned = featureScanner.scan_file(io.StringIO(text), featureScanner.DEFAULT_QUALIFIERS + ["translation"])
+	assert len(scanned.features) == len(expected.features), "Scanner doesn't find the same features as SeqIO!"
+	for feature, expected_feature in zip(scanned.features, expected.features):
+		assert feature.type == expected_feature.type, "Scanned feature type doesn't match SeqIO's!"
+		assert str(feature.location) == str(expected_feature.location), "Scanned feature location doesn't match SeqIO's!"
+		assert feature.qualifiers == {name : values for name, values in expected_feature.qualifiers.items() if name in featureScanner.DEFAULT_QUALIFIERS + ["translation"]}, "Scanned qualifiers don't match SeqIO's!"
+	
+	#the scanner stops at ORIGIN, so it never looks at the sequence
+	truncated = text[:text.index("ORIGIN")] + "ORIGIN\n        1 not a sequence"
+	assert len(featureScanner.scan_file(io.StringIO(truncated)).features) == len(expected.features), "Scanner reads past ORIGIN!"
+	
+	lines = ["LOCUS       test     100 bp    DNA     linear   UNK 01-JAN-1980", "FEATURES             Location/Qualifiers",
+				"     CDS             join(1..10,", "                     20..30)", "                     /pseudo", "                     /product=\"a \"\"quoted\"\"",
+				"                     product\"", "                     /aSProdPred=ser-thr", "ORIGIN"]
+	feature = featureScanner.scan_file(lines, ["pseudo", "product", "aSProdPred"]).features[0]
+	assert feature.location.parts[1].start == 19, "Scanner doesn't join wrapped locations!"
+	assert feature.qualifiers == {"pseudo" : [""], "product" : ['a "quoted" product'], "aSProdPred" : ["ser-thr"]}, "Scanner doesn't read qualifiers as SeqIO does!"
+	
+	directory = tempfile.mkdtemp()
+	try:
+		SeqIO.write(record, os.path.join(directory, "generated.gbk"), "genbank")
+		parsed = gbkParser.parse_genbank(directory, "generated.gbk")
+		CDS = [feature for feature in record.features if feature.qualifiers.get("aSProdPred", [""])[0] != ""]
+		aSDomains = [feature for feature in record.features if "specificity" in feature.qualifiers]
+		assert [prediction.overall_prediction for prediction in parsed.predictions] == [feature.qualifiers["aSProdPred"][0] for feature in CDS], "parse_genbank doesn't find the CDS predictions!"
+		for prediction, group in zip(parsed.predictions, gbkParser.group_domains(CDS, aSDomains)):
+			assert len(prediction.predictions) == len(group), "parse_genbank doesn't group the domains!"
+	finally:
+		shutil.rmtree(directory)
+
+'''Helper to check that the scanner reads every feature of a GenBank file's text (with every qualifier asked for) exactly as SeqIO does.'''
+def verify_scanned(text):
+	
+	expected = SeqIO.read(io.StringIO(text), "genbank")
+	names = set([name for feature in expected.features for name in feature.qualifiers])
+	scanned = featureScanner.scan_file(io.StringIO(text), names)
+	#locations are compared as strings, as fuzzy positions are equal to exact ones
+	return (scanned.name == expected.name and len(scanned.features) == len(expected.features)
+				and all([feature.type == expected_feature.type and str(feature.location) == str(expected_feature.location) and feature.qualifiers == dict(expected_feature.qualifiers)
+							for feature, expected_feature in zip(scanned.features, expected.features)]))
+
+'''Tests the scanner against SeqIO on handwritten files covering the parts of the format the generated ones don't:
+	joined and complemented locations (including ones wrapped over lines and spanning the origin of a circular record), fuzzy positions,
+	qualifiers spread over several lines, and records without any features.'''
+def test_feature_scanner_equivalence():
+	
+	record = SeqRecord(Seq("acgt" * 25), id="test", name="test", description="test", annotations={"molecule_type" : "DNA", "topology" : "circular"})
+	text = io.StringIO()
+	SeqIO.write(record, text, "genbank")
+	header, sequence = text.getvalue().split("FEATURES             Location/Qualifiers\n")
+	
+	def with_features(lines):
+		return header + "FEATURES             Location/Qualifiers\n" + "".join([line + "\n" for line in lines]) + sequence
+		
+	locations = ["     CDS             join(1..10,20..30)", "     CDS             complement(40..50)", "     CDS             complement(join(1..10,20..30))",
+					"     CDS             join(complement(40..50),complement(30..35))", "     misc_feature    order(1..5,10..15)", "     CDS             join(90..100,1..10)",
+					"     CDS             join(1..10,20..30,", "                     40..50,60..70)", "     CDS             complement(join(1..10,", "                     20..30))"]
+	assert verify_scanned(with_features(locations)), "Scanner doesn't read joined and complemented locations as SeqIO does!"
+	
+	fuzzy = ["     CDS             <1..>50", "     CDS             <5..100", "     CDS             1..>30", "     CDS             complement(<10..>20)",
+				"     CDS             join(<1..10,20..>30)", "     misc_feature    45", "     misc_feature    10^11"]
+	assert verify_scanned(with_features(fuzzy)), "Scanner doesn't read fuzzy positions as SeqIO does!"
+	
+	qualifiers = ["     CDS             1..30", "                     /product=\"a product whose name is much too long to fit on one", "                     line of the file\"",
+					"                     /note=\"a \"\"quoted\"\" word", "                     \"\"across\"\" lines\"", "                     /translation=\"MSTNPKPQRKTKRNTNRRPQDVKFPGG",
+					"                     MSTNPKPQRK\"", "                     /codon_start=1", "                     /pseudo", "                     /product=\"a second product\"",
+					"                     /note=\"\"", "     misc_feature    40..50", "                     /note=\"last feature, right before the sequence\""]
+	assert verify_scanned(with_features(qualifiers)), "Scanner doesn't read qualifiers over several lines as SeqIO does!"
+	
+	assert verify_scanned(with_features([])), "Scanner doesn't read a record with an empty feature table as SeqIO does!"
+	assert verify_scanned(header + sequence), "Scanner doesn't read a record without a feature table as SeqIO does!"
+
+def test_genbank_cache():
+	
+	directory = tempfile.mkdtemp()
+	try:
+		SeqIO.write(generate_antismash_record(), os.path.join(directory, "generated.gbk"), "genbank")
+		parsed = gbkParser.parse_genbank(directory, "generated.gbk")
+		contents = GenbankCache.pack(parsed)
+		
+		cache = GenbankCache(os.path.join(directory, "cache", "genbank.cache"))
+		parses = []
+		def parse():
+			parses.append(1)
+			return gbkParser.parse_genbank(directory, "generated.gbk")
+		assert GenbankCache.pack(cache.load(os.path.join(directory, "generated.gbk"), "antismash", parse)) == contents, "Cache doesn't give the parsed file on a cold load!"
+		assert GenbankCache.pack(cache.load(os.path.join(directory, "generated.gbk"), "antismash", parse)) == contents, "Cache doesn't give the parsed file on a warm load!"
+		assert len(parses) == 1, "Cache parses a file it already has!"
+		cache.save()
+		
+		cache = GenbankCache(cache.path)
+		assert len(cache) == 1, "Cache file doesn't keep its entries!"
+		gbk_files, failures = gbkParser.load_genbanks(directory, ["generated.gbk", "missing.gbk"], cache=cache, workers=1)
+		assert GenbankCache.pack(gbk_files[0]) == contents and len(cache) == 1, "Cache file doesn't give the parsed file!"
+		assert gbk_files[1] is None and [index for index, error in failures] == [1], "load_genbanks doesn't report files that can't be parsed in their place!"
+		assert not cache.changed, "Cache changes on a warm load!"
+		
+		SeqIO.write(generate_antismash_record(), os.path.join(directory, "generated.gbk"), "genbank")
+		os.utime(os.path.join(directory, "generated.gbk"), ns=(0, 0)) #the new file may be written within the same tick as the old one
+		gbk_files, failures = gbkParser.load_genbanks(directory, ["generated.gbk"], cache=cache, workers=1)
+		assert GenbankCache.pack(gbk_files[0]) == GenbankCache.pack(gbkParser.parse_genbank(directory, "generated.gbk")), "Cache doesn't replace stale entries!"
+		assert GenbankCache(cache.path).entries == cache.entries and not cache.changed, "load_genbanks doesn't save the replaced entry!"
+		
+		cache.clear()
+		assert len(cache) == 0 and not os.path.exists(cache.path), "Cache isn't cleared!"
+	finally:
+		shutil.rmtree(directory)
+
+def test_parallel_loading():
+	
+	directory = tempfile.mkdtemp()
+	try:
+		names = ["generated%d.gbk" % number for number in range(6)]
+		for name in names:
+			SeqIO.write(generate_antismash_record(), os.path.join(directory, name), "genbank")
+		with open(os.path.join(directory, "malformed.gbk"), 'w') as file:
+			file.write("LOCUS       malformed     100 bp    DNA\nFEATURES             Location/Qualifiers\n     CDS             1..10\n")
+		names = names[:3] + ["malformed.gbk", "missing.gbk"] + names[3:]
+		
+		expected = [GenbankCache.pack(gbkParser.parse_genbank(directory, name)) for name in names if name.startswith("generated")]
+		for workers in [1, 3]:
+			results, failures = genbankLoading.load_genbanks([(directory, name) for name in names], gbkParser.parse_genbank, workers=workers, chunksize=2)
+			assert len(results) == len(names), "load_genbanks doesn't give a result for every file!"
+			assert [index for index, error in failures] == [3, 4], "load_genbanks doesn't report the files it can't parse!"
+			assert results[3] is None and results[4] is None, "load_genbanks gives results for files it can't parse!"
+			assert [GenbankCache.pack(result) for result in results if result is not None] == expected, "load_genbanks doesn't give the parsed files in order!"
+		
+		records, failures = genbankLoading.load_genbanks([(os.path.join(directory, name),) for name in names], featureScanner.scan_genbank, workers=2)
+		assert [index for index, error in failures] == [3, 4], "load_genbanks doesn't report the files the scanner can't read!"
+		assert [len(record.features) for record in records if record is not None] == [len(featureScanner.scan_genbank(os.path.join(directory, name)).features) for name in names if name.startswith("generated")], "load_genbanks doesn't give the scanned files in order!"
+	finally:
+		shutil.rmtree(directory)
+
+def test_feature_catalog():
+	
+	directory = tempfile.mkdtemp()
+	try:
+		records = [generate_antismash_record() for number in range(5)]
+		records[1].features[0].qualifiers["product"] = ["lantipeptide"]
+		records[1].features.append(SeqFeature(SimpleLocation(10, 100, strand=1), type="PFAM_domain", qualifiers={"domain" : ["LANC_like"]}))
+		records[2].features.append(SeqFeature(SimpleLocation(10, 100, strand=1), type="cluster", qualifiers={"product" : ["t1pks"]}))
+		records[3].features.append(SeqFeature(SimpleLocation(10, 100, strand=1), type="cluster", qualifiers={}))
+		paths = [os.path.join(directory, "generated%d.gbk" % number) for number in range(len(records))]
+		for record, path in zip(records, paths):
+			SeqIO.write(record, path, "genbank")
+		
+		for record in records:
+			record = SeqIO.read(io.StringIO(record.format("genbank")), "genbank")
+			clusters = [feature for feature in record.features if feature.type == "cluster"]
+			predictions = [feature.qualifiers["aSProdPred"][0] for feature in record.features if "aSProdPred" in feature.qualifiers]
+			expected = {"clusters" : len(clusters), "product_class" : "/".join(sorted(set([feature.qualifiers["product"][0] for feature in clusters if "product" in feature.qualifiers]))),
+							"prediction_length" : sum([(prediction.count("-") + 1 if prediction.strip() != "" else 0) for prediction in predictions]),
+							"lanclike" : any(["lanc_like" in [domain.lower() for domain in feature.qualifiers.get("domain", [])] for feature in record.features]),
+							"missing_product" : any([not "product" in feature.qualifiers for feature in clusters])}
+			assert featureCatalog.summarise(record) == expected, "summarise doesn't match checking each property separately!"
+		
+		with open(os.path.join(directory, "malformed.gbk"), 'w') as file:
+			file.write("LOCUS       malformed     100 bp    DNA\nFEATURES             Location/Qualifiers\n")
+		catalog_path = os.path.join(directory, "catalog.tsv")
+		rows = featureCatalog.update_catalog(paths + [os.path.join(directory, "malformed.gbk")], catalog_path, workers=2)
+		assert [row["name"] for row in rows] == [os.path.basename(path) for path in paths], "Catalog doesn't keep the files it can scan in order!"
+		assert [{column : row[column] for column in featureCatalog.COLUMNS[3:-1]} for row in rows] == [featureCatalog.summarise_file(path) for path in paths], "Catalog rows don't match the files' summaries!"
+		saved = featureCatalog.read_catalog(catalog_path)
+		assert list(saved.values())[:-1] == rows and saved["malformed.gbk"]["error"] != "", "Saved catalog doesn't match its rows and failures!"
+		
+		saved_time = os.stat(catalog_path).st_mtime_ns
+		summarise_file = featureCatalog.summarise_file
+		featureCatalog.summarise_file = None #anything scanned again fails
+		try:
+			assert featureCatalog.update_catalog(paths + [os.path.join(directory, "malformed.gbk")], catalog_path, workers=1) == rows, "Catalog changes when its files haven't!"
+		finally:
+			featureCatalog.summarise_file = summarise_file
+		assert os.stat(catalog_path).st_mtime_ns == saved_time, "Catalog is saved again when its files haven't changed!"
+		
+		try:
+			featureCatalog.write_catalog(catalog_path, rows + [{"name" : "unfinished.gbk"}])
+			assert False, "write_catalog accepts a row without every column!"
+		except KeyError:
+			pass
+		assert featureCatalog.read_catalog(catalog_path) == saved, "write_catalog changes the catalog when it fails!"
+		assert not any([name.endswith(".tmp") for name in os.listdir(directory)]), "write_catalog leaves a temporary file behind when it fails!"
+		
+		SeqIO.write(records[1], paths[0], "genbank")
+		os.utime(paths[0], ns=(0, 0))
+		rows = featureCatalog.update_catalog(paths, catalog_path, workers=1)
+		assert rows[0]["product_class"] == "lantipeptide" and rows[0]["mtime_ns"] == 0, "Catalog doesn't update rows of changed files!"
+		assert featureCatalog.select(rows, lambda row: row["lanclike"]) == ["generated0.gbk", "generated1.gbk"], "select doesn't filter the catalog!"
+	finally:
+		shutil.rmtree(directory)
+
 def tests():
 	test_decompose_tag()
 	test_component_counts()
-	test_unique_components()
\ No newline at end of file
+	test_unique_components()
+	test_domain_assignment()
+	test_feature_scanner()
+	test_feature_scanner_equivalence()
+	test_genbank_cache()
+	test_parallel_loading()
+	test_feature_catalog()
\ No newline at end of file
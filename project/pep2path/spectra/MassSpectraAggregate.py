@@ -1,6 +1,41 @@
+import itertools
+import multiprocessing
+import numpy as np
+from collections import defaultdict
+
+from .MassSpectrum import MassSpectrum
 from .Tag import Tag
 from .SpectrumTags import SpectrumTags
+from .PeakStore import PeakStore
+from .ToleranceSweep import ToleranceSweep
+from .SpectrumView import SpectrumView
+
+'''Calls the named method of a spectrum with a dictionary of keyword arguments, given as one tuple (spectrum, method name, keyword arguments), and returns the result.
+	This needs to be at module level so that MassSpectraAggregate can send it to a pool of worker processes.'''
+def search_spectrum(arguments):
+	spectrum, method, kwargs = arguments
+	return getattr(spectrum, method)(**kwargs)
+	
+'''Calls the named tag search method (e.g. "find_sequence_tags") of each spectrum from an iterable of them (like mgfParser's iter_mgf) with the given keyword arguments,
+	yielding the results in the order of the spectra as they're found. Unlike a MassSpectraAggregate, the spectra never all have to be held in memory at once,
+	so files larger than memory can be searched as they're read. If workers is more than 1, spectra are taken workers * chunksize at a time and searched 
+	over a pool of that many processes, so only that many are held at once.'''
+def iter_search_results(spectra, method, workers=1, chunksize=1, **kwargs):
 
+	if(workers is None or workers <= 1):
+		for spectrum in spectra:
+			yield search_spectrum((spectrum, method, kwargs))
+		return
+		
+	spectra = iter(spectra)
+	with multiprocessing.Pool(processes=workers) as pool:
+		while(True):
+			batch = [(spectrum, method, kwargs) for spectrum in itertools.islice(spectra, workers * chunksize)]
+			if(len(batch) < 1):
+				return
+			for result in pool.map(search_spectrum, batch, chunksize=chunksize):
+				yield result
+	
 '''A wrapper class to make multiple operations on MassSpectra easier and with the use of less boilerplate.
 	It is NOT a guarantee of more efficiency, it's just a convenience.
 	Functions have both local and global variants, where 'local' performs the operation on each file individually whereas 'global' applies it to all
@@ -8,8 +43,113 @@ from .SpectrumTags import SpectrumTags
 class MassSpectraAggregate():
 
 	def __init__(self, spectra):
-		#List (or other iterable) containing spectra objects
-		self.spectra = spectra
+		#List containing spectra objects (any other iterable given is read into one, as the spectra are gone through more than once)
+		self.spectra = list(spectra)
+		#PeakStore holding the readings of every spectrum, if share_peaks or use_columns has been called
+		self.peak_store = None
+		
+		self.share_mass_table_indices()
+		
+	'''Gives every spectrum with the same mass table the same MassTableIndex, so tolerance windows that don't depend on the spectrum
+		are only worked out once for all of them (rather than once per spectrum). This is done when the aggregate is created.'''
+	def share_mass_table_indices(self):
+		mass_table_indices = {}
+		for spectrum in self.spectra:
+			if(id(spectrum.mass_table) not in mass_table_indices):
+				mass_table_indices[id(spectrum.mass_table)] = spectrum.get_mass_table_index()
+			spectrum.mass_table_index = mass_table_indices[id(spectrum.mass_table)]
+		
+	'''Moves the readings of every spectrum into one PeakStore (a shared memory block, or a memory-mapped file if shared memory isn't available),
+		with each spectrum's ms2peaks becoming a view of it. After this, spectra sent to worker processes (e.g. by find_sequence_tags with workers) 
+		only send a reference to the block, and the workers read the readings straight out of it rather than each getting a copy.
+		Operations that replace the readings of a spectrum (like sorting or filtering) give it its own copy again, so do those first.
+		
+		Returns the PeakStore. Call unshare_peaks when you're done with it to free it.'''
+	def share_peaks(self, use_shared_memory=True):
+		self.__check_not_branch("share_peaks")
+		return self.__use_peak_store(PeakStore.from_arrays([spectrum.ms2peaks for spectrum in self.spectra], use_shared_memory=use_shared_memory))
+		
+	'''Moves the readings of every spectrum into one PeakStore in ordinary memory (all the readings in one array, with the offsets where each spectrum's start),
+		with each spectrum's ms2peaks becoming a view of it, like share_peaks but without sharing them.
+		While every spectrum's readings are still its view of the aggregate's store, the local and global maxima, filters, sort_by_mass and normalise_intensity_global
+		are each done as a few NumPy calls over all the readings at once rather than spectrum by spectrum, and keep the readings in a store (this also applies after share_peaks).
+		Otherwise they work spectrum by spectrum as usual.
+		
+		Returns the PeakStore.'''
+	def use_columns(self):
+		self.__check_not_branch("use_columns")
+		return self.__use_peak_store(PeakStore.from_arrays([spectrum.ms2peaks for spectrum in self.spectra], in_memory=True))
+		
+	'''Helper to raise a ValueError if any of our spectra are SpectrumViews, whose readings can't be moved into a PeakStore (only the spectra they view can).'''
+	def __check_not_branch(self, method):
+		if(any(isinstance(spectrum, SpectrumView) for spectrum in self.spectra)):
+			raise ValueError("%s can't be used on an aggregate of SpectrumViews (see branch), call it on the aggregate they were branched from instead!" % method)
+		
+	'''Helper to make the given PeakStore the aggregate's, with each spectrum's readings as a view of it.'''
+	def __use_peak_store(self, peak_store):
+		for index, spectrum in enumerate(self.spectra):
+			spectrum.use_peak_store(peak_store, index)
+		self.peak_store = peak_store
+		return peak_store
+		
+	'''Helper to check whether the readings of every spectrum are still its view of the aggregate's PeakStore (so operations can be done over the store as a whole).'''
+	def __is_columnar(self):
+		peak_store = self.peak_store
+		if(peak_store is None or peak_store.readings is None or peak_store.number_of_spectra() != len(self.spectra)):
+			return False
+		return all(spectrum.peak_store is peak_store and spectrum.peak_store_index == index and peak_store.holds(index, spectrum.ms2peaks) for index, spectrum in enumerate(self.spectra))
+		
+	'''Helper to replace the aggregate's PeakStore with a new one of the same kind holding the given readings and offsets, moving every spectrum on to it.'''
+	def __replace_columns(self, readings, offsets):
+		old_store = self.peak_store
+		self.__use_peak_store(PeakStore.from_readings(readings, offsets, use_shared_memory=old_store.use_shared_memory, in_memory=not old_store.is_shared()))
+		old_store.unlink()
+		
+	'''Helper to return a list of the maximum of a column of the readings of each spectrum in one call over the aggregate's PeakStore, 
+		or None if that can't be done (because the readings aren't columnar, or a spectrum has no readings).'''
+	def __column_maxima(self, column):
+		if(not self.__is_columnar() or np.any(self.peak_store.counts() == 0) or len(self.spectra) < 1):
+			return None
+		return np.maximum.reduceat(self.peak_store.readings[:, column], self.peak_store.offsets[:-1]).tolist()
+		
+	'''Helper to rearrange the readings of the aggregate's PeakStore, given the (global) indices of the readings to keep in their new order and 
+		the index of the spectrum each belongs to (which must be in ascending order), updating the mappings of every spectrum.'''
+	def __rearrange_columns(self, kept, segments):
+		peak_store = self.peak_store
+		offsets = np.zeros(len(self.spectra) + 1, dtype=np.int64)
+		offsets[1:] = np.cumsum(np.bincount(segments, minlength=len(self.spectra)))
+		local_indices = kept - peak_store.offsets[segments]
+		for index, spectrum in enumerate(self.spectra):
+			spectrum.update_mappings(local_indices[offsets[index]:offsets[index+1]])
+		self.__replace_columns(peak_store.readings[kept], offsets)
+		
+	'''Helper to filter the readings of every spectrum in the aggregate's PeakStore against an array of thresholds (one per spectrum) in one go.'''
+	def __filter_columns(self, intensity_thresholds):
+		segments = self.peak_store.segment_ids()
+		kept, = (self.peak_store.readings[:, MassSpectrum.INTENSITY] > intensity_thresholds[segments]).nonzero()
+		self.__rearrange_columns(kept, segments[kept])
+		
+	'''Gives every spectrum that's using a PeakStore its own copy of its readings back, and frees the stores.'''
+	def unshare_peaks(self):
+		self.__check_not_branch("unshare_peaks")
+		peak_stores = [] if self.peak_store is None else [self.peak_store]
+		self.peak_store = None
+		for spectrum in self.spectra:
+			if(spectrum.peak_store is not None):
+				if(spectrum.peak_store.holds(spectrum.peak_store_index, spectrum.ms2peaks)):
+					spectrum.ms2peaks = np.array(spectrum.ms2peaks)
+				if(not any([spectrum.peak_store is peak_store for peak_store in peak_stores])):
+					peak_stores.append(spectrum.peak_store)
+				spectrum.peak_store, spectrum.peak_store_index = None, None
+		for peak_store in peak_stores:
+			peak_store.unlink()
+			
+	'''Returns a new aggregate of SpectrumViews of our spectra (or branches of them, if they're views already), whose filters, sorts and normalisations
+		are only recorded rather than changing the readings of the spectra (see SpectrumView). The readings are only materialised when tags are searched for,
+		so several sets of parameters can be branched off one parsed library without copying it. 
+		Call share_peaks (or use_columns) on this aggregate, not the branches, if you want them.'''
+	def branch(self):
+		return MassSpectraAggregate([spectrum.branch() if isinstance(spectrum, SpectrumView) else SpectrumView(spectrum) for spectrum in self.spectra])
 		
 	'''Returns a list of spectra ids for the spectra in the order that they're held.
 		You can use this to find out which spectrum a result was generated from.'''
@@ -28,7 +168,8 @@ class MassSpectraAggregate():
 	
 	'''Returns a list of the maximum masses in each spectrum.'''
 	def max_mass_local(self):
-		return [spectrum.max_mass() for spectrum in self.spectra]
+		masses = self.__column_maxima(MassSpectrum.MASS)
+		return masses if masses is not None else [spectrum.max_mass() for spectrum in self.spectra]
 		
 	'''Returns the maximum mass across all spectra.'''
 	def max_mass_global(self):
@@ -37,7 +178,8 @@ class MassSpectraAggregate():
 	
 	'''Returns a list of the maximum intensities across all spectra.'''
 	def max_intensity_local(self):
-		return [spectrum.max_intensity() for spectrum in self.spectra]
+		intensities = self.__column_maxima(MassSpectrum.INTENSITY)
+		return intensities if intensities is not None else [spectrum.max_intensity() for spectrum in self.spectra]
 		
 	'''Returns the maximum intensity across all spectra.'''
 	def max_intensity_global(self):
@@ -46,13 +188,23 @@ class MassSpectraAggregate():
 		
 	'''Sorts all spectra by mass.'''
 	def sort_by_mass(self):
+		if(self.__is_columnar()):
+			segments = self.peak_store.segment_ids()
+			order = np.lexsort((self.peak_store.readings[:, MassSpectrum.MASS], segments))
+			self.__rearrange_columns(order, segments) #the spectrum of each reading is unchanged by the sort
+			return
 		for spectrum in self.spectra:
 			spectrum.sort_by_mass()
 		
 	'''Takes a list of intensity thresholds, and filters the intensity of each item in spectra by the corresponding item in the list.
 		Default is deferred to spectrum class.'''
 	def filter_intensity_local(self, intensity_thresholds=None):
-		intensity_thresholds = [None for spectrum in spectra] if intensity_thresholds is None else intensity_thresholds
+		intensity_thresholds = [None for spectrum in self.spectra] if intensity_thresholds is None else intensity_thresholds
+		if(self.__is_columnar() and len(intensity_thresholds) == len(self.spectra)):
+			if(any(threshold is None for threshold in intensity_thresholds)):
+				intensity_thresholds = [0.05 * maxm if threshold is None else threshold for threshold, maxm in zip(intensity_thresholds, self.max_intensity_local())]
+			self.__filter_columns(np.array(intensity_thresholds, dtype=np.float64))
+			return
 		for spectrum, threshold in zip(self.spectra, intensity_thresholds):
 			spectrum.filter_intensity(intensity_threshold=threshold)
 		
@@ -60,33 +212,116 @@ class MassSpectraAggregate():
 		Default is 5% of the maximum intensity across all spectra.'''
 	def filter_intensity_global(self, intensity_threshold=None):
 		intensity_threshold = 0.05 * self.max_intensity_global() if intensity_threshold is None else intensity_threshold
+		if(self.__is_columnar()):
+			self.__filter_columns(np.full(len(self.spectra), intensity_threshold, dtype=np.float64))
+			return
 		for spectrum in self.spectra:
 			spectrum.filter_intensity(intensity_threshold=intensity_threshold)
 	
 	'''Takes a list of new maximum intensities, and normalises each spectrum to the corresponding item in the list.
 		Default is deferred to the spectrum class.'''
 	def normalise_intensity_local(self, new_maxes=None):
-		new_maxes = [None for spectrum in spectra] if new_maxes is None else new_maxes
+		new_maxes = [None for spectrum in self.spectra] if new_maxes is None else new_maxes
 		for spectrum, maxm in zip(self.spectra, new_maxes):
 			spectrum.normalise_intensity(new_max=maxm)
 	
 	'''Takes a new maximum intensity, and normalises all spectra according to it.
-		Default is deferred to the spectrum class.'''
-	def normalise_intensity_global(self, new_max=None):
+		All intensities are rescaled together in one NumPy pass (see MassSpectrum's scale_intensities, which exact is passed to).
+		Default is 100, the same as the spectrum class.'''
+	def normalise_intensity_global(self, new_max=None, exact=False):
+	
+		new_max = 100 if new_max is None else new_max #default value
+		spectra = [spectrum for spectrum in self.spectra if spectrum.peak_count() > 0]
+		if(len(spectra) < 1):
+			return
+			
 		old_max = self.max_intensity_global()
-		for spectrum in self.spectra:
-			spectrum.normalise_intensity(new_max=new_max, old_max=old_max)
+		for spectrum in [spectrum for spectrum in spectra if isinstance(spectrum, SpectrumView)]: #views only record the rescale
+			spectrum.normalise_intensity(new_max=new_max, old_max=old_max, exact=exact)
+		spectra = [spectrum for spectrum in spectra if not isinstance(spectrum, SpectrumView)]
+		if(len(spectra) < 1):
+			return
+		if(self.__is_columnar()): #every spectrum's readings are a view of the store, so they can just be rescaled in place
+			self.peak_store.readings[:, MassSpectrum.INTENSITY] = MassSpectrum.scale_intensities(self.peak_store.readings[:, MassSpectrum.INTENSITY], new_max, old_max, exact=exact)
+			return
+		intensities = MassSpectrum.scale_intensities(np.concatenate([spectrum.ms2peaks[:, MassSpectrum.INTENSITY] for spectrum in spectra]), new_max, old_max, exact=exact)
 		
+		for spectrum, spectrum_intensities in zip(spectra, np.split(intensities, np.cumsum([spectrum.peak_count() for spectrum in spectra])[:-1])):
+			spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = spectrum_intensities
+		
+	'''Helper to call the named tag search method of every spectrum with the given keyword arguments, returning a list of the results in the order of the spectra.
+		If workers is more than 1, the spectra are spread over a pool of that many processes, in chunks of chunksize spectra
+		(by default multiprocessing picks a chunk size that gives each worker a few chunks).'''
+	def __search_spectra(self, method, kwargs, workers, chunksize):
+		if(workers is None or workers <= 1):
+			return [search_spectrum((spectrum, method, kwargs)) for spectrum in self.spectra]
+		with multiprocessing.Pool(processes=workers) as pool:
+			return pool.map(search_spectrum, [(spectrum, method, kwargs) for spectrum in self.spectra], chunksize=chunksize)
+			
 	'''Returns a list of SpectrumTags, containing the sequence tags for each spectrum.
-		Defers mass_tolerance_mode default to the spectrum class, but the default value for the mass threshold is defined here as (10^(-5))
-		(10ppm with ppm mode).'''
-	def find_sequence_tags(self, mass_tolerance_mode=None, mass_threshold=0.00001):
-		return [spectrum.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold) for spectrum in self.spectra]
+		Defers mass_tolerance_mode and edge_mode defaults to the spectrum class, but the default value for the mass threshold is defined here as (10^(-5))
+		(10ppm with ppm mode).
+		
+		Each spectrum is independent, so with workers more than 1 they're searched in parallel over a process pool (see __search_spectra), 
+		with the results still in the order of the spectra. time_budget is the number of seconds each spectrum's search may take (see MassSpectrum's find_sequence_tags),
+		so that one pathological spectrum can't hold up the rest; any spectrum that runs out of time has complete set to False in its SpectrumTags.'''
+	def find_sequence_tags(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1, workers=1, chunksize=None, time_budget=None):
+		kwargs = {"mass_tolerance_mode" : mass_tolerance_mode, "mass_threshold" : mass_threshold, "edge_mode" : edge_mode, "max_residues" : max_residues, "time_budget" : time_budget}
+		return self.__search_spectra("find_sequence_tags", kwargs, workers, chunksize)
+		
+	'''Returns a generator of pairs of spectrum ids and generators of that spectrum's sequence tags (see MassSpectrum's iter_sequence_tags),
+		so that tags can be consumed one spectrum (and one tag) at a time. Defaults are the same as find_sequence_tags.'''
+	def iter_sequence_tags(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1):
+		for spectrum in self.spectra:
+			yield spectrum.id, spectrum.iter_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, edge_mode=edge_mode, max_residues=max_residues)
 		
 	'''Returns a pair of the longest sequence tag across all spectra, and a list of SpectrumTags.
-		Defers mass_tolerance_mode default to the spectrum class, but the default value for the mass threshold is defined here as (10^(-5))
-		(10ppm with ppm mode).'''
-	def find_longest_tag(self, mass_tolerance_mode=None, mass_threshold=0.00001):
-		spectra_tags = self.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)
-		return (max([spectrum_tags.longest_tag for spectrum_tags in spectra_tags]) if len(spectra_tags)>0 else 0), spectra_tags
-		
\ No newline at end of file
+		Defers mass_tolerance_mode and edge_mode defaults to the spectrum class, but the default value for the mass threshold is defined here as (10^(-5))
+		(10ppm with ppm mode).
+		
+		If longest_only is True, each spectrum only has its longest tags found (with MassSpectrum's find_longest_tag, which doesn't enumerate every tag),
+		and any spectrum that can't possibly contain a tag as long as the longest found so far is skipped and given no tags at all.
+		This is much faster when you only care about the longest tags, but the returned SpectrumTags won't have any shorter tags in them.
+		
+		workers, chunksize and time_budget work the same way as in find_sequence_tags. In parallel, spectra are searched independently, 
+		so longest_only doesn't skip any spectra (though it still only finds the longest tags in each).'''
+	def find_longest_tag(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1, longest_only=False, workers=1, chunksize=None, time_budget=None):
+	
+		if(not longest_only):
+			spectra_tags = self.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, edge_mode=edge_mode, max_residues=max_residues, 
+													workers=workers, chunksize=chunksize, time_budget=time_budget)
+			return (max([spectrum_tags.longest_tag for spectrum_tags in spectra_tags]) if len(spectra_tags)>0 else 0), spectra_tags
+			
+		if(workers is not None and workers > 1):
+			kwargs = {"mass_tolerance_mode" : mass_tolerance_mode, "mass_threshold" : mass_threshold, "edge_mode" : edge_mode, "max_residues" : max_residues, "time_budget" : time_budget}
+			spectra_tags = self.__search_spectra("find_longest_tag", kwargs, workers, chunksize)
+			return (max([spectrum_tags.longest_tag for spectrum_tags in spectra_tags]) if len(spectra_tags)>0 else 0), spectra_tags
+			
+		longest_tag, spectra_tags = 0, []
+		for spectrum in self.spectra:
+			if(longest_tag > 0 and not spectrum.can_reach_length(longest_tag, mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)):
+				spectra_tags.append(SpectrumTags(spectrum.id, 0, defaultdict(list)))
+				continue
+			spectra_tags.append(spectrum.find_longest_tag(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, edge_mode=edge_mode, max_residues=max_residues, time_budget=time_budget))
+			longest_tag = max(longest_tag, spectra_tags[-1].longest_tag)
+			
+		return longest_tag, spectra_tags
+		
+	'''Finds the sequence tags of every spectrum for several configurations at once, where configurations is a list of (mass tolerance mode, mass threshold, intensity threshold) tuples,
+		as if each spectrum were filtered by intensity and searched for tags separately for each configuration, but only finding each spectrum's edges once (see ToleranceSweep).
+		The spectra themselves aren't changed. If relative_intensity is True, intensity thresholds are fractions of each spectrum's max intensity, otherwise they're absolute.
+		
+		Returns a list with a list of SpectrumTags (one per spectrum, in order) for each configuration.'''
+	def sweep_sequence_tags(self, configurations, relative_intensity=False, edge_mode=None, max_residues=1, time_budget=None):
+	
+		results = [[] for configuration in configurations]
+		for spectrum in self.spectra:
+		
+			spectrum_configurations = [(mass_tolerance_mode, mass_threshold, (intensity_threshold * spectrum.max_intensity() if relative_intensity and intensity_threshold is not None else intensity_threshold))
+										for mass_tolerance_mode, mass_threshold, intensity_threshold in configurations]
+			sweep = ToleranceSweep(spectrum.materialise(), spectrum_configurations, edge_mode=edge_mode, max_residues=max_residues)
+			
+			for index, spectrum_tags in enumerate(sweep.find_all_sequence_tags(time_budget=time_budget)):
+				results[index].append(spectrum_tags)
+				
+		return results
\ No newline at end of file
@@ -1,10 +1,12 @@
+import time
 import numpy as np
-import copy
-from decimal import Decimal
+from fractions import Fraction
 from collections import defaultdict
 
 from .Tag import Tag
 from .SpectrumTags import SpectrumTags
+from .TagGraph import TagGraph
+from .MassTableIndex import MassTableIndex
 
 '''A wrapper class for mass-spectrometry files.'''
 class MassSpectrum():
@@ -13,13 +15,19 @@ class MassSpectrum():
 	MASS = 0
 	INTENSITY = 1
 	
+	#Upper bound (in bytes) on the working memory used by each block of broadcast_edges
+	BROADCAST_MEMORY_BUDGET = 2**26
+	
+	#Number of steps a tag search takes between checks of the clock, when it has a time budget
+	DEADLINE_CHECK_INTERVAL = 1024
+	
 	#############
 	###Methods###
 	#############
 	
 	'''Initialiser
 		All parameters are optional to allow leaving some blank, so be sure you fill everything you need'''
-	def __init__(self, id="", compound="", formula="", parent_mass=0.0, ionization="", inchi="", inchi_key="", smiles="", ms2peaks=np.array([]), mass_table={}, misc={}):
+	def __init__(self, id="", compound="", formula="", parent_mass=0.0, ionization="", inchi="", inchi_key="", smiles="", ms2peaks=np.array([]), mass_table={}, misc={}, mass_table_index=None):
 	
 		#String containing some identifier, probably file name
 		self.id = id
@@ -41,15 +49,23 @@ class MassSpectrum():
 		self.ms2peaks = ms2peaks
 		#Linked mass residue table as dictionary, with compound names as keys and masses as (double) values
 		self.mass_table = mass_table
+		#MassTableIndex of the mass table (which can be shared with other spectra using the same table), built when it's first needed if not given
+		self.mass_table_index = mass_table_index
 		#A miscellaneous dictionary to hold any other data you need with respect to a particular set of mass-spectrometry data
 		#Just put the names of any additional data types (e.g. "Annotations"...) as keys and list them under values, for easy extraction of all additional fields with .keys()
 		#If you intend to create additional data to be held across many instances of this class with standard operations performed on it, 
 		#I recommend you extend the class itself instead
 		self.misc = misc
 		
-		#An empty data-structure that is populated as we change the order of readings in mass-peaks
-		#It allows the new indices to be mapped back to their original positions in the data
-		self.mappings = []
+		#A NumPy array of the original position (in the data) of each of the current readings in ms2peaks, composed every time we change their order
+		#It allows the new indices to be mapped back to their original positions in the data, and is None until the order is first changed
+		self.mappings = None
+		#A list of the index arrays of every change to the order of readings, most recent first, for debugging (only kept after keep_mapping_history is called)
+		self.mapping_history = None
+		
+		#PeakStore our readings are a view of (if they've been moved into shared memory, see use_peak_store), and the index of our readings in it
+		self.peak_store = None
+		self.peak_store_index = None
 		
 	'''Returns string representation of object.
 		Not very elegant and mostly for debugging.
@@ -78,17 +94,85 @@ class MassSpectrum():
 			
 		return base_string
 		
+	'''When pickled (e.g. to be sent to a worker process), if our readings are still a view of a shared PeakStore then only the store 
+		(which pickles as a reference to its shared block) is pickled rather than the readings themselves.'''
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if(self.peak_store is not None and self.peak_store.is_shared() and self.peak_store.holds(self.peak_store_index, self.ms2peaks)):
+			state["ms2peaks"] = None
+		else: #our readings have been replaced since (e.g. by sorting them), or they're in ordinary memory, so the store isn't any use
+			state["peak_store"], state["peak_store_index"] = None, None
+		return state
+		
+	'''When unpickled, our readings are attached from the PeakStore if they were left out.'''
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		if(self.ms2peaks is None):
+			self.ms2peaks = self.peak_store.peaks(self.peak_store_index)
+			
+	'''Makes our readings the view of the readings at the given index of a PeakStore (which should hold the same readings), 
+		so they can be sent to other processes without being copied.'''
+	def use_peak_store(self, peak_store, index):
+		self.ms2peaks = peak_store.peaks(index)
+		self.peak_store = peak_store
+		self.peak_store_index = index
+		
 	'''When indices in ms2peaks are changed, add a mapping to translate them back to the indices in the original layout.
-		Takes what the changed indices would be in the original enumeration and adds a mapping based on this.'''
+		Takes the index each changed reading had before the change (i.e. the array used to index ms2peaks), and composes it with the mappings so far,
+		so that mappings always maps straight from the current indices to the original ones.'''
 	def update_mappings(self, old_indices):
-		self.mappings = [{new_index:old_index for new_index, old_index in enumerate(old_indices)}] + self.mappings
+		old_indices = np.asarray(old_indices, dtype=np.int64)
+		self.mappings = old_indices if self.mappings is None else self.mappings[old_indices]
+		if(self.mapping_history is not None):
+			self.mapping_history = [old_indices] + self.mapping_history
+			
+	'''Starts keeping every change to the order of readings in mapping_history (from now on), which is handy for debugging.'''
+	def keep_mapping_history(self):
+		self.mapping_history = [] if self.mapping_history is None else self.mapping_history
 	
-	'''Returns the current transformed indices to the original indices, using the mappings in mapping.'''
+	'''Returns the current transformed indices to the original indices (as a list), using the mappings.'''
 	def original_indices(self, indices):
-		for mapping in self.mappings:
-			indices = [mapping[index] for index in indices]
-		return indices
+		if(self.mappings is None):
+			return list(indices)
+		return self.mappings[np.asarray(indices, dtype=np.int64)].tolist()
 			
+	'''Returns the spectrum itself, as there's nothing to materialise (SpectrumView has the same method, which returns a new MassSpectrum of its readings).'''
+	def materialise(self):
+		return self
+		
+	'''Returns the MassTableIndex of our mass table, building it first if we don't have one (or the one we have was built from a different table).'''
+	def get_mass_table_index(self):
+		if(self.mass_table_index is None or self.mass_table_index.mass_table is not self.mass_table):
+			self.mass_table_index = MassTableIndex(self.mass_table)
+		return self.mass_table_index
+		
+	'''Parses lines of text of mass peak readings (a mass then an intensity, separated by whitespace, with any further columns ignored) into an array in the format of ms2peaks.
+		All the lines are converted in one call to NumPy's loadtxt. If that fails because some of them are malformed (e.g. they have a different number of columns
+		or aren't numbers), they're parsed line by line instead, skipping any line that doesn't start with two numbers.'''
+	@staticmethod
+	def parse_peaks(lines):
+	
+		if(any(line.strip() for line in lines)): #loadtxt warns about having no data
+			try:
+				peaks = np.loadtxt(lines, dtype=np.float64, comments=None, ndmin=2)
+				if(peaks.shape[1] >= 2):
+					return np.ascontiguousarray(peaks[:, :2])
+			except ValueError:
+				pass
+			
+		peaks = []
+		for line in lines:
+			split_line = line.split()
+			try:
+				peaks.append((float(split_line[0]), float(split_line[1])))
+			except (IndexError, ValueError): #malformed line
+				continue
+		return np.array(peaks, dtype=float)
+		
+	'''Returns the number of readings in our mass peak readings.'''
+	def peak_count(self):
+		return len(self.ms2peaks)
+	
 	'''Returns the maximum mass reading in our mass peak readings.'''
 	def max_mass(self):
 		return np.max(self.ms2peaks[:, self.MASS])
@@ -113,14 +197,28 @@ class MassSpectrum():
 		self.update_mappings(above_threshold)
 		self.ms2peaks = self.ms2peaks[above_threshold, :]
 	
+	'''Returns an array of intensities rescaled so that old_max becomes new_max.
+		
+		By default this is one NumPy multiplication by (new_max / old_max). That's two roundings, so each result is within a relative error of 2 * 2**-53 
+		(about 2 units in the last place) of the true value, and any intensity equal to old_max is set to exactly new_max, so the new max is always exact.
+		If exact is True, each intensity is instead multiplied as a fraction of integers (so there's no error at all) and rounded to the nearest float once, 
+		which is correctly rounded but much slower.'''
+	@staticmethod
+	def scale_intensities(intensities, new_max, old_max, exact=False):
+		if(exact):
+			ratio = Fraction(new_max) / Fraction(old_max)
+			return np.array([float(Fraction(intensity) * ratio) for intensity in intensities.tolist()], dtype=float)
+		scaled = intensities * (float(new_max) / float(old_max))
+		scaled[intensities == old_max] = new_max
+		return scaled
+		
 	'''Normalises mass intensity readings so the max reading is equal to some value.
-		Default value is 100. Casts to Decimal to try to avoid machine precision numerical errors, then back to float, so this may slow it down a little..'''
-	def normalise_intensity(self, new_max=100, old_max=None):
+		Default value is 100. See scale_intensities for how precise this is, and exact for a slower correctly-rounded version.'''
+	def normalise_intensity(self, new_max=100, old_max=None, exact=False):
 	
+		new_max = 100 if new_max is None else new_max #default value
 		old_max = self.max_intensity() if old_max is None else old_max
-		new_intensities = np.array([Decimal(peak) for peak in list(self.ms2peaks[:, self.INTENSITY])]) #cast to decimal
-		new_intensities *= ((Decimal(new_max) / Decimal(old_max))) #normalise
-		self.ms2peaks[:, self.INTENSITY] = np.array(new_intensities, dtype=float) #cast back, return
+		self.ms2peaks[:, self.INTENSITY] = self.scale_intensities(self.ms2peaks[:, self.INTENSITY], new_max, old_max, exact=exact)
 		
 	'''Calculates an upper and lower bound for a mass tolerance given a mass and a static value to vary by.'''
 	@staticmethod
@@ -134,60 +232,313 @@ class MassSpectrum():
 		
 	'''Calculates an uppper and lower bound for a mass tolerance given a mass and a percentage value to vary by, with percentage relative to the largest mass reading.'''
 	def max_ppm_mass_tolerance(self, mass, mass_tolerance):
-		return mass - (self.max_mass() * mass_tolerance), mass + (self.max_mass() * mass_tolerance)
+		tolerance = self.max_mass() * mass_tolerance #only find the max mass once
+		return mass - tolerance, mass + tolerance
 		
 	#######################################################
 	#Pass one of these names to anything that accepts a mass tolerance mode with MassSpectrum.NAME
-	#(Lambdas allow us to fix length of parameter list for use as a variable while keeping static and percentile mass tolerance static)
-	STATIC_MASS_TOLERANCE = lambda self, m, mt: self.static_mass_tolerance(m, mt)
-	REL_PPM_MASS_TOLERANCE = lambda self, m, mt: self.rel_ppm_mass_tolerance(m, mt)
+	#(The wrappers allow us to fix length of parameter list for use as a variable while keeping static and percentile mass tolerance static,
+	#and unlike lambdas they can be pickled, so the modes can be sent to other processes)
+	def static_mass_tolerance_mode(self, m, mt): return self.static_mass_tolerance(m, mt)
+	def rel_ppm_mass_tolerance_mode(self, m, mt): return self.rel_ppm_mass_tolerance(m, mt)
+	STATIC_MASS_TOLERANCE = static_mass_tolerance_mode
+	REL_PPM_MASS_TOLERANCE = rel_ppm_mass_tolerance_mode
 	MAX_PPM_MASS_TOLERANCE = max_ppm_mass_tolerance
 	#######################################################
 	
-	########################	
-	###Tag Search Methods###
-	########################
+	#Mass tolerance modes whose windows don't depend on the spectrum, so they can be cached in a MassTableIndex
+	SPECTRUM_INDEPENDENT_TOLERANCES = (STATIC_MASS_TOLERANCE, REL_PPM_MASS_TOLERANCE)
+	
+	############################
+	###Edge Discovery Methods###
+	############################
+	
+	'''Returns the masses of our readings as a one-dimensional array (even if we have no readings).'''
+	def __peak_masses(self):
+		return self.ms2peaks[:, self.MASS] if len(self.ms2peaks) > 0 else np.array([], dtype=float)
+		
+	'''Helper to join lists of edge arrays together and put them in order of source peak, then compound, then target peak
+		(which is the order the original per-peak loop discovers them in).'''
+	@staticmethod
+	def __collect_edges(sources, targets, residues):
+		if(len(sources) < 1):
+			return np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=int)
+		sources, targets, residues = np.concatenate(sources).astype(int), np.concatenate(targets).astype(int), np.concatenate(residues).astype(int)
+		edge_order = np.lexsort((targets, residues, sources))
+		return sources[edge_order], targets[edge_order], residues[edge_order]
 		
-	'''A helper method to unpack our provisional data structure when we perform breadth-first search and store all the connections between peaks in it.'''
-	def __unpack_tag_paths(self, tag_paths):
+	'''Helper to expand arrays of (start, count) pairs into the positions they cover, 
+		returning an array of the index of the pair each position came from and an array of the positions.'''
+	@staticmethod
+	def __expand_ranges(starts, counts):
+		owners = np.repeat(np.arange(len(starts)), counts)
+		positions = np.repeat(starts, counts) + (np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts))
+		return owners, positions
+		
+	'''Finds edges by comparing every peak against every later peak for every compound in the mass table, one peak at a time.
+		This is O(n^2 * k) in the number of peaks and compounds, and is kept around as a reference for the faster modes.
+		
+		lower_thresholds and upper_thresholds are arrays of the bounds on a mass difference for each compound in the mass table (in the order of the mass table).
+		Every edge-discovery mode returns three arrays of the same length, giving the source peak, target peak and compound index of each edge,
+		ordered by source peak, then compound, then target peak.'''
+	def loop_edges(self, lower_thresholds, upper_thresholds):
 	
-		to_check = list(range(len(tag_paths))) #List of all tag-beginning points we are yet to check (we ignore any that are visited during the construction of another tag)
-		tags = defaultdict(list) #List of pairs of tags and their corresponding peaks extracted from our data structure
+		masses = self.__peak_masses()
+		sources, targets, residues = [], [], []
+		
+		for index in range(len(masses)):
 		
-		'''Internal function to help us recursively traverse the data structure.
-			The for loop below starts it off with a 'source node' (i.e. a peak with no previous peaks that have a tag to it),
-			then it calls itself for connections found, building a 'stack' of the current sequence and its corresponding peaks,
-			and if it can't find any it adds the current state of this 'stack' to the list of tags.'''
-		def recursive_structure_search(current_tag, peaks, tags):
-			pushed = True #true if last operation was a push (not pop) preventing subsequences of tags from being registered as a separate tag
+			#calculate a table of mass differences between each peak and all following peaks
+			mass_differences = masses[(index+1):] - masses[index]
+			
+			#for each compound check if any mass differences are approximately equal to the mass of a compound in the mass table and record an edge if so
+			for residue, (lower_threshold, upper_threshold) in enumerate(zip(lower_thresholds, upper_thresholds)):
 			
-			for index in tag_paths[peaks[-1]].keys():
-				compounds = tag_paths[peaks[-1]][index]
+				candidate_positions, = (np.logical_and(mass_differences <= upper_threshold, mass_differences >= lower_threshold)).nonzero() #get indices where element between threshold
+				candidate_positions += index + 1 #adjust for the offset in only checking part of the array (since peaks are directional we only check succeeding ones)
 				
-				pushed = False #If there are ANY additions to the current tag, the current tag is a subsequence and we ignore it
-					
-				if(index in to_check): #Any tag we visit as part of another tag's path can be ignored as a root/source for a path as it must be a subsequence
-					to_check.remove(index)
+				sources.append(np.full(len(candidate_positions), index))
+				targets.append(candidate_positions)
+				residues.append(np.full(len(candidate_positions), residue))
+				
+		return self.__collect_edges(sources, targets, residues)
+		
+	'''Finds edges by sorting the masses once, then using a binary search (over every peak at once) to find the range of peaks whose mass falls
+		within each compound's tolerance window of each peak. This is O(k * n log n + E) rather than O(n^2 * k).
+		Compounds whose windows overlap (see MassTableIndex's merge_windows) are searched for together, which saves a lot of searches on large mass tables.
+		
+		The readings don't need to already be sorted by mass: edges still only go from a peak to a later peak in the current order,
+		and every candidate edge is checked with exactly the same comparison the loop uses, so this returns exactly the same edges as loop_edges.'''
+	def searchsorted_edges(self, lower_thresholds, upper_thresholds):
+	
+		masses = self.__peak_masses()
+		if(len(masses) < 1 or len(lower_thresholds) < 1):
+			return self.__collect_edges([], [], [])
+		
+		order = np.argsort(masses, kind="stable")
+		sorted_masses = masses[order]
+		
+		#(peak + threshold) isn't always rounded the same way as (other peak - peak), so we widen every search window by a few ulps 
+		#and let the exact check below throw away anything extra
+		slack = 4 * np.finfo(float).eps * (np.max(np.abs(masses)) + np.max(np.abs(lower_thresholds)) + np.max(np.abs(upper_thresholds)))
+		
+		sources, targets, residues = [], [], []
+		for group_lower, group_upper, group in zip(*MassTableIndex.merge_windows(lower_thresholds, upper_thresholds)):
+		
+			starts = np.searchsorted(sorted_masses, masses + group_lower - slack, side="left")
+			ends = np.searchsorted(sorted_masses, masses + group_upper + slack, side="right")
+			counts = np.maximum(ends - starts, 0)
+			
+			source, positions = self.__expand_ranges(starts, counts)
+			target = order[positions]
+			
+			mass_differences = masses[target] - masses[source]
+			later = target > source
+			group_lowers, group_uppers = lower_thresholds[group], upper_thresholds[group]
+			
+			if(np.all(np.diff(group_uppers) >= 0)):
+				#the group's lower bounds are in order, so if its upper bounds are too then the windows containing a difference are a contiguous run of the group,
+				#which we can find with another binary search instead of checking every compound (this is what keeps large mass tables and combinations fast)
+				first = np.searchsorted(group_uppers, mass_differences, side="left")
+				last = np.searchsorted(group_lowers, mass_differences, side="right")
+				candidate, member = self.__expand_ranges(first, np.where(later, np.maximum(last - first, 0), 0))
+				sources.append(source[candidate])
+				targets.append(target[candidate])
+				residues.append(group[member])
+			else:
+				for residue in group:
+					keep = later & (mass_differences <= upper_thresholds[residue]) & (mass_differences >= lower_thresholds[residue])
+					sources.append(source[keep])
+					targets.append(target[keep])
+					residues.append(np.full(np.count_nonzero(keep), residue))
+			
+		return self.__collect_edges(sources, targets, residues)
+		
+	'''Finds edges by working out every difference between a peak and a later peak as one NumPy broadcast (the upper triangle of the n*n difference matrix)
+		and checking all of them against every compound's tolerance window at once. This does the same O(n^2 * k) comparisons as loop_edges,
+		but without any Python-level work per peak, which makes it much faster on mid-sized spectra (a few hundred to a few thousand peaks).
+		
+		To avoid ever allocating the full n*n*k comparison tensor, the rows (source peaks) are processed in blocks,
+		with the number of rows per block chosen automatically so that each block stays within memory_budget bytes.
+		The differences left in a block are then compared against the compounds in blocks of differences and compounds that also stay within the budget,
+		as k grows combinatorially with max_residues. The default budget is MassSpectrum.BROADCAST_MEMORY_BUDGET.'''
+	def broadcast_edges(self, lower_thresholds, upper_thresholds, memory_budget=None):
+	
+		memory_budget = MassSpectrum.BROADCAST_MEMORY_BUDGET if memory_budget is None else memory_budget #default value
+	
+		masses = self.__peak_masses()
+		if(len(masses) < 1 or len(lower_thresholds) < 1):
+			return self.__collect_edges([], [], [])
+			
+		lower_thresholds, upper_thresholds = np.asarray(lower_thresholds), np.asarray(upper_thresholds)
+		#each element of a block of rows costs one float difference plus four booleans (the upper triangle, the two bounds checks against the widest window and their conjunction)
+		rows = max(1, int(memory_budget // (len(masses) * 12)))
+		#each difference costs three booleans per compound it's compared against (the two bounds checks and their conjunction),
+		#so the compounds are split into blocks as well if comparing even one difference against all of them would go over the budget
+		compounds_per_block = max(1, min(len(lower_thresholds), int(memory_budget // 3)))
+		candidates_per_block = max(1, int(memory_budget // (3 * compounds_per_block)))
+		
+		sources, targets, residues = [], [], []
+		for start in range(0, len(masses), rows):
+			stop = min(start + rows, len(masses))
+			
+			#row r is the source peak (start + r) and column c is the target peak (start + 1 + c), so only c >= r is in the upper triangle
+			mass_differences = masses[None, (start+1):] - masses[start:stop, None]
+			upper_triangle = np.arange(mass_differences.shape[1])[None, :] >= np.arange(stop - start)[:, None]
+			
+			#most differences are outside every window, so throw those away before comparing against each compound individually
+			in_range = upper_triangle & (mass_differences >= np.min(lower_thresholds)) & (mass_differences <= np.max(upper_thresholds))
+			row, column = in_range.nonzero()
+			candidates = mass_differences[row, column]
+			
+			for candidate_start in range(0, len(candidates), candidates_per_block):
+				candidate_block = candidates[candidate_start:(candidate_start+candidates_per_block), None]
+				for compound_start in range(0, len(lower_thresholds), compounds_per_block):
+					compound_stop = compound_start + compounds_per_block
+					matches = (candidate_block >= lower_thresholds[compound_start:compound_stop]) & (candidate_block <= upper_thresholds[compound_start:compound_stop])
+					candidate, residue = matches.nonzero()
 					
-				if(len(compounds) == 1): #if the list of compounds only has one element, just add that element rather than string representation of the list
-					compounds = compounds[0]
-				recursive_structure_search(current_tag + str(compounds) + "-", (copy.copy(peaks)) + [index], tags) #visit the next tag
+					sources.append(row[candidate + candidate_start] + start)
+					targets.append(column[candidate + candidate_start] + start + 1)
+					residues.append(residue + compound_start)
+			
+		return self.__collect_edges(sources, targets, residues)
+		
+	#######################################################
+	#Pass one of these names to anything that accepts an edge discovery mode with MassSpectrum.NAME
+	LOOP_EDGES = loop_edges
+	SEARCHSORTED_EDGES = searchsorted_edges
+	BROADCAST_EDGES = broadcast_edges
+	#######################################################
+	
+	########################	
+	###Tag Search Methods###
+	########################
+		
+	'''Returns the label used in a tag string for an edge that could represent any of the given compounds.
+		If the list of compounds only has one element, that element is used rather than the string representation of the list
+		(in brackets if it's a combination of compounds, e.g. [Gly+Ala], so it still reads as one component).'''
+	@staticmethod
+	def __edge_label(compounds):
+		if(len(compounds) == 1):
+			return ("[%s]" if MassTableIndex.is_combination(compounds[0]) else "%s") % str(compounds[0])
+		return str(compounds)
+		
+	'''Creates a Tag from a tag string and the (current) indices of the peaks it runs across.'''
+	def __make_tag(self, current_tag, peaks):
+		masses = list(self.ms2peaks[peaks, MassSpectrum.MASS])
+		return Tag(current_tag, self.original_indices(peaks), masses)
+		
+	'''Returns the time (on the time.monotonic clock) a search with the given time budget in seconds has to finish by, or None if there's no budget.'''
+	@staticmethod
+	def __deadline(time_budget):
+		return None if time_budget is None else time.monotonic() + time_budget
+		
+	'''Returns whether we're past the deadline (always False if there isn't one).'''
+	@staticmethod
+	def __out_of_time(deadline):
+		return deadline is not None and time.monotonic() > deadline
+		
+	'''Raises a TimeoutError if we're past the deadline (checking the clock only every DEADLINE_CHECK_INTERVAL steps, as it's comparatively slow).'''
+	def __check_deadline(self, deadline, steps):
+		if(steps % MassSpectrum.DEADLINE_CHECK_INTERVAL == 0 and self.__out_of_time(deadline)):
+			raise TimeoutError("Ran out of time searching for tags in spectrum %s!" % str(self.id))
 			
-			if(pushed and len(peaks) > 1): #This is a maximum-length tag (i.e. not a subsequence) and isn't zero-length
-				masses = list(self.ms2peaks[peaks, MassSpectrum.MASS])
-				(tags[len(peaks) - 1]).append(Tag(current_tag, self.original_indices(peaks), masses)) #Save current tag, and the sequence of corresponding peaks
+	'''Returns the given tag graph, or builds a new one if none was given, making sure it actually belongs to our current readings.'''
+	def __tag_graph(self, tag_graph, mass_tolerance_mode, mass_threshold, edge_mode, max_residues):
+		if(tag_graph is None):
+			return self.build_tag_graph(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, edge_mode=edge_mode, max_residues=max_residues)
+		if(tag_graph.number_of_peaks() != len(self.ms2peaks)):
+			raise ValueError("Tag graph has %d peaks but spectrum %s has %d readings!" % (tag_graph.number_of_peaks(), str(self.id), len(self.ms2peaks)))
+		return tag_graph
+		
+	'''A helper method to walk a tag graph and yield every sequence tag in it, one at a time.
+		A tag is a path from a 'source node' (i.e. a peak with no previous peaks that have a tag to it) to a peak with no following peaks,
+		as any path starting or finishing elsewhere is a subsequence of one of these.
+		
+		Rather than recursing, this keeps an explicit stack with the position of the next unvisited edge of each peak on the current path,
+		so memory use is bounded by the length of the longest tag (not the number of tags), and long tags can't hit Python's recursion limit.
+		If a deadline is given, a TimeoutError is raised if the walk is still going after it.'''
+	def __iter_tag_graph(self, tag_graph, deadline=None):
 	
+		indptr, indices = tag_graph.indptr.tolist(), tag_graph.indices.tolist()
+		labels = [self.__edge_label(compounds) for compounds in tag_graph.all_edge_compounds()] #worked out once per edge rather than once per tag
+		in_degrees = tag_graph.in_degrees()
+		steps = 0
 	
-		index = 0
-		while(index < len(to_check)): 
+		for root in range(tag_graph.number_of_peaks()):
 		
-			recursive_structure_search("-", [to_check[index]], tags)
-			index += 1 
+			if(in_degrees[root] > 0): #Any tag starting here must be a subsequence of a tag starting before it
+				continue
+				
+			peaks, path = [root], [] #the current path, and the edges along it
+			stack = [indptr[root]]
+			
+			while(len(stack) > 0):
+			
+				self.__check_deadline(deadline, steps)
+				steps += 1
+				
+				peak = peaks[-1]
+				edge = stack[-1]
+				
+				if(edge >= indptr[peak+1]): #we've been along every edge from the current peak, so pop it
+					if(indptr[peak] == indptr[peak+1] and len(peaks) > 1): #This is a maximum-length tag (i.e. not a subsequence) and isn't zero-length
+						yield self.__make_tag("-" + "".join([labels[e] + "-" for e in path]), list(peaks))
+					stack.pop()
+					peaks.pop()
+					if(len(path) > 0):
+						path.pop()
+					continue
+					
+				stack[-1] = edge + 1 #push the next peak on to the path
+				peaks.append(indices[edge])
+				path.append(edge)
+				stack.append(indptr[indices[edge]])
+				
+	'''A helper method to unpack a tag graph into a SpectrumTags object holding every sequence tag, stored by length.
+		If the deadline passes, the tags found so far are returned, marked as incomplete.'''
+	def __unpack_tag_graph(self, tag_graph, deadline=None):
+	
+		tags, complete = defaultdict(list), True
+		try:
+			for tag in self.__iter_tag_graph(tag_graph, deadline=deadline):
+				tags[tag.length].append(tag)
+		except TimeoutError:
+			complete = False
 			
 		longest_tag = (max(tags.keys()) if len(tags.keys()) > 0 else 0)
 			
-		return SpectrumTags(self.id, longest_tag, tags)
+		return SpectrumTags(self.id, longest_tag, tags, tag_graph=tag_graph, complete=complete)
 	
+	'''Calculates the bounds on a mass difference for each compound in the mass table with the given mass tolerance mode (using our MassTableIndex), 
+		returning the compound names and arrays of their lower and upper bounds (in the order of the mass table).
+		If max_residues is more than 1, combinations of up to that many compounds are included after the compounds (see MassTableIndex's combination_index).'''
+	def mass_thresholds(self, mass_tolerance_mode, mass_threshold, max_residues=1):
+		mass_table_index = self.get_mass_table_index()
+		compounds = mass_table_index.compounds if max_residues == 1 else mass_table_index.combination_index(max_residues)[0]
+		if(len(self.ms2peaks) < 1):
+			return compounds, np.array([], dtype=float), np.array([], dtype=float)
+		lower_thresholds, upper_thresholds = mass_table_index.tolerance_windows(mass_tolerance_mode, mass_threshold, spectrum=self, max_residues=max_residues,
+																					cacheable=(mass_tolerance_mode in MassSpectrum.SPECTRUM_INDEPENDENT_TOLERANCES))
+		return compounds, lower_thresholds, upper_thresholds
+		
+	'''Builds the graph of possible compounds between peaks that sequence tags are read out of (described in find_sequence_tags), as a TagGraph object.
+		Each edge holds a bitmask of the compounds (by their index in the mass table) it could represent.
+		
+		The graph only depends on the current readings and the parameters given, so it can be built once, kept (or saved with TagGraph's save),
+		and passed to find_sequence_tags, iter_sequence_tags or find_longest_tag as tag_graph to run as many searches on it as you like.
+		Takes the same parameters as find_sequence_tags.'''
+	def build_tag_graph(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1):
+	
+		mass_tolerance_mode = MassSpectrum.MAX_PPM_MASS_TOLERANCE if mass_tolerance_mode is None else mass_tolerance_mode #default value
+		edge_mode = MassSpectrum.SEARCHSORTED_EDGES if edge_mode is None else edge_mode #default value
+	
+		compounds, lower_thresholds, upper_thresholds = self.mass_thresholds(mass_tolerance_mode, mass_threshold, max_residues=max_residues)
+		sources, targets, residues = edge_mode(self, lower_thresholds, upper_thresholds)
+		
+		return TagGraph.from_edges(len(self.ms2peaks), sources, targets, residues, compounds)
+		
 	'''ms2peaks contains an array of mass spectrometry readings, with a mass value and an intensity value.
 		We want to find gaps in the masses that correspond to the masses in mass_table (with some tolerance, either percentile or absolute).
 		Then we want to find all sequences of masses where one mass begins on a peak as another ends, with no subsequences - this is a sequence tag. 
@@ -205,28 +556,116 @@ class MassSpectrum():
 		mass_threshold specifies the value to be used for the mass tolerance. So in the case of a fixed mass tolerance of 0.05 it will give +-0.05 to the value
 		and in the case of percentile it will give +-5%.
 		
-		Returns a SpectrumTags object of sequence tags (with no subsequences because those can be reconstructed from longer tags).'''
-	def find_sequence_tags(self, mass_tolerance_mode=None, mass_threshold=0.00001):
-	
-		mass_tolerance_mode = MassSpectrum.MAX_PPM_MASS_TOLERANCE if mass_tolerance_mode is None else mass_tolerance_mode #default value
-	
-		tag_paths = [defaultdict(list) for item in self.ms2peaks]  #our provisional data structure where each entry is a dictionary representing a peak,
-																	#with keys indices of other (later) peaks and values a list of possible compounds which could be represented
-																	#by the mass differences between these peaks
+		edge_mode allows you to specify which of this class's edge discovery methods is used to find the edges of the graph
+		(again with standard names defined alongside them). All of them find exactly the same edges, they only differ in speed.
+		The default is a binary search over the sorted masses.
 		
-		for index in range(len(tag_paths)):
+		max_residues allows gaps left by missing peaks to be bridged: if it's more than 1, a gap can also match the combined mass of any 2 (up to max_residues, at most 3) compounds, 
+		which is labelled with the compounds joined by '+' in brackets (e.g. -Val-[Gly+Ala]-Ser-). The default is 1, i.e. single compounds only.
 		
-			#calculate a table of mass differences between each peak and all following peaks
-			mass_differences = np.array(self.ms2peaks)[(index+1):, self.MASS] - np.array(self.ms2peaks)[index, self.MASS] 
+		If you already have a tag graph for this spectrum (from build_tag_graph, or the tag_graph of an earlier SpectrumTags) you can pass it as tag_graph,
+		in which case the other parameters are ignored and the graph isn't rebuilt.
 		
-			#for each compound check if any mass differences are approximately equal to the mass of a compound in the mass table and add it to tag_paths if so
-			for compound, mass in self.mass_table.items():
+		time_budget allows you to give a number of seconds the search can take, after which it stops and returns the tags it has found so far
+		(with the complete attribute of the returned SpectrumTags set to False), so that one pathological spectrum can't take forever. By default there's no limit.
+		The budget covers building the tag graph too, but that can't be stopped part way through: the graph isn't built if the budget has already run out,
+		and if it runs out while the graph is being built, the search stops (with no tags) once it's finished.
+		
+		Returns a SpectrumTags object of sequence tags (with no subsequences because those can be reconstructed from longer tags), which also holds the tag graph.'''
+	def find_sequence_tags(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1, tag_graph=None, time_budget=None):
+		deadline = self.__deadline(time_budget)
+		if(not self.__out_of_time(deadline)): #building the graph can't be stopped part way through, so it isn't started without any time left
+			tag_graph = self.__tag_graph(tag_graph, mass_tolerance_mode, mass_threshold, edge_mode, max_residues)
+		if(self.__out_of_time(deadline)):
+			return SpectrumTags(self.id, 0, defaultdict(list), tag_graph=tag_graph, complete=False)
+		return self.__unpack_tag_graph(tag_graph, deadline=deadline)
+		
+	'''Returns a generator that yields the same sequence tags as find_sequence_tags as Tag objects, one at a time, instead of collecting them all into a SpectrumTags object.
+		The tag graph is built when this is called, but tags are only found as they're asked for, so a spectrum with millions of tags can be processed
+		(e.g. written out, or have its components counted) without ever holding them all in memory. Takes the same parameters as find_sequence_tags.'''
+	def iter_sequence_tags(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1, tag_graph=None):
+		return self.__iter_tag_graph(self.__tag_graph(tag_graph, mass_tolerance_mode, mass_threshold, edge_mode, max_residues))
+		
+	'''Works out the length of the longest path starting from each peak in a tag graph, with dynamic programming.
+		Edges only go from a peak to a later peak, so the current order of the peaks is already a topological order of the DAG,
+		and visiting them in reverse means every peak's successors are done before the peak itself. This is O(V+E).'''
+	@staticmethod
+	def __longest_paths(tag_graph):
+		indptr, indices = tag_graph.indptr.tolist(), tag_graph.indices.tolist()
+		longest = [0 for peak in range(tag_graph.number_of_peaks())]
+		for index in reversed(range(len(longest))):
+			if(indptr[index] < indptr[index+1]):
+				longest[index] = 1 + max([longest[next_index] for next_index in indices[indptr[index]:indptr[index+1]]])
+		return longest
+		
+	'''Finds only the longest sequence tags in this spectrum, without enumerating every tag like find_sequence_tags does (which can grow exponentially on noisy spectra).
+		The length of the longest tag is found with dynamic programming over the DAG in O(V+E), and the tags of that length are then read back out by only following
+		edges that keep us on a longest path. If all_witnesses is True this gives all tags of that length (the same ones find_sequence_tags would give for that length),
+		otherwise it gives just one of them.
+		
+		Takes the same parameters as find_sequence_tags, and returns a SpectrumTags object only containing tags of the longest length.
+		The time budget covers the dynamic programming as well as building the tag graph, but neither can be stopped part way through (see find_sequence_tags).'''
+	def find_longest_tag(self, mass_tolerance_mode=None, mass_threshold=0.00001, edge_mode=None, max_residues=1, all_witnesses=True, tag_graph=None, time_budget=None):
+	
+		deadline = self.__deadline(time_budget)
+		tags = defaultdict(list)
+		if(not self.__out_of_time(deadline)): #as in find_sequence_tags
+			tag_graph = self.__tag_graph(tag_graph, mass_tolerance_mode, mass_threshold, edge_mode, max_residues)
+		if(self.__out_of_time(deadline)):
+			return SpectrumTags(self.id, 0, tags, tag_graph=tag_graph, complete=False)
+		indptr, indices = tag_graph.indptr.tolist(), tag_graph.indices.tolist()
+		longest = self.__longest_paths(tag_graph)
+		longest_tag = max(longest) if len(longest) > 0 else 0
+		
+		if(longest_tag < 1):
+			#the search over the longest paths below checks the deadline as soon as it starts, but a graph without any edges never gets there
+			return SpectrumTags(self.id, 0, tags, tag_graph=tag_graph, complete=not self.__out_of_time(deadline))
 			
-				lower_threshold, upper_threshold = mass_tolerance_mode(self, mass, mass_threshold)
-					
-				candidate_positions, = (np.logical_and(mass_differences <= upper_threshold, mass_differences >= lower_threshold)).nonzero() #get indices where element between threshold 
-				candidate_positions += index + 1 #adjust for the offset in only checking part of the array (since peaks are directional we only check succeeding ones)
+		edge_compounds = tag_graph.all_edge_compounds()
+			
+		#any peak starting a longest path can't have an edge into it, so these are exactly the starts of the longest tags
+		stack = [("-", [index]) for index in reversed(range(len(longest))) if longest[index] == longest_tag]
+		steps = 0
+		while(len(stack) > 0):
+		
+			try:
+				self.__check_deadline(deadline, steps)
+			except TimeoutError:
+				return SpectrumTags(self.id, longest_tag, tags, tag_graph=tag_graph, complete=False)
+			steps += 1
+		
+			current_tag, peaks = stack.pop()
+			if(longest[peaks[-1]] == 0): #reached the end of a tag
+				tags[longest_tag].append(self.__make_tag(current_tag, peaks))
+				if(not all_witnesses):
+					break
+				continue
 				
-				for next_pos in candidate_positions: tag_paths[index][next_pos] += [compound] #add to provisional data structure
+			for edge in reversed(range(indptr[peaks[-1]], indptr[peaks[-1]+1])): #reversed so the stack pops them in their original order
+				if(longest[indices[edge]] == longest[peaks[-1]] - 1):
+					stack.append((current_tag + self.__edge_label(edge_compounds[edge]) + "-", peaks + [indices[edge]]))
 					
-		return self.__unpack_tag_paths(tag_paths)
\ No newline at end of file
+		return SpectrumTags(self.id, longest_tag, tags, tag_graph=tag_graph)
+
+		
+	'''A cheap check of whether this spectrum could possibly contain a sequence tag of the given length, without building the tag graph.
+		A tag of length L needs at least L + 1 peaks, and they have to span at least L times the smallest mass difference any compound can match.
+		This never rules out a spectrum that does have a tag that long, but can pass one that doesn't, so it's for skipping spectra early in batch runs.
+		Takes the same mass tolerance parameters as find_sequence_tags.'''
+	def can_reach_length(self, length, mass_tolerance_mode=None, mass_threshold=0.00001):
+	
+		mass_tolerance_mode = MassSpectrum.MAX_PPM_MASS_TOLERANCE if mass_tolerance_mode is None else mass_tolerance_mode #default value
+	
+		if(length < 1):
+			return True
+		if(len(self.ms2peaks) < length + 1):
+			return False
+			
+		compounds, lower_thresholds, upper_thresholds = self.mass_thresholds(mass_tolerance_mode, mass_threshold)
+		if(len(lower_thresholds) < 1):
+			return False
+			
+		masses = self.__peak_masses()
+		smallest_gap = max(np.min(lower_thresholds), 0)
+		rounding = length * 4 * np.finfo(float).eps * np.max(np.abs(masses)) #allow for the rounding in each of the L differences
+		return (np.max(masses) - np.min(masses)) + rounding >= length * smallest_gap
\ No newline at end of file
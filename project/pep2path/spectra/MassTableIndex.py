@@ -0,0 +1,108 @@
+import itertools
+import numpy as np
+
+'''Class to hold a mass table in the form the tag search wants it: the compound masses as a NumPy array (in the order of the mass table, 
+	and sorted by mass), and the tolerance windows around them for each mass tolerance mode they've been asked for.
+	
+	Building one of these for a table with hundreds of compounds (like the Kersten table) and sharing it between every spectrum that uses that table
+	(which MassSpectraAggregate does for you) means the masses are only converted once, and windows that don't depend on the spectrum are only worked out once.
+	It assumes the mass table isn't changed after the index is built - if it is, build a new one.'''
+class MassTableIndex():
+
+	#Separator between the names of the compounds in a combination of compounds (e.g. "Gly+Ala")
+	COMBINATION_SEPARATOR = "+"
+	#Largest number of compounds a gap between two peaks can be matched to a combination of
+	MAX_COMBINATION_SIZE = 3
+	
+	def __init__(self, mass_table):
+		#The mass table this index was built from, as a dictionary with compound names as keys and masses as values
+		self.mass_table = mass_table
+		#List of compound names, in the order of the mass table
+		self.compounds = list(mass_table.keys())
+		#NumPy array of compound masses in the order of compounds (cast to float, as some tables hold them as strings)
+		self.masses = np.array([float(mass) for mass in mass_table.values()], dtype=float)
+		#NumPy array of the indices of compounds in non-decreasing order of mass
+		self.order = np.argsort(self.masses, kind="stable")
+		#Dictionary of tolerance windows that don't depend on the spectrum, keyed by (mass tolerance mode, mass threshold, max residues)
+		self.cached_windows = {}
+		#Dictionary of combination indices (see combination_index), keyed by the largest number of compounds in a combination
+		self.cached_combinations = {}
+		
+	def __str__(self):
+		return "\n".join([str(self.compounds[index]) + " " + str(self.masses[index]) for index in self.order])
+		
+	'''Returns the number of compounds in the mass table.'''
+	def number_of_compounds(self):
+		return len(self.compounds)
+		
+	'''Returns the compound masses in non-decreasing order.'''
+	def sorted_masses(self):
+		return self.masses[self.order]
+		
+	'''Returns whether a compound name is the name of a combination of compounds from combination_index.'''
+	@staticmethod
+	def is_combination(compound):
+		return MassTableIndex.COMBINATION_SEPARATOR in str(compound)
+		
+	'''Returns a list of names and an array of masses of every compound, followed by every multiset of 2 up to max_residues compounds
+		(named by joining the compound names with COMBINATION_SEPARATOR), for matching gaps left by missing peaks.
+		The combinations of each size are sorted by mass, so a search over them can stay a binary search. 
+		They're only built the first time they're asked for.'''
+	def combination_index(self, max_residues):
+	
+		if(max_residues < 1 or max_residues > MassTableIndex.MAX_COMBINATION_SIZE):
+			raise ValueError("Combinations must have between 1 and %d compounds, not %d!" % (MassTableIndex.MAX_COMBINATION_SIZE, max_residues))
+	
+		if(max_residues not in self.cached_combinations):
+			names, masses = list(self.compounds), [self.masses]
+			for size in range(2, max_residues + 1):
+				combinations = np.array(list(itertools.combinations_with_replacement(range(len(self.compounds)), size)), dtype=int).reshape(-1, size)
+				combination_masses = np.sum(self.masses[combinations], axis=1)
+				order = np.argsort(combination_masses, kind="stable")
+				names += [MassTableIndex.COMBINATION_SEPARATOR.join([str(self.compounds[index]) for index in combinations[combination]]) for combination in order]
+				masses.append(combination_masses[order])
+			self.cached_combinations[max_residues] = (names, np.concatenate(masses))
+			
+		return self.cached_combinations[max_residues]
+		
+	'''Returns a pair of arrays of the lower and upper bounds on a mass difference for each compound (in the order of compounds) with the given mass tolerance mode.
+		The mode is called once with the whole array of masses rather than once per compound, with spectrum passed as its first argument
+		(all of MassSpectrum's mass tolerance modes work on arrays).
+		If max_residues is more than 1, the windows are for every entry of combination_index(max_residues) instead.
+		
+		If cacheable is True the windows mustn't depend on the spectrum, and they're only worked out the first time they're asked for with that mode and threshold.
+		The arrays returned are shared, so don't change them.'''
+	def tolerance_windows(self, mass_tolerance_mode, mass_threshold, spectrum=None, cacheable=False, max_residues=1):
+	
+		key = (mass_tolerance_mode, mass_threshold, max_residues)
+		if(cacheable and key in self.cached_windows):
+			return self.cached_windows[key]
+			
+		masses = self.masses if max_residues == 1 else self.combination_index(max_residues)[1]
+		lower_thresholds, upper_thresholds = mass_tolerance_mode(spectrum, masses, mass_threshold)
+		windows = (np.array(lower_thresholds, dtype=float).reshape(-1), np.array(upper_thresholds, dtype=float).reshape(-1))
+		
+		if(cacheable):
+			self.cached_windows[key] = windows
+		return windows
+		
+	'''Merges tolerance windows that overlap (e.g. Gln and Lys with a wide enough tolerance) into groups, so that a search can look for
+		a mass difference in every window of a group at once, then check which compounds of the group it actually matches.
+		
+		Returns an array of the lower bounds of each group (in increasing order), an array of the upper bounds of each group, 
+		and a list of arrays of the indices of the compounds in each group (in non-decreasing order of their lower bounds).'''
+	@staticmethod
+	def merge_windows(lower_thresholds, upper_thresholds):
+	
+		if(len(lower_thresholds) < 1):
+			return np.array([], dtype=float), np.array([], dtype=float), []
+	
+		order = np.argsort(lower_thresholds, kind="stable")
+		lower, upper = lower_thresholds[order], upper_thresholds[order]
+		
+		#a window starts a new group if it starts after every window before it has ended
+		starts = np.ones(len(order), dtype=bool)
+		starts[1:] = lower[1:] > np.maximum.accumulate(upper)[:-1]
+		boundaries, = starts.nonzero()
+		
+		return lower[boundaries], np.maximum.reduceat(upper, boundaries), np.split(order, boundaries[1:])
@@ -0,0 +1,137 @@
+import json
+import numpy as np
+
+from . import mgfParser
+from ..genbank import fileSaving
+
+'''Class for an index of the byte offset of every BEGIN IONS block in an .mgf, along with its TITLE, PEPMASS and SCANS,
+	so single spectra can be read by seeking straight to their blocks rather than parsing the whole file.
+	The index is kept in a sidecar file next to the .mgf (the .mgf's path with EXTENSION added), which records the .mgf's fingerprint
+	(see genbank's fileSaving), and is rebuilt by load whenever the .mgf has changed since.'''
+class MgfIndex():
+	
+	#Extension added to the path of an .mgf to give the path of its index
+	EXTENSION = ".idx"
+	
+	def __init__(self, path, offsets, titles, parent_masses, scans):
+		#String containing the path of the .mgf
+		self.path = path
+		#NumPy array of the byte offset of the start of every BEGIN IONS line in the .mgf, in the order of the file
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		#List of the TITLE of every block (None if it has none)
+		self.titles = titles
+		#NumPy array of the PEPMASS of every block (NaN if it has none, or it isn't a number)
+		self.parent_masses = np.array([np.nan if mass is None else mass for mass in parent_masses], dtype=float)
+		#List of the SCANS of every block as text (None if it has none)
+		self.scans = scans
+		
+		#Dictionary of the indices of the blocks with each title, in the order of the file
+		self.title_index = {}
+		for index, title in enumerate(titles):
+			self.title_index.setdefault(title, []).append(index)
+		#NumPy array of the indices of the blocks in order of PEPMASS (with NaNs last), and of the PEPMASSes in that order
+		self.mass_order = np.argsort(self.parent_masses, kind="stable")
+		self.sorted_masses = self.parent_masses[self.mass_order]
+	
+	def __str__(self):
+		return "MgfIndex of %d spectra in %s" % (len(self), self.path)
+	
+	def __len__(self):
+		return len(self.offsets)
+	
+	'''Returns the path of the index of the .mgf at path.'''
+	@staticmethod
+	def index_path(path):
+		return path + MgfIndex.EXTENSION
+	
+	'''Scans the .mgf at path for the start of every block and its TITLE, PEPMASS and SCANS (without parsing any peaks),
+		writes the index to its sidecar file (unless write is False) and returns it.
+		If the sidecar can't be written (e.g. the .mgf is in a read-only directory), the index is only kept in memory rather than scanning the .mgf again.'''
+	@staticmethod
+	def build(path, write=True):
+		
+		fingerprint = fileSaving.fingerprint(path)
+		offsets, titles, parent_masses, scans = [], [], [], []
+		fields = {b"TITLE" : titles, b"PEPMASS" : parent_masses, b"SCANS" : scans}
+		
+		with open(path, 'rb') as file:
+			offset = 0
+			for line in file:
+				if(b"BEGIN IONS" in line):
+					offsets.append(offset)
+					titles.append(None)
+					parent_masses.append(None)
+					scans.append(None)
+				elif(len(offsets) > 0 and b'=' in line):
+					field, value = line.split(b'=')[:2] #as the parser splits fields, so titles match the ids of its spectra
+					if(field in fields): #the parser keeps the last of each field in a block
+						value = value.decode("utf-8", "replace").strip()
+						fields[field][-1] = value if field != b"PEPMASS" else MgfIndex.__parse_mass(value)
+				offset += len(line)
+		
+		mgf_index = MgfIndex(path, offsets, titles, parent_masses, scans)
+		if(write):
+			try:
+				mgf_index.write(fingerprint)
+			except OSError:
+				pass
+		return mgf_index
+	
+	'''Helper to parse the first number of a PEPMASS (which can be followed by an intensity), or None if it isn't one.'''
+	@staticmethod
+	def __parse_mass(value):
+		try:
+			return float(value.split()[0])
+		except (IndexError, ValueError):
+			return None
+	
+	'''Writes the index to its sidecar file, recording the fingerprint of the .mgf it was built from.'''
+	def write(self, fingerprint):
+		
+		index = {"source" : fingerprint, "offsets" : self.offsets.tolist(), "titles" : self.titles,
+					"parent_masses" : [None if np.isnan(mass) else mass for mass in self.parent_masses.tolist()], "scans" : self.scans}
+		with fileSaving.atomic_write(MgfIndex.index_path(self.path)) as file:
+			json.dump(index, file)
+	
+	'''Returns the index of the .mgf at path from its sidecar file, building it first if there isn't one or the .mgf has changed since it was built (see build).'''
+	@staticmethod
+	def load(path):
+		try:
+			with open(MgfIndex.index_path(path), 'r') as file:
+				index = json.load(file)
+			if(index["source"] == fileSaving.fingerprint(path)):
+				return MgfIndex(path, index["offsets"], index["titles"], index["parent_masses"], index["scans"])
+		except (OSError, ValueError, KeyError): #no index (or a broken one)
+			pass
+		return MgfIndex.build(path)
+	
+	'''Returns a list of the indices of the blocks with the given title.'''
+	def find_title(self, title):
+		return self.title_index.get(title, [])
+	
+	'''Returns a list of the indices of the blocks with a PEPMASS in [lower, upper], in the order of the file.'''
+	def find_mass_range(self, lower, upper):
+		start, end = np.searchsorted(self.sorted_masses, lower, side="left"), np.searchsorted(self.sorted_masses, upper, side="right")
+		return np.sort(self.mass_order[start:end]).tolist()
+	
+	'''Returns a list of the spectra of the blocks at the given indices, seeking straight to each and parsing only it (see mgfParser's iter_spectra).
+		Blocks the parser would skip (those without peaks) are left out.'''
+	def read_spectra(self, indices):
+		
+		lines = []
+		with open(self.path, 'rb') as file:
+			for index in indices:
+				file.seek(self.offsets[index])
+				for line in file:
+					lines.append(line.decode("utf-8", "replace"))
+					if(b"END IONS" in line):
+						break
+		return list(mgfParser.iter_spectra(lines)) #the blocks are parsed together so they share a MassTableIndex
+	
+	'''Returns a list of the spectra with the given title (usually just one).'''
+	def get_by_title(self, title):
+		return self.read_spectra(self.find_title(title))
+	
+	'''Returns a list of the spectra with a PEPMASS in [lower, upper], in the order of the file.'''
+	def get_by_mass_range(self, lower, upper):
+		return self.read_spectra(self.find_mass_range(lower, upper))
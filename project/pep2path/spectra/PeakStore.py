@@ -0,0 +1,176 @@
+import os
+import tempfile
+import numpy as np
+
+try:
+	from multiprocessing import shared_memory, resource_tracker
+except ImportError: #only in Python 3.8+, otherwise we fall back to a memory-mapped temporary file
+	shared_memory = None
+
+'''Class to hold the mass spectrometry readings of many spectra in one block of memory that other processes can attach to without copying it,
+	either a multiprocessing.shared_memory block or (if that isn't available) a memory-mapped temporary file.
+	
+	The readings of every spectrum are stacked into one N*2 array of floats (mass and intensity columns, like ms2peaks), 
+	and offsets gives where each spectrum's readings start and end, so each spectrum's ms2peaks can be a view of its rows.
+	Pickling a PeakStore only pickles the name of the block and the offsets, and unpickling it (e.g. in a worker process) attaches to the same block, 
+	with read-only views. The process that created it should call unlink when it's done with it, to free the block.
+	Each process only attaches to a block once, however many times stores of it are unpickled there (e.g. once for every chunk a pool worker is sent),
+	and only the process that created a block tracks it, so workers neither free it nor warn about it when they exit.
+	
+	A PeakStore can also just be held in ordinary (unshared) memory, as a columnar layout of the readings that operations on many spectra at once
+	can be vectorised over (see MassSpectraAggregate's use_columns). These pickle their readings like any other array.'''
+class PeakStore():
+
+	#Dictionary of pairs of (shared memory handle or None, readings) of the blocks this process has attached to by unpickling stores, under their names
+	attached = {}
+
+	def __init__(self, offsets, name, use_shared_memory, read_only=False, readings=None):
+		#NumPy array of length (number of spectra + 1), where the readings of spectrum i are rows offsets[i] to offsets[i+1] of the block
+		self.offsets = offsets
+		#String containing the name of the shared memory block, or the path of the memory-mapped file (or None if the store is in ordinary memory)
+		self.name = name
+		#Bool which is True if the block is shared memory, and False if it's a memory-mapped file
+		self.use_shared_memory = use_shared_memory
+		#Bool which is True if views of the block shouldn't be written to (as they are in processes that attach to it)
+		self.read_only = read_only
+		
+		if(readings is None):
+			self.__attach()
+		else: #in ordinary memory, so there's nothing to attach to
+			self.shared_memory = None
+			self.readings = readings
+		
+	def __str__(self):
+		return "PeakStore of %d spectra (%d readings) in %s" % (self.number_of_spectra(), self.offsets[-1], self.name)
+		
+	'''Maps the block into this process, as an N*2 array of readings. Read-only stores reuse the process's attachment to the block if it already has one.'''
+	def __attach(self):
+	
+		if(self.read_only and self.name in PeakStore.attached):
+			self.shared_memory, self.readings = PeakStore.attached[self.name]
+			return
+			
+		rows = int(self.offsets[-1])
+		if(self.use_shared_memory):
+			self.shared_memory = PeakStore.__open_untracked(self.name) if self.read_only else shared_memory.SharedMemory(name=self.name)
+			self.readings = np.ndarray((rows, 2), dtype=np.float64, buffer=self.shared_memory.buf)
+		else:
+			self.shared_memory = None
+			self.readings = np.memmap(self.name, dtype=np.float64, mode=("r" if self.read_only else "r+"), shape=(rows, 2)) if rows > 0 else np.zeros((0, 2))
+		if(self.read_only):
+			PeakStore.attached[self.name] = (self.shared_memory, self.readings)
+			
+	'''Attaches to the shared memory block with the given name without registering it with this process's resource tracker
+		(which would otherwise free it, or warn that it leaked, when the process exits, even though it belongs to the process that created it).'''
+	@staticmethod
+	def __open_untracked(name):
+		try:
+			return shared_memory.SharedMemory(name=name, track=False) #Python 3.13+
+		except TypeError:
+			pass
+		register = resource_tracker.register
+		resource_tracker.register = lambda name, rtype: None
+		try:
+			return shared_memory.SharedMemory(name=name)
+		finally:
+			resource_tracker.register = register
+			
+	'''Only the name of the block and the offsets are pickled, not the readings (unless the store is in ordinary memory).'''
+	def __getstate__(self):
+		return {"offsets" : self.offsets, "name" : self.name, "use_shared_memory" : self.use_shared_memory, "readings" : (None if self.is_shared() else self.readings)}
+		
+	'''Attaches to the block when unpickled, with read-only views.'''
+	def __setstate__(self, state):
+		self.__init__(state["offsets"], state["name"], state["use_shared_memory"], read_only=state["readings"] is None, readings=state["readings"])
+		
+	'''Creates a new block holding the readings in a list of arrays (one per spectrum, in the format of ms2peaks), returning a PeakStore of it.
+		Shared memory is used if use_shared_memory is True and it's available, otherwise a memory-mapped temporary file is.
+		If in_memory is True, the readings are just held in an ordinary array instead.'''
+	@staticmethod
+	def from_arrays(peak_arrays, use_shared_memory=True, in_memory=False):
+	
+		peak_arrays = [np.asarray(peaks, dtype=np.float64).reshape(-1, 2) for peaks in peak_arrays] #empty spectra have one-dimensional empty arrays
+		offsets = np.zeros(len(peak_arrays) + 1, dtype=np.int64)
+		offsets[1:] = np.cumsum([len(peaks) for peaks in peak_arrays])
+		readings = np.concatenate(peak_arrays) if len(peak_arrays) > 0 else np.zeros((0, 2))
+		return PeakStore.from_readings(readings, offsets, use_shared_memory=use_shared_memory, in_memory=in_memory)
+		
+	'''Creates a new PeakStore holding an N*2 array of the readings of every spectrum stacked together, where offsets gives where each spectrum's readings start and end.
+		Takes the same options as from_arrays. If in_memory is True, the array given is used as it is rather than copied.'''
+	@staticmethod
+	def from_readings(readings, offsets, use_shared_memory=True, in_memory=False):
+	
+		if(in_memory):
+			return PeakStore(offsets, None, False, readings=readings)
+	
+		size = max(int(offsets[-1]) * 2 * 8, 1) #blocks can't be empty
+		
+		block, name = None, None
+		if(use_shared_memory and shared_memory is not None):
+			try:
+				block = shared_memory.SharedMemory(create=True, size=size)
+				name = block.name
+			except OSError: #e.g. no /dev/shm
+				block = None
+		if(block is None):
+			use_shared_memory = False
+			descriptor, name = tempfile.mkstemp(prefix="peakstore", suffix=".dat")
+			os.close(descriptor)
+			np.memmap(name, dtype=np.uint8, mode="w+", shape=(size,)).flush()
+			
+		peak_store = PeakStore(offsets, name, use_shared_memory)
+		if(block is not None):
+			block.close() #the store has its own handle on the block
+		peak_store.readings[:, :] = readings
+		return peak_store
+		
+	'''Returns whether the store is in a block other processes can attach to (rather than ordinary memory).'''
+	def is_shared(self):
+		return self.name is not None
+		
+	'''Returns the number of spectra in the store.'''
+	def number_of_spectra(self):
+		return len(self.offsets) - 1
+		
+	'''Returns an array of the number of readings of each spectrum.'''
+	def counts(self):
+		return np.diff(self.offsets)
+		
+	'''Returns an array of the index of the spectrum each reading belongs to.'''
+	def segment_ids(self):
+		return np.repeat(np.arange(self.number_of_spectra()), self.counts())
+		
+	'''Returns a view of the readings of the spectrum at the given index (without copying them).'''
+	def peaks(self, index):
+		view = self.readings[self.offsets[index]:self.offsets[index+1], :]
+		if(self.read_only):
+			view = view.view()
+			view.flags.writeable = False
+		return view
+		
+	'''Returns whether an array is exactly the view of the readings of the spectrum at the given index 
+		(rather than e.g. a sorted or filtered copy of them).'''
+	def holds(self, index, array):
+		view = self.readings[self.offsets[index]:self.offsets[index+1], :]
+		return (isinstance(array, np.ndarray) and array.shape == view.shape and array.strides == view.strides
+					and array.__array_interface__["data"][0] == view.__array_interface__["data"][0])
+					
+	'''Frees the block (in the process that created it). Views of it that still exist in this process keep working, but no other process can attach to it.'''
+	def unlink(self):
+		self.readings = None
+		if(not self.is_shared()):
+			return
+		attached_memory, attached_readings = PeakStore.attached.pop(self.name, (None, None))
+		if(attached_memory is not None):
+			try:
+				attached_memory.close()
+			except BufferError:
+				pass
+		if(self.use_shared_memory):
+			self.shared_memory.unlink()
+			try:
+				self.shared_memory.close()
+			except BufferError: #some views of it are still around, so it'll be unmapped when they're gone
+				pass
+		elif(os.path.exists(self.name)):
+			os.remove(self.name)
@@ -0,0 +1,117 @@
+import os
+import hashlib
+
+from . import packedSpectra
+from ..genbank import fileSaving
+
+'''Class for a persistent on-disk cache of parsed spectra files, so that they only have to be parsed once rather than on every run.
+	Each source file's parse result is kept as one packed file (see packedSpectra) named after the file's absolute path, whose header records the file's
+	fingerprint (absolute path, size and modification time); an entry whose fingerprint no longer matches its source is stale, and is thrown away and replaced.
+	Warm loads memory-map the readings of an entry rather than parsing any text.
+	
+	The cache is kept under max_size bytes by removing the least recently used entries (entries are touched whenever they're used) after every new entry.'''
+class SpectraCache():
+	
+	#Default directory entries are kept in
+	DEFAULT_DIRECTORY = os.path.join(os.path.dirname(__file__), "spectraCache")
+	#Default maximum size of the cache in bytes
+	DEFAULT_MAX_SIZE = 2**30
+	#Extension of entries in the cache directory
+	EXTENSION = ".spectra"
+	
+	def __init__(self, directory=None, max_size=None):
+		#String containing the path of the directory entries are kept in (which is created when the first entry is stored)
+		self.directory = SpectraCache.DEFAULT_DIRECTORY if directory is None else directory
+		#Int of the most bytes the entries may take up together (after which the least recently used are removed)
+		self.max_size = SpectraCache.DEFAULT_MAX_SIZE if max_size is None else max_size
+	
+	def __str__(self):
+		return "SpectraCache in %s (%d of %d bytes used)" % (self.directory, self.size(), self.max_size)
+	
+	'''Returns the path of the entry for a source file parsed as the given kind (e.g. "ms" or "mgf").'''
+	def entry_path(self, path, kind):
+		key = hashlib.sha1((kind + "\0" + os.path.abspath(path)).encode("utf-8")).hexdigest()
+		return os.path.join(self.directory, key + SpectraCache.EXTENSION)
+	
+	'''Returns the parsed contents of the source file at path, from its entry if there's an up to date one,
+		otherwise by parsing it (with parse, a function taking the open file) and storing the result as a new entry.
+		pack turns a parse result into a pair of (a list of JSON-serialisable metadata, a list of arrays of readings in the format of ms2peaks),
+		and unpack(metadata, peak_arrays) turns them back into a parse result, where the arrays are views of the memory-mapped entry.'''
+	def load(self, path, kind, parse, pack, unpack):
+		
+		fingerprint = fileSaving.fingerprint(path)
+		entry = self.entry_path(path, kind)
+		
+		cached = self.read_entry(entry, kind, fingerprint)
+		if(cached is not None):
+			return unpack(*cached)
+		
+		file = open(path, 'r')
+		parsed = parse(file)
+		file.close()
+		
+		metadata, peak_arrays = pack(parsed)
+		self.store(entry, kind, fingerprint, metadata, peak_arrays)
+		return parsed
+	
+	'''Returns a pair of (metadata, list of arrays of readings) from an entry, or None if there isn't one (or it's stale or unreadable, in which case it's removed).'''
+	def read_entry(self, entry, kind, fingerprint):
+		
+		try:
+			header, readings = packedSpectra.read_packed(entry)
+		except (OSError, ValueError, KeyError):
+			self.remove(entry)
+			return None
+		
+		if(header.get("kind") != kind or header.get("source") != fingerprint): #the source has changed since
+			self.remove(entry)
+			return None
+		
+		os.utime(entry) #mark as recently used
+		return header["metadata"], [packedSpectra.spectrum_peaks(header, readings, index) for index in range(len(header["offsets"]) - 1)]
+	
+	'''Writes a new entry, then removes the least recently used others until the cache fits in max_size.'''
+	def store(self, entry, kind, fingerprint, metadata, peak_arrays):
+		os.makedirs(self.directory, exist_ok=True)
+		packedSpectra.write_packed(entry, {"kind" : kind, "source" : fingerprint, "metadata" : metadata}, peak_arrays)
+		self.evict(keep=entry)
+	
+	'''Removes the least recently used entries until the cache fits in max_size (never removing the entry at keep).'''
+	def evict(self, keep=None):
+		
+		entries = []
+		for name in os.listdir(self.directory):
+			if(name.endswith(SpectraCache.EXTENSION)):
+				try:
+					stat = os.stat(os.path.join(self.directory, name))
+				except OSError: #removed by someone else
+					continue
+				entries.append((stat.st_mtime_ns, stat.st_size, os.path.join(self.directory, name)))
+		
+		size = sum([entry_size for _, entry_size, _ in entries])
+		for _, entry_size, entry in sorted(entries):
+			if(size <= self.max_size):
+				break
+			if(entry != keep):
+				self.remove(entry)
+				size -= entry_size
+	
+	'''Returns the number of bytes the entries take up together.'''
+	def size(self):
+		if(not os.path.isdir(self.directory)):
+			return 0
+		return sum([os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory) if name.endswith(SpectraCache.EXTENSION)])
+	
+	'''Removes an entry (if it exists).'''
+	def remove(self, entry):
+		try:
+			os.remove(entry)
+		except OSError:
+			pass
+	
+	'''Removes every entry.'''
+	def clear(self):
+		if(os.path.isdir(self.directory)):
+			for name in os.listdir(self.directory):
+				if(name.endswith(SpectraCache.EXTENSION)):
+					self.remove(os.path.join(self.directory, name))
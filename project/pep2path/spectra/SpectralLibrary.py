@@ -0,0 +1,126 @@
+import os
+import glob
+import fnmatch
+
+from . import packedSpectra
+from . import massSpectraParser
+from . import mgfParser
+from .MassSpectrum import MassSpectrum
+from .MassSpectraAggregate import MassSpectraAggregate
+from .MassTableIndex import MassTableIndex
+from .masstables import AA_mass_table
+
+'''Class for a packed spectral library: every spectrum from a directory of .ms and .mgf files packed into one indexed file (see packedSpectra),
+	so they can all be loaded with one open rather than thousands, and any one fetched by its id without looking at the rest.
+	The header is a table of every spectrum's metadata (its id, the file it came from, which parser read it and its parsed fields),
+	and the readings of every spectrum are stored one after another, memory-mapped when the library is opened.
+	
+	Spectra from .ms files have the file's name as their id (as spectraMain's setup_mass_spectra gives them), and spectra from .mgf files have their TITLE.
+	Create one with pack, or "python main.py pack <directory> <library file>".'''
+class SpectralLibrary():
+	
+	#Value of "kind" in the header of a library file
+	KIND = "library"
+	#File name patterns packed by default
+	DEFAULT_PATTERNS = ["*.ms", "*.mgf"]
+	
+	def __init__(self, path):
+		#String containing the path of the library file
+		self.path = path
+		
+		header, readings = packedSpectra.read_packed(path)
+		if(header.get("kind") != SpectralLibrary.KIND):
+			raise ValueError("Not a spectral library: " + str(path))
+		#Dictionary of the header of the library file (see pack)
+		self.header = header
+		#N*2 NumPy array of the readings of every spectrum, memory-mapped copy-on-write
+		self.readings = readings
+		#Dictionary of the index of each spectrum in the library under its id (the first, if several have the same id)
+		self.index = {}
+		for index, metadata in enumerate(header["spectra"]):
+			self.index.setdefault(metadata["id"], index)
+		#MassTableIndex of each parser's mass table, shared by every spectrum made from the library
+		self.mass_table_indices = {"ms" : MassTableIndex(AA_mass_table), "mgf" : MassTableIndex(mgfParser.AA_mass_table)}
+	
+	def __str__(self):
+		return "SpectralLibrary of %d spectra from %d files in %s" % (len(self), len(self.header["sources"]), self.path)
+	
+	def __len__(self):
+		return len(self.header["spectra"])
+	
+	def __contains__(self, id):
+		return id in self.index
+	
+	'''Packs every file in a directory matching any of the patterns (in glob order) into a library file at library_path, and returns the SpectralLibrary of it.'''
+	@staticmethod
+	def pack(directory, library_path, patterns=None):
+		
+		patterns = SpectralLibrary.DEFAULT_PATTERNS if patterns is None else patterns
+		spectra, peak_arrays, sources = [], [], []
+		
+		for pattern in patterns:
+			for filename in glob.glob(os.path.join(directory, pattern)):
+				
+				source = os.path.basename(filename)
+				sources.append(source)
+				if(filename.endswith(".mgf")):
+					for spectrum in mgfParser.load_file(filename).spectra:
+						spectra.append({"id" : spectrum.id, "source" : source, "kind" : "mgf",
+										"fields" : {"parent_mass" : spectrum.parent_mass, "ionization" : spectrum.ionization, "misc" : spectrum.misc}})
+						peak_arrays.append(spectrum.ms2peaks)
+				else:
+					metadata, record_peaks = massSpectraParser.pack_record(massSpectraParser.load_file(filename))
+					spectra.append({"id" : source, "source" : source, "kind" : "ms", "fields" : metadata[0]})
+					peak_arrays += record_peaks if len(record_peaks) > 0 else [[]]
+		
+		packedSpectra.write_packed(library_path, {"kind" : SpectralLibrary.KIND, "sources" : sources, "spectra" : spectra}, peak_arrays)
+		return SpectralLibrary(library_path)
+	
+	'''Returns a list of the ids of every spectrum in the library, in the order they were packed.'''
+	def ids(self):
+		return [metadata["id"] for metadata in self.header["spectra"]]
+	
+	'''Returns the readings of the spectrum at the given index in the library, as a view of the memory-mapped readings.'''
+	def peaks(self, index):
+		return packedSpectra.spectrum_peaks(self.header, self.readings, index)
+	
+	'''Returns the record of the .ms file with the given name, as massSpectraParser's parse_file gives it (or None if it isn't in the library).'''
+	def record(self, id):
+		index = self.index.get(id)
+		if(index is None or self.header["spectra"][index]["kind"] != "ms"):
+			return None
+		return massSpectraParser.unpack_record([dict(self.header["spectra"][index]["fields"])], [self.peaks(index)])
+	
+	'''Returns a list of tuples of the file name and record (see record) of every .ms file in the library whose name matches the pattern,
+		in the same form as massSpectraParser's load_files_from_dir. A pattern without wildcards is looked up directly rather than matched against every name.'''
+	def records(self, pattern="*.ms"):
+		if(not glob.has_magic(pattern)):
+			record = self.record(pattern)
+			return [(pattern, record)] if record is not None else []
+		return [(metadata["id"], self.record(metadata["id"])) for metadata in self.header["spectra"] if metadata["kind"] == "ms" and fnmatch.fnmatch(metadata["id"], pattern)]
+	
+	'''Returns a new MassSpectrum of the spectrum with the given id (or None if it isn't in the library), made as the parser of its file would make it.
+		Its readings are a copy-on-write view of the library, so nothing else is read.'''
+	def spectrum(self, id):
+		index = self.index.get(id)
+		return None if index is None else self.spectrum_at(index)
+	
+	'''Returns a new MassSpectrum of the spectrum at the given index in the library (see spectrum).'''
+	def spectrum_at(self, index):
+		
+		metadata = self.header["spectra"][index]
+		fields = metadata["fields"]
+		
+		if(metadata["kind"] == "mgf"):
+			return MassSpectrum(id=metadata["id"], parent_mass=fields["parent_mass"], ionization=fields["ionization"], ms2peaks=self.peaks(index),
+									mass_table=mgfParser.AA_mass_table, misc=dict(fields["misc"]), mass_table_index=self.mass_table_indices["mgf"])
+		return MassSpectrum(id=metadata["id"], compound=fields.get("compound", ""), formula=fields.get("formula", ""), parent_mass=fields.get("parentmass", 0.0),
+								ionization=fields.get("ionization", ""), inchi=fields.get("InChI", ""), inchi_key=fields.get("InChIKey", ""), smiles=fields.get("smiles", ""),
+								ms2peaks=self.peaks(index), mass_table=AA_mass_table, mass_table_index=self.mass_table_indices["ms"])
+	
+	'''Returns a MassSpectraAggregate of the spectra with the given ids (in that order, skipping any not in the library), or of every spectrum if ids is None.'''
+	def spectra(self, ids=None):
+		if(ids is None):
+			return MassSpectraAggregate([self.spectrum_at(index) for index in range(len(self))])
+		ids = [ids] if isinstance(ids, str) else ids
+		return MassSpectraAggregate([self.spectrum(id) for id in ids if id in self.index])
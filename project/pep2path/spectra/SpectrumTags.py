@@ -4,13 +4,17 @@ import itertools
 '''Class to contain all sequence tags from a spectrum.'''
 class SpectrumTags():
 
-	def __init__(self, id, longest_tag, tags):
+	def __init__(self, id, longest_tag, tags, tag_graph=None, complete=True):
 		#String containing id of the file this was generated from
 		self.id = id
 		#Int containing the length of the longest tag in the dictionary
 		self.longest_tag = longest_tag
 		#Dictionary containing tag lengths as keys and lists of tags as values i.e. {length:[tag]}
 		self.tags = tags
+		#TagGraph the tags were read out of (if it was kept), so more searches can be run on it without rebuilding it
+		self.tag_graph = tag_graph
+		#Bool which is False if the search was stopped early (because it ran out of time), in which case some tags may be missing
+		self.complete = complete
 		
 	def __str__(self):
 		return self.id + "\n" + "\n".join([("---Length: %d---" % length) + "\n" + "\n".join([str(tag) for tag in self.tags[length]]) for length in self.tags.keys()])
@@ -0,0 +1,176 @@
+import copy
+import numpy as np
+
+from .MassSpectrum import MassSpectrum
+
+'''Class for a lazy, non-destructive view of a MassSpectrum, which has the same filter, sort and normalise methods but only records them
+	rather than changing the readings: filters as a boolean mask over the spectrum's readings (or, once the readings have been sorted,
+	by dropping indices from the permutation), sorts as an array of the indices of the spectrum's readings in their new order,
+	and normalisations as a list of rescales. The spectrum itself is never changed.
+	
+	The readings are only materialised (as a new MassSpectrum, see materialise) when the tag search methods need them, so many views
+	with different parameters can be branched off one parsed spectrum for about a byte per reading each, rather than a copy of the whole spectrum.'''
+class SpectrumView():
+	
+	def __init__(self, spectrum):
+		#The MassSpectrum being viewed (which is never changed)
+		self.spectrum = spectrum
+		#Boolean NumPy array over the spectrum's readings of the ones that are left after filtering, or None if none have been filtered
+		#(only used until the readings are sorted, after which indices is)
+		self.mask = None
+		#NumPy array of the indices in the spectrum of the readings that are left, in their new order, or None if they haven't been reordered
+		self.indices = None
+		#List of tuples of (new max, old max, exact) of every normalisation, in the order they happened (see MassSpectrum's scale_intensities)
+		self.rescales = []
+		#Read-only NumPy array of the materialised readings, kept from the last time ms2peaks was read until the next transform (None if there isn't one)
+		self.__peaks = None
+	
+	def __str__(self):
+		return "View of " + str(self.materialise())
+	
+	'''Returns a new view of the same spectrum with the same transforms so far, which can then be changed independently.
+		Views never change their arrays in place (only replace them), so this doesn't copy any arrays.'''
+	def branch(self):
+		return copy.copy(self)
+	
+	'''Returns a new MassSpectrum of the readings left in the view in their current order (with mappings back to the spectrum's original layout,
+		as if the transforms had been done to it), leaving the spectrum being viewed alone.'''
+	def materialise(self):
+		
+		spectrum = copy.copy(self.spectrum) #everything that's changed is replaced rather than changed in place, so a shallow copy is enough
+		indices = self.__selected()
+		if(indices is not None):
+			spectrum.ms2peaks = self.spectrum.ms2peaks[indices, :]
+			spectrum.update_mappings(indices)
+		if(len(self.rescales) > 0):
+			spectrum.ms2peaks = np.array(spectrum.ms2peaks) if indices is None else spectrum.ms2peaks
+			spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = self.__intensities(spectrum.ms2peaks[:, MassSpectrum.INTENSITY])
+		return spectrum
+	
+	'''Helper to return an array of the indices in the spectrum of the readings left in the view, in their current order, or None if that's all of them in their original order.'''
+	def __selected(self):
+		if(self.indices is not None):
+			return self.indices
+		if(self.mask is not None):
+			return self.mask.nonzero()[0]
+		return None
+	
+	'''Helper to return the given intensities of readings of the spectrum with every normalisation so far applied to them.'''
+	def __intensities(self, intensities):
+		for new_max, old_max, exact in self.rescales:
+			intensities = MassSpectrum.scale_intensities(intensities, new_max, old_max, exact=exact)
+		return intensities
+	
+	'''Helper to return a column of the readings left in the view, in their current order.'''
+	def __column(self, column):
+		indices = self.__selected()
+		values = self.spectrum.ms2peaks[:, column] if indices is None else self.spectrum.ms2peaks[indices, column]
+		return self.__intensities(values) if column == MassSpectrum.INTENSITY else values
+	
+	################
+	###Properties###
+	################
+	
+	@property
+	def id(self):
+		return self.spectrum.id
+	
+	@property
+	def mass_table(self):
+		return self.spectrum.mass_table
+	
+	@property
+	def misc(self):
+		return self.spectrum.misc
+	
+	'''The MassTableIndex is only a cache of the mass table, so it's shared with the spectrum being viewed.'''
+	@property
+	def mass_table_index(self):
+		return self.spectrum.mass_table_index
+	
+	@mass_table_index.setter
+	def mass_table_index(self, mass_table_index):
+		self.spectrum.mass_table_index = mass_table_index
+	
+	'''Returns the readings left in the view, materialised as a new (read-only) array, so changes to them can't be mistaken for changes to the view.
+		The array is kept until the view's next transform, so reading it again doesn't materialise the readings again.'''
+	@property
+	def ms2peaks(self):
+		if(self.__peaks is None):
+			ms2peaks = self.materialise().ms2peaks
+			ms2peaks = ms2peaks.view() if ms2peaks is self.spectrum.ms2peaks else ms2peaks
+			ms2peaks.flags.writeable = False
+			self.__peaks = ms2peaks
+		return self.__peaks
+	
+	#############
+	###Methods###
+	#############
+	
+	'''Returns the MassTableIndex of the mass table of the spectrum being viewed (see MassSpectrum's get_mass_table_index).'''
+	def get_mass_table_index(self):
+		return self.spectrum.get_mass_table_index()
+	
+	'''Returns the current transformed indices to the original indices of the spectrum being viewed (as a list), as MassSpectrum's original_indices would.'''
+	def original_indices(self, indices):
+		return self.materialise().original_indices(indices)
+	
+	'''Returns the number of readings left in the view, without materialising them.'''
+	def peak_count(self):
+		indices = self.__selected()
+		return len(self.spectrum.ms2peaks) if indices is None else len(indices)
+	
+	'''Returns the maximum mass reading left in the view.'''
+	def max_mass(self):
+		return np.max(self.__column(MassSpectrum.MASS))
+	
+	'''Returns the maximum intensity reading left in the view.'''
+	def max_intensity(self):
+		return np.max(self.__column(MassSpectrum.INTENSITY))
+	
+	'''Records a sort of the readings in non-decreasing order of mass (in exactly the order MassSpectrum's sort_by_mass would give).'''
+	def sort_by_mass(self):
+		indices = self.__selected()
+		indices = np.arange(len(self.spectrum.ms2peaks)) if indices is None else indices
+		self.indices = indices[np.argsort(self.__column(MassSpectrum.MASS), axis=0)]
+		self.mask = None
+		self.__peaks = None
+	
+	'''Records a filter of the readings removing any with intensities less than the number given (see MassSpectrum's filter_intensity, including its default).'''
+	def filter_intensity(self, intensity_threshold=None):
+		
+		intensity_threshold = 0.05*self.max_intensity() if intensity_threshold is None else intensity_threshold #default value
+		if(self.indices is None):
+			above_threshold = self.__intensities(self.spectrum.ms2peaks[:, MassSpectrum.INTENSITY]) > intensity_threshold
+			self.mask = above_threshold if self.mask is None else (self.mask & above_threshold)
+		else:
+			self.indices = self.indices[self.__column(MassSpectrum.INTENSITY) > intensity_threshold]
+		self.__peaks = None
+	
+	'''Records a normalisation of the intensities so the max reading is equal to some value (see MassSpectrum's normalise_intensity).'''
+	def normalise_intensity(self, new_max=100, old_max=None, exact=False):
+		
+		new_max = 100 if new_max is None else new_max #default value
+		old_max = self.max_intensity() if old_max is None else old_max
+		self.rescales = self.rescales + [(new_max, old_max, exact)]
+		self.__peaks = None
+	
+	'''Materialises the view and builds its TagGraph (see MassSpectrum's build_tag_graph).'''
+	def build_tag_graph(self, *args, **kwargs):
+		return self.materialise().build_tag_graph(*args, **kwargs)
+	
+	'''Materialises the view and finds its sequence tags (see MassSpectrum's find_sequence_tags).'''
+	def find_sequence_tags(self, *args, **kwargs):
+		return self.materialise().find_sequence_tags(*args, **kwargs)
+	
+	'''Materialises the view and iterates over its sequence tags (see MassSpectrum's iter_sequence_tags).'''
+	def iter_sequence_tags(self, *args, **kwargs):
+		return self.materialise().iter_sequence_tags(*args, **kwargs)
+	
+	'''Materialises the view and finds its longest tags (see MassSpectrum's find_longest_tag).'''
+	def find_longest_tag(self, *args, **kwargs):
+		return self.materialise().find_longest_tag(*args, **kwargs)
+	
+	'''Materialises the view and checks whether it could have a tag of the given length (see MassSpectrum's can_reach_length).'''
+	def can_reach_length(self, *args, **kwargs):
+		return self.materialise().can_reach_length(*args, **kwargs)
@@ -30,10 +30,11 @@ class Tag():
 		return list(self.component_counts().keys())
 		
 	'''Expands the multiple-possibility brackets (e.g. [A, B, C]) in tag strings that are used in place of storing every individual tag 
-		(as this would cause them to be exponential in number).'''
+		(as this would cause them to be exponential in number).
+		Combinations of compounds bridging a missing peak (e.g. [A+B]) are kept together as one component (A+B).'''
 	@staticmethod
 	def expand_brackets(comp):
-		return ["".join([chr for chr in comp if chr.isalnum() or chr == '/']) for comp in comp.split(',')]
+		return ["".join([chr for chr in comp if chr.isalnum() or chr == '/' or chr == '+']) for comp in comp.split(',')]
 		
 	'''A function that expands any instance of multiple tag possibility into several sequence tags with definite possibilities.
 		So an example tag -A-[A, B, C]-B- will expand into tags -A-A-B-, -A-B-B-, -A-C-B-.
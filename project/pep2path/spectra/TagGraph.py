@@ -0,0 +1,95 @@
+import numpy as np
+
+'''Class to contain the graph of possible compounds between the peaks of a spectrum, which sequence tags are read out of.
+	(See MassSpectrum's find_sequence_tags for a description of the graph.)
+	
+	It's held in compressed sparse row (CSR) form: the edges leaving peak i are at positions indptr[i] to indptr[i+1] of indices (the peaks they go to) 
+	and residues (a bitmask of the compounds they could represent, with bit j standing for compounds[j]).
+	This is a lot smaller than a dictionary per peak with a list of compound names per edge, and it's just arrays, so it can be cached, saved and loaded,
+	and reused for as many tag searches on the same spectrum as you like (as long as the order of its readings doesn't change).'''
+class TagGraph():
+
+	def __init__(self, indptr, indices, residues, compounds):
+		#NumPy array of length (number of peaks + 1) giving the range of each peak's edges in indices and residues
+		self.indptr = indptr
+		#NumPy array containing the peak each edge goes to (edges from one peak are in the order they were discovered)
+		self.indices = indices
+		#NumPy array of uint8 with one row per edge, holding a little-endian packed bitmask (see np.packbits) of the compounds that edge could represent
+		self.residues = residues
+		#List of the names of the compounds that edges represent, in the order of the mass table the graph was built with
+		self.compounds = compounds
+		
+	def __str__(self):
+		return "\n".join([str(peak) + ": " + ", ".join([str(self.indices[edge]) + " " + str(self.edge_compounds(edge)) for edge in range(self.indptr[peak], self.indptr[peak+1])]) 
+							for peak in range(self.number_of_peaks())])
+							
+	'''Builds a graph from arrays of edges given by their source peak, target peak and the index of the compound in compounds they represent,
+		ordered by source peak, then compound, then target peak (which is what MassSpectrum's edge discovery modes return).
+		Edges between the same pair of peaks are merged into one edge representing all of their compounds,
+		and only the compounds that some edge represents are kept (so the bitmasks stay small even with huge lists of compounds, like combinations of compounds).'''
+	@staticmethod
+	def from_edges(number_of_peaks, sources, targets, residues, compounds):
+	
+		pairs, first_edges, pair_of_edge = np.unique(sources.astype(np.int64) * number_of_peaks + targets, return_index=True, return_inverse=True)
+		
+		#keep each peak's edges in the order they were first discovered in (sources are already in order, so this only reorders edges within a peak)
+		order = np.argsort(first_edges, kind="stable")
+		rank = np.empty(len(order), dtype=np.int64)
+		rank[order] = np.arange(len(order))
+		pairs = pairs[order]
+		
+		used_residues, residues = np.unique(residues, return_inverse=True)
+		masks = np.zeros((len(pairs), len(used_residues)), dtype=bool)
+		masks[rank[pair_of_edge.reshape(-1)], residues.reshape(-1)] = True
+		
+		indptr = np.zeros(number_of_peaks + 1, dtype=np.int64)
+		indptr[1:] = np.cumsum(np.bincount(pairs // max(number_of_peaks, 1), minlength=number_of_peaks))
+		indices = (pairs % max(number_of_peaks, 1)).astype(np.int32)
+		
+		return TagGraph(indptr, indices, np.packbits(masks, axis=1, bitorder="little"), [compounds[residue] for residue in used_residues])
+		
+	'''Returns the number of peaks (vertices) in the graph.'''
+	def number_of_peaks(self):
+		return len(self.indptr) - 1
+		
+	'''Returns the number of edges in the graph.'''
+	def number_of_edges(self):
+		return len(self.indices)
+		
+	'''Returns the number of bytes used by the graph's arrays.'''
+	def nbytes(self):
+		return self.indptr.nbytes + self.indices.nbytes + self.residues.nbytes
+		
+	'''Returns an array of the peaks that the given peak has edges to.'''
+	def successors(self, peak):
+		return self.indices[self.indptr[peak]:self.indptr[peak+1]]
+		
+	'''Returns an array of the number of edges going into each peak.'''
+	def in_degrees(self):
+		return np.bincount(self.indices, minlength=self.number_of_peaks())
+		
+	'''Returns a list of the names of all the compounds the given edge could represent, in mass table order.'''
+	def edge_compounds(self, edge):
+		bits = np.unpackbits(self.residues[edge], count=len(self.compounds), bitorder="little")
+		return [self.compounds[residue] for residue in bits.nonzero()[0]]
+		
+	'''Returns a list of the compound lists of every edge. Edges usually only have one of a few different bitmasks, so each one is only decoded once.'''
+	def all_edge_compounds(self):
+		decoded = {}
+		edge_compounds = []
+		for mask in self.residues:
+			key = mask.tobytes()
+			if(not key in decoded):
+				decoded[key] = [self.compounds[residue] for residue in np.unpackbits(mask, count=len(self.compounds), bitorder="little").nonzero()[0]]
+			edge_compounds.append(decoded[key])
+		return edge_compounds
+		
+	'''Saves the graph to the given file (or file path) in NumPy's .npz format.'''
+	def save(self, file):
+		np.savez(file, indptr=self.indptr, indices=self.indices, residues=self.residues, compounds=np.array(self.compounds, dtype=str))
+		
+	'''Loads a graph saved with save from the given file (or file path).'''
+	@staticmethod
+	def load(file):
+		with np.load(file) as data:
+			return TagGraph(data["indptr"], data["indices"], data["residues"], [str(compound) for compound in data["compounds"]])
\ No newline at end of file
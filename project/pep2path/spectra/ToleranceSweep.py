@@ -0,0 +1,89 @@
+import copy
+import numpy as np
+
+from .MassSpectrum import MassSpectrum
+from .TagGraph import TagGraph
+
+'''Class to find the sequence tags of a spectrum under several configurations of (mass tolerance mode, mass threshold, intensity threshold) at once,
+	as in a parameter sweep, without running the whole filter and tag search pipeline once per configuration.
+	
+	The edges of the tag graph are found once, over the peaks left by the lowest intensity threshold, with every compound's tolerance window 
+	widened to cover its window in every configuration. Each edge is stored with its mass difference and the intensities of the peaks at its ends,
+	so the tag graph of each configuration is just the edges that pass that configuration's intensity threshold and (exact) tolerance windows,
+	which is a cheap vectorised mask rather than another edge search.
+	The results are exactly the same as filtering a copy of the spectrum by intensity and calling find_sequence_tags on it for each configuration.'''
+class ToleranceSweep():
+
+	def __init__(self, spectrum, configurations, edge_mode=None, max_residues=1):
+	
+		edge_mode = MassSpectrum.SEARCHSORTED_EDGES if edge_mode is None else edge_mode #default value
+	
+		#The MassSpectrum being swept (which is never changed)
+		self.spectrum = spectrum
+		#List of tuples of (mass tolerance mode, mass threshold, intensity threshold), where intensity thresholds are absolute as in MassSpectrum's filter_intensity
+		#(None meaning its default)
+		self.configurations = configurations
+		#Largest number of compounds a gap can be matched to a combination of (see MassSpectrum's find_sequence_tags)
+		self.max_residues = max_residues
+		
+		intensity_thresholds = [self.__intensity_threshold(intensity_threshold) for _, _, intensity_threshold in configurations]
+		
+		#Copy of the spectrum filtered by the lowest intensity threshold, whose peaks every configuration's peaks are a subset of (in the same order)
+		self.base = self.filtered_spectrum(min(intensity_thresholds) if len(intensity_thresholds) > 0 else None)
+		
+		#every configuration's windows are worked out on the base spectrum, which has the largest max mass of any of them, so they're at least as wide
+		windows = [self.base.mass_thresholds(mass_tolerance_mode, mass_threshold, max_residues=max_residues) for mass_tolerance_mode, mass_threshold, _ in configurations]
+		self.compounds = windows[0][0] if len(windows) > 0 else []
+		lower_thresholds = np.min([lower for _, lower, _ in windows], axis=0) if len(windows) > 0 else np.array([], dtype=float)
+		upper_thresholds = np.max([upper for _, _, upper in windows], axis=0) if len(windows) > 0 else np.array([], dtype=float)
+		
+		#Arrays of the source peak, target peak and compound index of every edge found with the widest windows (peaks are indices in base)
+		self.sources, self.targets, self.residues = edge_mode(self.base, lower_thresholds, upper_thresholds)
+		
+		masses = self.base.ms2peaks[:, MassSpectrum.MASS] if len(self.base.ms2peaks) > 0 else np.array([], dtype=float)
+		intensities = self.base.ms2peaks[:, MassSpectrum.INTENSITY] if len(self.base.ms2peaks) > 0 else np.array([], dtype=float)
+		
+		#Array of the mass difference of every edge (calculated exactly as the edge discovery modes do, so it's compared to the windows the same way)
+		self.mass_differences = masses[self.targets] - masses[self.sources]
+		#Arrays of the intensities of the peaks at each end of every edge
+		self.source_intensities = intensities[self.sources]
+		self.target_intensities = intensities[self.targets]
+		
+	'''Returns the absolute intensity threshold filter_intensity would use for the given one.'''
+	def __intensity_threshold(self, intensity_threshold):
+		return 0.05*self.spectrum.max_intensity() if intensity_threshold is None else intensity_threshold
+		
+	'''Returns a copy of the spectrum filtered by the given intensity threshold (as with filter_intensity), leaving the spectrum itself alone.'''
+	def filtered_spectrum(self, intensity_threshold):
+		filtered = copy.copy(self.spectrum) #filter_intensity replaces ms2peaks and mappings rather than changing them, so a shallow copy is enough
+		filtered.filter_intensity(intensity_threshold=self.__intensity_threshold(intensity_threshold))
+		return filtered
+		
+	'''Returns a pair of the spectrum filtered by the intensity threshold of the configuration at the given index, and the TagGraph of that configuration.'''
+	def tag_graph(self, index):
+	
+		mass_tolerance_mode, mass_threshold, intensity_threshold = self.configurations[index]
+		intensity_threshold = self.__intensity_threshold(intensity_threshold)
+		spectrum = self.filtered_spectrum(intensity_threshold)
+		compounds, lower_thresholds, upper_thresholds = spectrum.mass_thresholds(mass_tolerance_mode, mass_threshold, max_residues=self.max_residues)
+		
+		if(len(lower_thresholds) < 1 or len(self.sources) < 1):
+			return spectrum, TagGraph.from_edges(len(spectrum.ms2peaks), np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=int), compounds)
+			
+		keep = ((self.source_intensities > intensity_threshold) & (self.target_intensities > intensity_threshold)
+					& (self.mass_differences >= lower_thresholds[self.residues]) & (self.mass_differences <= upper_thresholds[self.residues]))
+					
+		#peaks in the filtered spectrum are the base peaks above the threshold, in the same order
+		kept_peaks = self.base.ms2peaks[:, MassSpectrum.INTENSITY] > intensity_threshold
+		new_indices = np.cumsum(kept_peaks) - 1
+		
+		return spectrum, TagGraph.from_edges(len(spectrum.ms2peaks), new_indices[self.sources[keep]], new_indices[self.targets[keep]], self.residues[keep], compounds)
+		
+	'''Returns a SpectrumTags object of the sequence tags for the configuration at the given index (see MassSpectrum's find_sequence_tags).'''
+	def find_sequence_tags(self, index, time_budget=None):
+		spectrum, tag_graph = self.tag_graph(index)
+		return spectrum.find_sequence_tags(tag_graph=tag_graph, time_budget=time_budget)
+		
+	'''Returns a list of SpectrumTags objects, one for each configuration.'''
+	def find_all_sequence_tags(self, time_budget=None):
+		return [self.find_sequence_tags(index, time_budget=time_budget) for index in range(len(self.configurations))]
@@ -0,0 +1,49 @@
+import io
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+'''Loads many spectra files at once for the parsers' load_files_from_dir: files are opened and read by a pool of threads,
+so slow storage always has reads waiting rather than idling while each file is parsed, and can optionally be parsed by a pool of processes.
+Results always come back in the order the files were given.'''
+
+#Default number of threads that read files at once
+DEFAULT_THREADS = 8
+
+#############
+###Workers###
+#############
+
+'''Parses the text of a file, given as one tuple (parse function, text), and returns the result.
+	This needs to be at module level so that it can be sent to a pool of worker processes.'''
+def parse_text(arguments):
+	parse, text = arguments
+	return parse(io.StringIO(text))
+	
+#####################
+###Loading Methods###
+#####################
+
+'''Returns a list of the results of load_file(filename, cache=cache, parse=...) for every filename, in the same order as filenames,
+	where load_file is one of the parsers' load_file functions and parse_file is its parse_file.
+	Files are loaded by a pool of threads (threads of them); if processes is more than 0, the text each thread reads is parsed in a pool of that many processes
+	(which only helps with big files, as the results have to be sent back). With 1 thread and no processes, files are loaded one after another as before.'''
+def load_files(filenames, load_file, parse_file, cache=None, threads=DEFAULT_THREADS, processes=0):
+
+	threads = 1 if threads is None or threads < 1 else threads
+	processes = 0 if processes is None else processes
+	if(threads == 1 and processes < 1):
+		return [load_file(filename, cache=cache) for filename in filenames]
+		
+	process_pool = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+	
+	def parse_in_process(file): #called from a thread, which waits for its file's result
+		return process_pool.submit(parse_text, (parse_file, file.read())).result()
+		
+	def load(filename):
+		return load_file(filename, cache=cache, parse=(None if process_pool is None else parse_in_process))
+		
+	try:
+		with ThreadPoolExecutor(max_workers=threads) as thread_pool:
+			return list(thread_pool.map(load, filenames))
+	finally:
+		if(process_pool is not None):
+			process_pool.shutdown()
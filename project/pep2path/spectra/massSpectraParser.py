@@ -2,6 +2,10 @@ import os
 import glob
 import numpy as np
 
+from .MassSpectrum import MassSpectrum
+from .SpectraCache import SpectraCache
+from . import fileLoading
+
 '''Takes a directory and a pattern to find files by, 
 parses them line by line according to parsing modes in dictionary (reads them as a single string by default)
 and loads them into:
@@ -21,9 +25,9 @@ def default_parser(dict, key, split_line):
 def float_parser(dict, key, split_line):
 	dict[key] = float(split_line[0])
 	
-'''Parses line as one in a list of arrays of size 2 of related data items separated by spaces'''
-def ms2peaks_parser(dict, key, split_line):
-	dict[key] += [np.array((split_line[0], split_line[1]), dtype=float)]
+'''Collects the (unsplit) line as one of a block of mass peak readings, which are all converted at once at cleanup'''
+def ms2peaks_parser(dict, key, line):
+	dict[key].append(line)
 	
 '''Parses line as a single instance of multiple data items, delimited by spaces'''
 def list_parser(dict, key, split_line):
@@ -41,13 +45,17 @@ parsing_modes = {
 					"ms2peaks": ms2peaks_parser
 				}
 				
+'''Fields whose lines are passed to their parser as they are (as text, rather than split into a list), 
+	so that big blocks of lines can be collected quickly and converted in one go at cleanup.'''
+raw_line_fields = ["ms2peaks"]
+				
 #########################
 ###Line Parser Cleanup###
 #########################
 
-'''Casts ms2peaks list to array at the end, once it's done being read in'''
+'''Converts the collected ms2peaks lines to an array at the end, once it's done being read in (see MassSpectrum's parse_peaks)'''
 def ms2peaks_cleanup(dict, key):
-	dict[key] = np.array(dict[key], dtype=float)
+	dict[key] = MassSpectrum.parse_peaks(dict[key])
 
 ###############################
 ###Cleanup Lookup Dictionary###
@@ -60,6 +68,23 @@ cleanup_dict = {
 					"ms2peaks": ms2peaks_cleanup
 				}
 
+##############################
+###Cache Conversion Methods###
+##############################
+
+'''Turns a parsed record into the metadata and arrays of readings a SpectraCache keeps (the readings are left out of the metadata, as None).'''
+def pack_record(record):
+	if("ms2peaks" not in record):
+		return [record], []
+	return [dict(record, ms2peaks=None)], [record["ms2peaks"]]
+	
+'''Turns the metadata and arrays of readings from a SpectraCache back into a record.'''
+def unpack_record(metadata, peak_arrays):
+	record = metadata[0]
+	if("ms2peaks" in record):
+		record["ms2peaks"] = peak_arrays[0]
+	return record
+
 ################################				
 ###Whole File Parsing Methods###
 ################################
@@ -73,8 +98,13 @@ def parse_file(file):
 	line_parser = default_parser
 	
 	field = "" #names of data type
+	raw_lines = False #whether the field's lines are passed on unsplit
 
 	for line in file:
+	
+		if(raw_lines and '>' not in line): #can't be a new field name, and blank lines are skipped when the block is converted
+			line_parser(record, field, line)
+			continue
 		
 		split_line = line.split()
 		if(len(split_line) < 1): #empty line - next
@@ -86,6 +116,7 @@ def parse_file(file):
 				cleanup_dict[field](record, field)
 		
 			field = split_line[0][1:] #take first item in line, remove preceding '>' denoting new field name
+			raw_lines = field in raw_line_fields
 			
 			#set new field to store data under
 			if(field in parsing_modes):
@@ -98,26 +129,39 @@ def parse_file(file):
 			if(len(split_line) < 1): #empty line - next
 				continue
 			
-		line_parser(record, field, split_line) #pass current line off for parsing
+		line_parser(record, field, " ".join(split_line) if raw_lines else split_line) #pass current line off for parsing
 		
 	if(field in cleanup_dict): #perform any necessary cleanup on last field before finishing with file
 		cleanup_dict[field](record, field)
 	
 	return record
 
-'''Takes a directory under path, and a file name pattern under pattern,
-	and feeds them all to the file parsing method for parsing.'''
-def load_files_from_dir(path=os.path.dirname(__file__), pattern="*.ms"):
-	
-	records = [] #each element is a dictionary representing a parsed file
+'''Parses the file at the given path, through a SpectraCache if one is given (so it's only parsed again if it's changed since it was last parsed).
+	parse is the function the open file is parsed with (parse_file by default).'''
+def load_file(path, cache=None, parse=None):
 
-	for filename in glob.glob(os.path.join(path, pattern)):
-
-		file = open(os.path.join(path, filename), 'r')
-		records += [(os.path.basename(filename),parse_file(file))]
-		file.close()
+	parse = parse_file if parse is None else parse
+	if(cache is not None):
+		return cache.load(path, "ms", parse, pack_record, unpack_record)
 		
-	return records
+	file = open(path, 'r')
+	record = parse(file)
+	file.close()
+	return record
+
+'''Takes a directory under path, and a file name pattern under pattern,
+	and feeds them all to the file parsing method for parsing.
+	By default parsed files are kept in the default SpectraCache, so they're only parsed again if they've changed;
+	cache can also be another SpectraCache, or False to always parse the files.
+	Files are read by a pool of threads (threads of them), and parsed in a pool of processes if processes is more than 0,
+	with the results still in the order of the glob (see fileLoading's load_files).'''
+def load_files_from_dir(path=os.path.dirname(__file__), pattern="*.ms", cache=True, threads=fileLoading.DEFAULT_THREADS, processes=0):
+	
+	cache = SpectraCache() if cache is True else (cache if cache else None)
+	filenames = glob.glob(os.path.join(path, pattern))
+	
+	records = fileLoading.load_files([os.path.join(path, filename) for filename in filenames], load_file, parse_file, cache=cache, threads=threads, processes=processes)
+	return [(os.path.basename(filename), record) for filename, record in zip(filenames, records)] #each element is a dictionary representing a parsed file
 	
 ##########
 ###Main###
@@ -4,6 +4,9 @@ import numpy as np
 
 from .MassSpectrum import MassSpectrum
 from .MassSpectraAggregate import MassSpectraAggregate
+from .MassTableIndex import MassTableIndex
+from .SpectraCache import SpectraCache
+from . import fileLoading
 
 '''Takes a directory and a pattern to find files by, 
 parses them line by line according to parsing modes in dictionary (reads them as a single string by default)
@@ -43,9 +46,9 @@ def default_parser(dict, key, values):
 def float_parser(dict, key, values):
 	dict[key] = float(values[0])
 	
-'''Parses line as one in a list of arrays of size 2 of related data items separated by spaces'''
+'''Parses the lines after the first as mass peak readings of two numbers separated by spaces, all converted at once (see MassSpectrum's parse_peaks)'''
 def ms2peaks_parser(dict, key, values):
-	dict[key] = np.array([np.array((line.split()[0], line.split()[1])) for line in values[1:]], dtype=float)
+	dict[key] = MassSpectrum.parse_peaks(values[1:])
 	
 '''Parses as a series of lines of text (i.e. unchanged)'''
 def block_parser(dict, key, values):
@@ -63,20 +66,40 @@ parsing_modes = {
 					"SCANS": ms2peaks_parser
 				}
 
+##############################
+###Cache Conversion Methods###
+##############################
+
+'''Turns an aggregate of parsed spectra into the metadata and arrays of readings a SpectraCache keeps.'''
+def pack_spectra(spectra_aggregate):
+	metadata = [{"id" : spectrum.id, "parent_mass" : spectrum.parent_mass, "ionization" : spectrum.ionization, "misc" : spectrum.misc} for spectrum in spectra_aggregate.spectra]
+	return metadata, [spectrum.ms2peaks for spectrum in spectra_aggregate.spectra]
+	
+'''Turns the metadata and arrays of readings from a SpectraCache back into an aggregate of spectra (sharing one MassTableIndex, as iter_spectra's do).'''
+def unpack_spectra(metadata, peak_arrays):
+	mass_table_index = MassTableIndex(AA_mass_table)
+	return MassSpectraAggregate([MassSpectrum(id=fields["id"],
+												parent_mass=fields["parent_mass"],
+												ionization=fields["ionization"],
+												ms2peaks=peaks,
+												mass_table=AA_mass_table,
+												misc=fields["misc"],
+												mass_table_index=mass_table_index) for fields, peaks in zip(metadata, peak_arrays)])
+
 ################################				
 ###Whole File Parsing Methods###
 ################################
 
-'''Given a file handle, parses the file line-by-line into a record,
-	using '=' to delineate field names,
-	which are then used to access parsing methods for the dictionary above'''
-def parse_file(file):
+'''Given a file handle, parses the file line-by-line, yielding a MassSpectrum for each BEGIN IONS/END IONS block as soon as its END IONS is read,
+	so only one spectrum is ever held in memory and files larger than memory can be searched as they're read (see iter_mgf).
+	Field names are delineated by '=', and are then used to access parsing methods for the dictionary above.
+	Every spectrum shares one MassTableIndex of the mass table.'''
+def iter_spectra(file):
 
 	named_fields = ["TITLE", "PEPMASS", "CHARGE", "SCANS"]
+	mass_table_index = MassTableIndex(AA_mass_table)
 
 	spectrum = {}
-	spectra = []
-	line_parser = default_parser
 	
 	field = "" #names of data type
 	data = []
@@ -87,6 +110,8 @@ def parse_file(file):
 		if("BEGIN IONS" in line):
 			in_spectrum = True
 			spectrum = {}
+			field = ""
+			data = []
 			continue
 			
 		if("END IONS" in line):
@@ -97,19 +122,20 @@ def parse_file(file):
 			data = []
 			misc = {}
 			
-			if(len(spectrum["SCANS"]) > 1):
-				for field, values in spectrum.items():
-					if(field in named_fields):
-						parsing_modes.get(field, default_parser)(spectrum, field, values)
+			if(len(spectrum.get("SCANS", [])) > 1):
+				for key, values in spectrum.items():
+					if(key in named_fields):
+						parsing_modes.get(key, default_parser)(spectrum, key, values)
 					else:
-						parsing_modes.get(field, default_parser)(misc, field, values)		
+						parsing_modes.get(key, default_parser)(misc, key, values)		
 					
-				spectra.append(MassSpectrum(id=spectrum.get("TITLE", ""),
-										parent_mass=spectrum.get("PEPMASS", 0.0),
-										ionization=spectrum.get("CHARGE", ""),
-										ms2peaks=spectrum.get("SCANS", np.array([])),
-										mass_table=AA_mass_table,
-										misc=misc))
+				yield MassSpectrum(id=spectrum.get("TITLE", ""),
+									parent_mass=spectrum.get("PEPMASS", 0.0),
+									ionization=spectrum.get("CHARGE", ""),
+									ms2peaks=spectrum.get("SCANS", np.array([])),
+									mass_table=AA_mass_table,
+									misc=misc,
+									mass_table_index=mass_table_index)
 			
 			continue
 			
@@ -122,21 +148,44 @@ def parse_file(file):
 				data = []
 			
 			data.append(line)
-	
-	return MassSpectraAggregate(spectra)
+			
+'''Given the path of an .mgf, opens it and yields a MassSpectrum for each of its spectra as it's read (see iter_spectra), closing it at the end.
+	Each can be searched for tags as it comes, e.g. with MassSpectraAggregate's iter_search_results, without holding the whole file in memory.'''
+def iter_mgf(path):
+	with open(path, 'r') as file:
+		for spectrum in iter_spectra(file):
+			yield spectrum
 
-'''Takes a directory under path, and a file name pattern under pattern,
-	and feeds them all to the file parsing method for parsing.'''
-def load_files_from_dir(path=os.path.join(os.path.dirname(__file__), "spectraData"), pattern="*.mgf"):
-	
-	spectra_aggregates = [] #each element is a filename and spectra aggregate of a single .mgf
+'''Given a file handle, parses every spectrum in the file (see iter_spectra) and loads them into a MassSpectraAggregate.'''
+def parse_file(file):
+	return MassSpectraAggregate(list(iter_spectra(file)))
+
+'''Parses the .mgf at the given path into a MassSpectraAggregate, through a SpectraCache if one is given (so it's only parsed again if it's changed since it was last parsed).
+	parse is the function the open file is parsed with (parse_file by default).'''
+def load_file(path, cache=None, parse=None):
 
-	for filename in glob.glob(os.path.join(path, pattern)):
-		file = open(os.path.join(path, filename), 'r')
-		spectra_aggregates.append((os.path.basename(filename), parse_file(file)))
-		file.close()
+	parse = parse_file if parse is None else parse
+	if(cache is not None):
+		return cache.load(path, "mgf", parse, pack_spectra, unpack_spectra)
 		
-	return spectra_aggregates
+	file = open(path, 'r')
+	spectra_aggregate = parse(file)
+	file.close()
+	return spectra_aggregate
+
+'''Takes a directory under path, and a file name pattern under pattern,
+	and feeds them all to the file parsing method for parsing.
+	By default parsed files are kept in the default SpectraCache, so they're only parsed again if they've changed;
+	cache can also be another SpectraCache, or False to always parse the files.
+	Files are read by a pool of threads (threads of them), and parsed in a pool of processes if processes is more than 0,
+	with the results still in the order of the glob (see fileLoading's load_files).'''
+def load_files_from_dir(path=os.path.join(os.path.dirname(__file__), "spectraData"), pattern="*.mgf", cache=True, threads=fileLoading.DEFAULT_THREADS, processes=0):
+	
+	cache = SpectraCache() if cache is True else (cache if cache else None)
+	filenames = glob.glob(os.path.join(path, pattern))
+	
+	spectra_aggregates = fileLoading.load_files([os.path.join(path, filename) for filename in filenames], load_file, parse_file, cache=cache, threads=threads, processes=processes)
+	return [(os.path.basename(filename), spectra_aggregate) for filename, spectra_aggregate in zip(filenames, spectra_aggregates)] #each element is a filename and spectra aggregate of a single .mgf
 	
 ##########
 ###Main###
@@ -0,0 +1,81 @@
+import os
+import json
+import numpy as np
+
+from ..genbank import fileSaving
+
+'''Reads and writes packed spectra files, which hold the parsed contents of spectra files in a compact binary form that can be memory-mapped
+rather than parsed again. A packed file is:
+	the magic bytes below,
+	the length of the header as an 8-byte little-endian integer,
+	the header, as UTF-8 JSON (a dictionary holding at least "offsets", see below, and whatever metadata the writer wants to keep with it),
+	padding up to a multiple of ALIGNMENT bytes,
+	the readings of every spectrum stacked into one N*2 array of little-endian float64s (mass and intensity columns, like ms2peaks),
+where the header's offsets are where each spectrum's readings start and end (so spectrum i is rows offsets[i] to offsets[i+1]).'''
+
+#Bytes every packed file starts with (the last is the version of the format)
+MAGIC = b"PEP2PKD\x01"
+#Number of bytes the readings are aligned to in the file
+ALIGNMENT = 64
+#Type the readings are stored as
+PEAK_DTYPE = np.dtype("<f8")
+
+####################
+###Packed Writing###
+####################
+
+'''Writes a list of arrays of readings (one per spectrum, in the format of ms2peaks) to a packed file at path, with the given header (a JSON-serialisable dictionary,
+	to which the offsets are added), so that it's never seen half-written (see genbank's fileSaving).'''
+def write_packed(path, header, peak_arrays):
+	
+	peak_arrays = [np.asarray(peaks, dtype=PEAK_DTYPE).reshape(-1, 2) for peaks in peak_arrays] #empty spectra have one-dimensional empty arrays
+	offsets = np.zeros(len(peak_arrays) + 1, dtype=np.int64)
+	offsets[1:] = np.cumsum([len(peaks) for peaks in peak_arrays])
+	
+	header = dict(header, offsets=offsets.tolist())
+	header_bytes = json.dumps(header).encode("utf-8")
+	start = len(MAGIC) + 8 + len(header_bytes)
+	padding = (-start) % ALIGNMENT
+	
+	with fileSaving.atomic_write(path, 'wb') as file:
+		file.write(MAGIC)
+		file.write(len(header_bytes).to_bytes(8, "little"))
+		file.write(header_bytes)
+		file.write(b"\0" * padding)
+		for peaks in peak_arrays:
+			file.write(peaks.tobytes())
+
+####################
+###Packed Reading###
+####################
+
+'''Returns a pair of the header of the packed file at path and the byte offset its readings start at, without reading the readings.
+	Raises ValueError if the file isn't a packed file (or is truncated).'''
+def read_header(path):
+	with open(path, 'rb') as file:
+		if(file.read(len(MAGIC)) != MAGIC):
+			raise ValueError("Not a packed spectra file: " + str(path))
+		length = int.from_bytes(file.read(8), "little")
+		header_bytes = file.read(length)
+		if(len(header_bytes) != length):
+			raise ValueError("Truncated packed spectra file: " + str(path))
+	start = len(MAGIC) + 8 + length
+	return json.loads(header_bytes.decode("utf-8")), start + ((-start) % ALIGNMENT)
+
+'''Returns a pair of the header of the packed file at path and an N*2 array of all its readings, which is memory-mapped copy-on-write
+	(so nothing is read until it's used, and changes to it are never written back to the file). Raises ValueError if the file isn't a packed file or is truncated.'''
+def read_packed(path):
+	
+	header, start = read_header(path)
+	rows = header["offsets"][-1]
+	if(rows < 1): #zero-length files can't be memory-mapped
+		return header, np.zeros((0, 2), dtype=PEAK_DTYPE)
+	if(os.path.getsize(path) < start + rows * 2 * PEAK_DTYPE.itemsize):
+		raise ValueError("Truncated packed spectra file: " + str(path))
+	return header, np.memmap(path, dtype=PEAK_DTYPE, mode='c', offset=start, shape=(rows, 2))
+
+'''Returns the readings of the spectrum at the given index from a header and array of readings given by read_packed, as a (plain NumPy) view of the array.
+	Spectra with no readings give an empty one-dimensional array, as the parsers do.'''
+def spectrum_peaks(header, readings, index):
+	start, end = header["offsets"][index], header["offsets"][index+1]
+	return readings[start:end].view(np.ndarray) if end > start else np.array([], dtype=float)
@@ -26,16 +26,16 @@ def setup_mass_spectra(file, mass_table=AA_mass_table):
 						ms2peaks=dict["ms2peaks"], 
 						mass_table=mass_table)
 						
-'''Convenience function to perform the multiple steps necessary to find tags and their ids.'''
-def find_longest_tag(path=os.path.join(os.path.dirname(__file__), "spectraData"), pattern="*.ms", 
-						intensity_thresholds=None,
-						mass_tolerance_mode=None, mass_threshold=0.00001):
+'''Convenience function to perform the multiple steps necessary to get spectra ready for tag searching: 
+	parsing, converting to objects, filtering by intensity and sorting by mass.
+	If a SpectralLibrary is given, the .ms records are taken from it instead of parsing the files under path (see SpectralLibrary's records).'''
+def load_spectra(path=os.path.join(os.path.dirname(__file__), "spectraData"), pattern="*.ms", intensity_thresholds=None, library=None):
 	
 	import time
 	
 	print("Starting to parse for pattern \"" + pattern + "\"...")
 	start = time.clock()
-	records = load_files_from_dir(path=path, pattern=pattern)
+	records = load_files_from_dir(path=path, pattern=pattern) if library is None else library.records(pattern)
 	print("Time taken: " + str(time.clock() - start))
 	
 	print("Converting to objects...")
@@ -56,9 +56,21 @@ def find_longest_tag(path=os.path.join(os.path.dirname(__file__), "spectraData")
 	spectra.sort_by_mass()
 	print("Time taken: " + str(time.clock() - start))
 	
+	return spectra
+						
+'''Convenience function to perform the multiple steps necessary to find tags and their ids.
+	If longest_only is True only the longest tags are searched for (see MassSpectraAggregate's find_longest_tag).'''
+def find_longest_tag(path=os.path.join(os.path.dirname(__file__), "spectraData"), pattern="*.ms", 
+						intensity_thresholds=None,
+						mass_tolerance_mode=None, mass_threshold=0.00001, longest_only=False):
+	
+	import time
+	
+	spectra = load_spectra(path=path, pattern=pattern, intensity_thresholds=intensity_thresholds)
+	
 	print("Finding longest tag...")
 	start = time.clock()
-	longest_tag, tags = spectra.find_longest_tag(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)
+	longest_tag, tags = spectra.find_longest_tag(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, longest_only=longest_only)
 	print("Time taken: " + str(time.clock() - start))
 	
 	print("Longest tag found: " + str(longest_tag) + "\n")
@@ -71,7 +83,7 @@ def print_longest_tags(path=os.path.join(os.path.dirname(__file__), "spectraData
 						mass_tolerance_mode=None, mass_threshold=0.00001):
 						
 	longest_tag, spectra_tags = find_longest_tag(path=path, pattern=pattern, intensity_thresholds=intensity_thresholds, 
-											mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)
+											mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, longest_only=True)
 				
 	spectra_tags = filter((lambda spectrum_tags : spectrum_tags.longest_tag == longest_tag), spectra_tags) #first get all spectra with the maximum tag lengths
 	for spectrum_tags in spectra_tags: #print the id of each spectrum, its longest tag length, and all tags with the longest tag length (which should be identical to local longest)
@@ -79,36 +91,54 @@ def print_longest_tags(path=os.path.join(os.path.dirname(__file__), "spectraData
 		for tag in spectrum_tags.tags[longest_tag]:	
 			print(tag)
 	
-'''Writes to "tags.out" on the specifed path all tags with the specified length and their spectrum id.'''	
+'''Writes to "tags.out" on the specifed path all tags with the specified length and their spectrum id.
+	Tags are streamed from each spectrum (see MassSpectrum's iter_sequence_tags), and only the ones that are going to be written are ever kept,
+	so this works on spectra with far too many tags to hold in memory.
+	By default only the longest tags are written, and the tag graphs built to find how long they are (see MassSpectraAggregate's find_longest_tag) are reused
+	to stream them rather than built again, skipping spectra without any tags that long.'''	
 def write_tags(path=os.path.join(os.path.dirname(__file__), "spectraData"), pattern="*.ms", 
 						intensity_thresholds=None,
 						mass_tolerance_mode=None, mass_threshold=0.00001,
 						lengths_to_print=None, output_path=os.path.join(os.path.dirname(__file__), "out"),
 						filename="tags.out"):
 						
-	longest_tag, spectra_tags = find_longest_tag(path=path, pattern=pattern, intensity_thresholds=intensity_thresholds, 
-											mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)
-								
-	lengths_to_print = [longest_tag] if lengths_to_print is None else lengths_to_print #default value
+	spectra = load_spectra(path=path, pattern=pattern, intensity_thresholds=intensity_thresholds)
+	
+	spectra_tags = [None for spectrum in spectra.spectra]
+	if(lengths_to_print is None): #default value, which only needs the length of the longest tag rather than every tag
+		longest_tag, spectra_tags = spectra.find_longest_tag(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, longest_only=True)
+		lengths_to_print = [longest_tag]
 	lengths_to_print = [lengths_to_print] if isinstance(lengths_to_print, str) else lengths_to_print #take string input
-	lengths_to_print = list(filter(lambda length : length <= longest_tag and length > 0, lengths_to_print)) #remove impossible indices
+	lengths_to_print = list(filter(lambda length : length > 0, lengths_to_print)) #remove impossible indices
 	
 	file = open(os.path.join(output_path, filename), 'w')
-	for spectrum_tags in spectra_tags: #print the id of each spectrum, the current tag length, and all tags with that length
+	for spectrum, spectrum_tags in zip(spectra.spectra, spectra_tags):
 	
-		for length in lengths_to_print:
+		if(spectrum_tags is not None and spectrum_tags.longest_tag not in lengths_to_print): #no tags as long as the longest (including spectra find_longest_tag skipped)
+			continue
+		id = spectrum.id
+		tags = spectrum.iter_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold, tag_graph=(None if spectrum_tags is None else spectrum_tags.tag_graph))
 		
-			if(length in spectrum_tags.tags.keys()):
+		#keep only the tags with lengths we want to print, so we can print them grouped by length
+		tags_to_print = {length:[] for length in lengths_to_print}
+		for tag in tags:
+			if(tag.length in tags_to_print):
+				tags_to_print[tag.length].append(tag)
+	
+		for length in lengths_to_print: #print the id of each spectrum, the current tag length, and all tags with that length
+		
+			if(len(tags_to_print[length]) > 0):
 			
-				file.write(str("---" + spectrum_tags.id) + " " + str(length) + "---\n")
+				file.write(str("---" + str(id)) + " " + str(length) + "---\n")
 				
-				for tag in spectrum_tags.tags[length]:	
+				for tag in tags_to_print[length]:	
 					file.write(str(tag) + "\n")
 		
 	file.close()
 
-'''Helper to take the mibig file and automatically write the contents of corresponding files to tags.out.'''	
-def mibig_parser(inpath=os.path.join(os.path.dirname(__file__), "spectraData")):
+'''Helper to take the mibig file and automatically write the contents of corresponding files to tags.out.
+	If a SpectralLibrary is given, each file is fetched from it by name rather than globbed for under inpath.'''	
+def mibig_parser(inpath=os.path.join(os.path.dirname(__file__), "spectraData"), library=None):
 
 	file = open(os.path.join(os.path.dirname(__file__), "mibig_gnps_links_q3.csv"), 'r')
 	filenames = [line.split(',')[1] + ".ms" for line in file]
@@ -120,16 +150,15 @@ def mibig_parser(inpath=os.path.join(os.path.dirname(__file__), "spectraData")):
 	mass_thresholds = [0.01, 0.001, 0.00001] *2
 	intensity_thresholds = [0.05, 0.005] *3
 	outs = ["mibig_hMass_hInten", "mibi_lMass_lInten", "mibig_ppmMass_hInten", "mibig_hMass_lInten", "mibig_lMass_hInten"]
-	zipped = zip(mass_tolerance_modes, mass_thresholds, intensity_thresholds, outs)
+	configurations = list(zip(mass_tolerance_modes, mass_thresholds, intensity_thresholds))[:len(outs)]
+	
+	#each file is only parsed once, and each spectrum's edges are only found once for every configuration (see MassSpectraAggregate's sweep_sequence_tags)
+	spectra = [load_spectra(path=inpath, pattern=filename, intensity_thresholds=0.0, library=library).spectra for filename in filenames] #only drop zero-intensity readings for now
+	spectra = MassSpectraAggregate(list(itertools.chain.from_iterable(spectra)))
+	swept_tags = spectra.sweep_sequence_tags(configurations, relative_intensity=True)
 	
 	outpath = os.path.join(os.path.dirname(__file__), "out")
-	for mass_tolerance_mode, mass_threshold, intensity_threshold, out in zipped:
-		
-		spectra_tags = [find_longest_tag(path=inpath, pattern=filename, intensity_thresholds=intensity_threshold, 
-											mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)[1]
-												for filename in filenames]
-												
-		spectra_tags = itertools.chain.from_iterable(spectra_tags) #flatten list of spectra tags
+	for spectra_tags, out in zip(swept_tags, outs):
 		
 		file = open(os.path.join(outpath, (out + ".out")), 'w')
 		for spectrum_tags in spectra_tags:
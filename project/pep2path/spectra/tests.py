@@ -1,14 +1,33 @@
 import os
+import io
+import glob
+import copy
+import pickle
+import shutil
+import tempfile
+import time
+import sys
+import types
 import numpy as np
 import random
 import string
 import itertools
-from collections import Counter
+from fractions import Fraction
+from collections import Counter, defaultdict
 
 from .MassSpectrum import MassSpectrum
-from .MassSpectraAggregate import MassSpectraAggregate
+from .MassSpectraAggregate import MassSpectraAggregate, iter_search_results
 from .Tag import Tag
 from .SpectrumTags import SpectrumTags
+from .TagGraph import TagGraph
+from .PeakStore import PeakStore
+from .MassTableIndex import MassTableIndex
+from .ToleranceSweep import ToleranceSweep
+from .SpectrumView import SpectrumView
+from . import mgfParser, massSpectraParser
+from .SpectraCache import SpectraCache
+from .SpectralLibrary import SpectralLibrary
+from .MgfIndex import MgfIndex
 
 from .masstables import AA_mass_table, AA_alphabet
 
@@ -109,6 +128,7 @@ def test_flatten_tags(alphabet=AA_alphabet):
 
 def test_mappings(trials=1000):
 	spectrum = MassSpectrum()
+	spectrum.keep_mapping_history()
 	array = np.array(range(trials))
 	for i in range(5):
 		indices = random.sample(range(trials), trials)
@@ -116,6 +136,15 @@ def test_mappings(trials=1000):
 		array = array[indices]
 	assert list(array) == list(spectrum.original_indices(range(trials))), "MassSpectrum does not map indices correctly!"
 	
+	history = np.array(range(trials))
+	for indices in reversed(spectrum.mapping_history):
+		history = history[indices]
+	assert list(history) == list(array), "MassSpectrum's mapping history doesn't compose to its mappings!"
+	
+	subset = random.sample(range(trials), trials // 2)
+	spectrum.update_mappings(subset)
+	assert list(array[subset]) == spectrum.original_indices(range(trials // 2)), "MassSpectrum does not map indices correctly after filtering!"
+	
 '''Tests correctness of MassSpectraAggregate's get_spectra_ids, attach_spectra_ids and get_spectra_by_id.'''
 def test_sequence_by_id_helpers():
 
@@ -277,12 +306,36 @@ def test_normalise_intensity():
 	new_maxes = [random.randint(100, 10000) for spectrum in spectra]
 	spectra_aggregate.normalise_intensity_local(new_maxes=new_maxes)
 	assert verify_max_local(spectra, new_maxes, MassSpectrum.INTENSITY), "normalise_intensity_local fails test!"
+	spectra_aggregate.normalise_intensity_local()
+	assert verify_max_local(spectra, [100 for spectrum in spectra], MassSpectrum.INTENSITY), "normalise_intensity_local fails test with its default maxes!"
 		
 	spectra, spectra_aggregate = generate_random_spectra([MassSpectrum.INTENSITY])
 	new_max = random.randint(100, 10000)
 	spectra_aggregate.normalise_intensity_global(new_max=new_max)
 	assert verify_max_global(spectra, [new_max for spectrum in spectra], MassSpectrum.INTENSITY), "normalise_intensity_global fails test!"
 	
+'''Tests that normalise_intensity is within its documented error bound of the exact (correctly-rounded) version, that the exact version is correctly rounded,
+	and that normalise_intensity_global gives the same intensities as normalising each spectrum with the global max.'''
+def test_normalise_intensity_precision():
+
+	spectra, spectra_aggregate = generate_random_spectra([MassSpectrum.INTENSITY])
+	new_max = random.uniform(1, 10000)
+	old_max = spectra_aggregate.max_intensity_global()
+	copies = [copy.deepcopy(spectrum) for spectrum in spectra]
+	exact_copies = [copy.deepcopy(spectrum) for spectrum in spectra]
+	
+	spectra_aggregate.normalise_intensity_global(new_max=new_max)
+	for spectrum, spectrum_copy, exact_copy in zip(spectra, copies, exact_copies):
+		exact = [float(Fraction(intensity) * Fraction(new_max) / Fraction(old_max)) for intensity in spectrum_copy.ms2peaks[:, MassSpectrum.INTENSITY]]
+		spectrum_copy.normalise_intensity(new_max=new_max, old_max=old_max)
+		exact_copy.normalise_intensity(new_max=new_max, old_max=old_max, exact=True)
+		
+		assert np.array_equal(spectrum.ms2peaks, spectrum_copy.ms2peaks), "normalise_intensity_global doesn't match normalise_intensity with the global max!"
+		assert exact_copy.ms2peaks[:, MassSpectrum.INTENSITY].tolist() == exact, "normalise_intensity with exact isn't correctly rounded!"
+		assert np.all(np.abs(spectrum_copy.ms2peaks[:, MassSpectrum.INTENSITY] - exact) <= 3 * 2.0**-53 * np.abs(exact)), "normalise_intensity isn't within its error bound!" #plus exact's own rounding
+		
+	assert verify_max_global(spectra, [new_max for spectrum in spectra], MassSpectrum.INTENSITY), "normalise_intensity_global doesn't make the max exact!"
+	
 '''Tests MassSpectrum's static_mass_tolerance, percentile_mass_tolerance and ppm_mass_tolerance.'''
 def test_mass_tolerance_calculations():
 
@@ -306,6 +359,36 @@ def test_mass_tolerance_calculations():
 				for mass_tolerance, spectrum in zip(mass_tolerances, spectra)])), \
 		   "ppm_mass_tolerance fails test!"
 	
+'''Helper to randomly generate tags in a spectrum, with extra peaks corresponding to nothing, and noise.
+	The generated tags are stored in the spectrum's misc dictionary under "printable_tags".'''
+def generate_tag_spectrum(mass_table=AA_mass_table, mass_threshold=0.001):
+	#generate the masses of a few mass tags to become a sequence tag, generate several 'sequence tags' this way
+	printable_tags = [[str(random.choice(list(mass_table.keys()))) for length in range(random.randint(2, 10))] for number in range(random.randint(1, 5))]
+	tags = [[mass_table[element] for element in tag] for tag in printable_tags]
+	
+	#first element in generated tag elements doesn't actually represent a difference, just a starting mass, so we exclude it from tag
+	printable_tags = [[element for element in tag][1:] for tag in printable_tags] 
+	
+	#turn tags into rolling sums to generate a 'walk' of mass peaks
+	tags = [np.cumsum(np.array(tag)) for tag in tags]
+	
+	#add some readings which shouldn't correspond to anything
+	upper_bound = max([np.max(tag) for tag in tags])
+	tags.append((upper_bound) * np.random.random(size=(random.randint(10, 20))))
+	
+	#now collapse into a single array and filter duplicates
+	tags = np.unique(np.concatenate(tags))
+
+	#add noise in range [mass_tolerance/2, mass_tolerance/2)
+	tags += (mass_threshold) * np.random.random(size=tags.shape) - mass_threshold
+
+	ms2peaks = np.zeros((tags.shape[0], 2))
+	ms2peaks[:, MassSpectrum.MASS] = tags
+	
+	printable_tags = ["-" + "-".join(tag) + "-" for tag in printable_tags]
+	
+	return MassSpectrum(ms2peaks=ms2peaks, mass_table=mass_table, misc={"printable_tags":printable_tags})
+	
 '''Tests MassSpectrum's find_sequence_tags and MassSpectraAggregate's longest_tag.'''
 def test_find_longest_tag(mass_table=AA_mass_table):
 
@@ -313,32 +396,7 @@ def test_find_longest_tag(mass_table=AA_mass_table):
 	
 	'''Helper to randomly generate tags in a spectrum, with extra peaks corresponding to nothing, and noise.'''
 	def generate_spectrum():
-		#generate the masses of a few mass tags to become a sequence tag, generate several 'sequence tags' this way
-		printable_tags = [[str(random.choice(list(mass_table.keys()))) for length in range(random.randint(2, 10))] for number in range(random.randint(1, 5))]
-		tags = [[mass_table[element] for element in tag] for tag in printable_tags]
-		
-		#first element in generated tag elements doesn't actually represent a difference, just a starting mass, so we exclude it from tag
-		printable_tags = [[element for element in tag][1:] for tag in printable_tags] 
-		
-		#turn tags into rolling sums to generate a 'walk' of mass peaks
-		tags = [np.cumsum(np.array(tag)) for tag in tags]
-		
-		#add some readings which shouldn't correspond to anything
-		upper_bound = max([np.max(tag) for tag in tags])
-		tags.append((upper_bound) * np.random.random(size=(random.randint(10, 20))))
-		
-		#now collapse into a single array and filter duplicates
-		tags = np.unique(np.concatenate(tags))
-	
-		#add noise in range [mass_tolerance/2, mass_tolerance/2)
-		tags += (mass_threshold) * np.random.random(size=tags.shape) - mass_threshold
-	
-		ms2peaks = np.zeros((tags.shape[0], 2))
-		ms2peaks[:, MassSpectrum.MASS] = tags
-		
-		printable_tags = ["-" + "-".join(tag) + "-" for tag in printable_tags]
-		
-		return MassSpectrum(ms2peaks=ms2peaks, mass_table=mass_table, misc={"printable_tags":printable_tags})
+		return generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold)
 		
 	'''Helper to generate spectra and spectra aggregate.'''
 	def generate_spectra():
@@ -370,7 +428,633 @@ def test_find_longest_tag(mass_table=AA_mass_table):
 	tag_lengths = [spectrum_tags.longest_tag for spectrum_tags in spectra_tags]
 	assert ((longest_tag == 0 or longest_tag == max(tag_lengths)) and all(returned_tags)), \
 		   "find_longest_tag fails test!"
+	
+'''Helper to reduce a SpectrumTags object to something that can be compared regardless of the order tags were found in.'''
+def tag_signature(spectrum_tags):
+	return {length:sorted([(tag.tag, tuple(tag.peaks)) for tag in tags]) for length, tags in spectrum_tags.tags.items()}
+	
+'''Tests that every edge discovery mode for MassSpectrum's find_sequence_tags gives exactly the same tags,
+	for every mass tolerance mode, whether or not the readings are sorted by mass.'''
+def test_edge_modes(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	edge_modes = [MassSpectrum.LOOP_EDGES, MassSpectrum.SEARCHSORTED_EDGES, MassSpectrum.BROADCAST_EDGES, 
+					lambda self, lower, upper: self.broadcast_edges(lower, upper, memory_budget=1)] #smallest possible budget forces one row per block
+	tolerances = [(MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold), (MassSpectrum.REL_PPM_MASS_TOLERANCE, 0.00001), (MassSpectrum.MAX_PPM_MASS_TOLERANCE, 0.00001)]
+	
+	spectrum = generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold)
+	shuffled = MassSpectrum(ms2peaks=spectrum.ms2peaks[np.random.permutation(spectrum.ms2peaks.shape[0]), :], mass_table=mass_table)
+	
+	for s in [spectrum, shuffled]:
+		for mass_tolerance_mode, threshold in tolerances:
+			signatures = [tag_signature(s.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=threshold, edge_mode=edge_mode)) for edge_mode in edge_modes]
+			assert all([signature == signatures[0] for signature in signatures]), "Edge discovery modes for find_sequence_tags don't agree!"
+			
+	assert tag_signature(MassSpectrum(mass_table=mass_table).find_sequence_tags()) == {}, "find_sequence_tags fails on an empty spectrum!"
+	
+	#combinations of residues give many more compounds, which broadcast_edges has to split into blocks within its budget too
+	compounds, lower_thresholds, upper_thresholds = spectrum.mass_thresholds(MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold, max_residues=2)
+	expected = spectrum.searchsorted_edges(lower_thresholds, upper_thresholds)
+	for memory_budget in [1, 3 * len(compounds) // 4, None]:
+		edges = spectrum.broadcast_edges(lower_thresholds, upper_thresholds, memory_budget=memory_budget)
+		assert all([np.array_equal(found, expected_edges) for found, expected_edges in zip(edges, expected)]), "broadcast_edges doesn't find every edge when it splits the compounds into blocks!"
+			
+'''Tests MassSpectrum's find_longest_tag and can_reach_length, and MassSpectraAggregate's find_longest_tag with longest_only,
+	against the longest tags found by enumerating every tag with find_sequence_tags.'''
+def test_longest_tag_only(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold) for i in range(random.randint(2, 5))]
+	
+	for spectrum in spectra:
+		spectrum_tags = spectrum.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+		longest = spectrum.find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+		witness = spectrum.find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, all_witnesses=False)
+		length = spectrum_tags.longest_tag
+		
+		assert longest.longest_tag == length and witness.longest_tag == length, "find_longest_tag doesn't find the longest tag length!"
+		assert tag_signature(longest) == {length:tag_signature(spectrum_tags)[length]}, "find_longest_tag doesn't find all of the longest tags!"
+		assert len(witness.tags[length]) == 1 and tag_signature(witness)[length][0] in tag_signature(spectrum_tags)[length], "find_longest_tag doesn't find a single longest tag!"
+		
+		assert spectrum.can_reach_length(length, mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold), "can_reach_length rules out the longest tag!"
+		assert not spectrum.can_reach_length(spectrum.ms2peaks.shape[0], mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold), \
+				"can_reach_length allows a tag longer than the number of peaks!"
+				
+	longest_tag, spectra_tags = MassSpectraAggregate(spectra).find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+	longest_only, longest_spectra_tags = MassSpectraAggregate(spectra).find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, longest_only=True)
+	assert longest_only == longest_tag, "MassSpectraAggregate's find_longest_tag with longest_only doesn't agree with the full search!"
+	assert all([tag_signature(l_tags).get(longest_tag, []) == tag_signature(s_tags).get(longest_tag, []) for l_tags, s_tags in zip(longest_spectra_tags, spectra_tags)]), \
+			"MassSpectraAggregate's find_longest_tag with longest_only doesn't find the same longest tags as the full search!"
+			
+'''Tests MassSpectrum's iter_sequence_tags against find_sequence_tags, and that it copes with a tag far longer than Python's recursion limit.'''
+def test_iter_sequence_tags(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	spectrum = generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold)
+	
+	tags = spectrum.iter_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+	assert isinstance(tags, types.GeneratorType), "iter_sequence_tags doesn't return a generator!"
+	
+	streamed = defaultdict(list)
+	for tag in tags: streamed[tag.length].append(tag)
+	spectrum_tags = spectrum.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+	assert tag_signature(SpectrumTags(spectrum.id, 0, streamed)) == tag_signature(spectrum_tags), "iter_sequence_tags doesn't give the same tags as find_sequence_tags!"
+	
+	length = sys.getrecursionlimit() + 10
+	ms2peaks = np.zeros((length + 1, 2))
+	ms2peaks[:, MassSpectrum.MASS] = np.cumsum(np.full(length + 1, mass_table["Gly"]))
+	chain = MassSpectrum(ms2peaks=ms2peaks, mass_table={"Gly" : mass_table["Gly"]})
+	chain_tags = list(chain.iter_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold))
+	assert len(chain_tags) == 1 and chain_tags[0].length == length, "iter_sequence_tags fails on a tag longer than the recursion limit!"
+
+'''Tests that a TagGraph can be built once, saved and loaded again, and reused for every kind of tag search with the same results as building it each time.'''
+def test_tag_graph(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	spectrum = generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold)
+	tag_graph = spectrum.build_tag_graph(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+	
+	file = io.BytesIO()
+	tag_graph.save(file)
+	file.seek(0)
+	loaded = TagGraph.load(file)
+	assert np.array_equal(loaded.indptr, tag_graph.indptr) and np.array_equal(loaded.indices, tag_graph.indices) and np.array_equal(loaded.residues, tag_graph.residues), \
+			"TagGraph isn't the same after saving and loading!"
+	assert loaded.all_edge_compounds() == tag_graph.all_edge_compounds(), "TagGraph's compounds aren't the same after saving and loading!"
+	
+	spectrum_tags = spectrum.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+	assert tag_signature(spectrum.find_sequence_tags(tag_graph=loaded)) == tag_signature(spectrum_tags), "find_sequence_tags with a tag graph gives different tags!"
+	assert tag_signature(spectrum.find_longest_tag(tag_graph=loaded)) == tag_signature(spectrum.find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)), \
+			"find_longest_tag with a tag graph gives different tags!"
+	assert len(list(spectrum.iter_sequence_tags(tag_graph=spectrum_tags.tag_graph))) == sum([len(tags) for tags in spectrum_tags.tags.values()]), \
+			"iter_sequence_tags with a SpectrumTags' tag graph gives different tags!"
+	
+	try:
+		MassSpectrum(ms2peaks=spectrum.ms2peaks[1:, :], mass_table=mass_table).find_sequence_tags(tag_graph=tag_graph)
+		assert False, "find_sequence_tags accepts a tag graph with the wrong number of peaks!"
+	except ValueError:
+		pass
+		
+'''Tests MassTableIndex's tolerance windows (against calling each mass tolerance mode once per compound) and merge_windows, 
+	that MassSpectraAggregate shares one index between spectra with the same mass table, and that edges are unchanged when windows overlap.'''
+def test_mass_table_index(mass_table=AA_mass_table):
+
+	spectra = [generate_tag_spectrum(mass_table=mass_table) for i in range(random.randint(2, 5))]
+	spectra_aggregate = MassSpectraAggregate(spectra)
+	mass_table_index = spectra[0].mass_table_index
+	assert all([spectrum.mass_table_index is mass_table_index for spectrum in spectra]), "MassSpectraAggregate doesn't share its MassTableIndex!"
+	generated = MassSpectraAggregate(spectrum for spectrum in spectra)
+	assert len(generated.find_sequence_tags()) == len(spectra), "MassSpectraAggregate uses up a generator of spectra sharing its MassTableIndex!"
+	
+	string_index = MassTableIndex({compound:str(mass) for compound, mass in mass_table.items()}) #like the Kersten table
+	assert np.array_equal(string_index.masses, mass_table_index.masses), "MassTableIndex doesn't convert string masses!"
+	assert np.all(np.diff(mass_table_index.sorted_masses()) >= 0), "MassTableIndex doesn't sort masses!"
+	
+	for mass_tolerance_mode, threshold in [(MassSpectrum.STATIC_MASS_TOLERANCE, 0.05), (MassSpectrum.REL_PPM_MASS_TOLERANCE, 0.0005), (MassSpectrum.MAX_PPM_MASS_TOLERANCE, 0.0005)]:
+		cacheable = mass_tolerance_mode in MassSpectrum.SPECTRUM_INDEPENDENT_TOLERANCES
+		lower, upper = mass_table_index.tolerance_windows(mass_tolerance_mode, threshold, spectrum=spectra[0], cacheable=cacheable)
+		expected = [mass_tolerance_mode(spectra[0], mass, threshold) for mass in mass_table.values()]
+		assert np.array_equal(lower, [l for l, u in expected]) and np.array_equal(upper, [u for l, u in expected]), "MassTableIndex's tolerance windows are wrong!"
+		assert (mass_table_index.tolerance_windows(mass_tolerance_mode, threshold, spectrum=spectra[1], cacheable=cacheable)[0] is lower) == cacheable, \
+				"MassTableIndex doesn't cache (only) spectrum-independent tolerance windows!"
+				
+		group_lower, group_upper, groups = MassTableIndex.merge_windows(lower, upper)
+		assert sorted(np.concatenate(groups).tolist()) == list(range(len(mass_table))), "merge_windows loses compounds!"
+		assert np.all(group_lower[1:] > group_upper[:-1]), "merge_windows leaves overlapping windows!"
+		
+		for spectrum in spectra:
+			assert tag_signature(spectrum.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=threshold, edge_mode=MassSpectrum.SEARCHSORTED_EDGES)) == \
+					tag_signature(spectrum.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=threshold, edge_mode=MassSpectrum.LOOP_EDGES)), \
+					"searchsorted_edges finds different edges when tolerance windows overlap!"
+					
+	compounds = list(mass_table.keys())
+	group_lower, group_upper, groups = MassTableIndex.merge_windows(*mass_table_index.tolerance_windows(MassSpectrum.STATIC_MASS_TOLERANCE, 0.05, cacheable=True))
+	assert any([compounds.index("Gln") in group and compounds.index("Lys") in group for group in groups]), "merge_windows doesn't merge Gln and Lys!"
+	
+'''Tests that find_sequence_tags with max_residues bridges a missing peak with a combination of compounds (and doesn't without it),
+	that every edge discovery mode still agrees when combinations are used, and the tag notation for combinations.'''
+def test_multi_residue_gaps(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	compounds = list(mass_table.keys())
+	first, second = sorted(["Gly", "Ser"], key=compounds.index) #combinations are named in mass table order
+	
+	ms2peaks = np.zeros((3, 2))
+	ms2peaks[:, MassSpectrum.MASS] = np.cumsum([100.0, mass_table["Gly"] + mass_table["Ser"], mass_table["Val"]]) #the peak between Gly and Ser is missing
+	spectrum = MassSpectrum(ms2peaks=ms2peaks, mass_table=mass_table)
+	
+	assert spectrum.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold).longest_tag == 1, \
+			"find_sequence_tags bridges a missing peak without max_residues!"
+	bridged = spectrum.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, max_residues=2)
+	assert [tag.tag for tag in bridged.tags[2]] == ["-[%s+%s]-Val-" % (first, second)], "find_sequence_tags with max_residues doesn't bridge a missing peak!"
+	assert list(bridged.tags[2][0].expand_tag_notation()) == ["%s+%s-Val" % (first, second)], "expand_tag_notation splits up a combination of compounds!"
+	
+	names, masses = spectrum.mass_table_index.combination_index(3)
+	assert len(names) == len(masses) == len(mass_table) + len(list(itertools.combinations_with_replacement(mass_table, 2))) + len(list(itertools.combinations_with_replacement(mass_table, 3))), \
+			"combination_index doesn't have every combination!"
+	try:
+		spectrum.find_sequence_tags(max_residues=MassTableIndex.MAX_COMBINATION_SIZE + 1)
+		assert False, "find_sequence_tags accepts combinations of too many compounds!"
+	except ValueError:
+		pass
+		
+	spectrum = generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold)
+	for max_residues in [2, 3]:
+		signatures = [tag_signature(spectrum.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, edge_mode=edge_mode, max_residues=max_residues)) 
+						for edge_mode in [MassSpectrum.LOOP_EDGES, MassSpectrum.SEARCHSORTED_EDGES, MassSpectrum.BROADCAST_EDGES]]
+		assert all([signature == signatures[0] for signature in signatures]), "Edge discovery modes don't agree with max_residues!"
+		
+'''Tests that MassSpectraAggregate's tag searches give the same results (in the same order) over a process pool as they do serially,
+	and that a time budget stops a search early and marks it as incomplete.'''
+def test_parallel_tag_search(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	spectra_aggregate = MassSpectraAggregate([generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold) for i in range(random.randint(3, 6))])
+	
+	serial = spectra_aggregate.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+	parallel = spectra_aggregate.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, workers=2, chunksize=1)
+	assert [tag_signature(spectrum_tags) for spectrum_tags in parallel] == [tag_signature(spectrum_tags) for spectrum_tags in serial], \
+			"find_sequence_tags gives different results in parallel!"
+	assert [spectrum_tags.id for spectrum_tags in parallel] == spectra_aggregate.get_spectra_ids(), "find_sequence_tags doesn't keep the order of the spectra in parallel!"
+	
+	longest_tag, longest = spectra_aggregate.find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, longest_only=True, workers=2)
+	assert longest_tag == max([spectrum_tags.longest_tag for spectrum_tags in serial]), "find_longest_tag gives a different longest tag in parallel!"
+	
+	timed_out = spectra_aggregate.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, workers=2, time_budget=0)
+	assert all([not spectrum_tags.complete and spectrum_tags.longest_tag == 0 for spectrum_tags in timed_out]), "find_sequence_tags doesn't stop when it runs out of time!"
+	assert all([spectrum_tags.complete for spectrum_tags in serial]), "find_sequence_tags marks a search with no time budget as incomplete!"
+	
+	#the budget also covers building the tag graph, which isn't started when there's no time left and stops the search once it's built when it ran over
+	builds = []
+	def slow_edges(spectrum, lower_thresholds, upper_thresholds):
+		builds.append(1)
+		time.sleep(0.05)
+		return MassSpectrum.SEARCHSORTED_EDGES(spectrum, lower_thresholds, upper_thresholds)
+	spectrum = spectra_aggregate.spectra[0]
+	for search in [spectrum.find_sequence_tags, spectrum.find_longest_tag]:
+		timed_out = search(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, edge_mode=slow_edges, time_budget=0)
+		assert not timed_out.complete and timed_out.tag_graph is None and len(builds) == 0, "%s builds a tag graph when it's already out of time!" % search.__name__
+		timed_out = search(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, edge_mode=slow_edges, time_budget=0.01)
+		assert not timed_out.complete and timed_out.longest_tag == 0 and timed_out.tag_graph is not None and len(builds) == 1, \
+				"%s doesn't stop when it runs out of time building its tag graph!" % search.__name__
+		builds.clear()
+	empty = MassSpectrum(mass_table=mass_table)
+	assert not empty.find_longest_tag(time_budget=0).complete and empty.find_longest_tag(time_budget=60).complete, "find_longest_tag ignores its time budget on a spectrum without tags!"
+	
+'''Tests that MassSpectraAggregate's share_peaks moves readings into a PeakStore (in shared memory or a memory-mapped file) that spectra are pickled as references to,
+	that tag searches over a process pool give the same results with it, and that unshare_peaks gives spectra their own readings back.'''
+def test_peak_store(mass_table=AA_mass_table):
+
+	mass_threshold = 0.001
+	for use_shared_memory in [True, False]:
+	
+		spectra_aggregate = MassSpectraAggregate([generate_tag_spectrum(mass_table=mass_table, mass_threshold=mass_threshold) for i in range(random.randint(3, 6))] + [MassSpectrum(mass_table=mass_table)])
+		readings = [np.array(spectrum.ms2peaks).reshape(-1, 2) for spectrum in spectra_aggregate.spectra]
+		serial = spectra_aggregate.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold)
+		
+		peak_store = spectra_aggregate.share_peaks(use_shared_memory=use_shared_memory)
+		assert all([np.array_equal(spectrum.ms2peaks, peaks) for spectrum, peaks in zip(spectra_aggregate.spectra, readings)]), "share_peaks changes the readings!"
+		assert all([np.shares_memory(spectrum.ms2peaks, peak_store.readings) for spectrum in spectra_aggregate.spectra if len(spectrum.ms2peaks) > 0]), \
+				"share_peaks doesn't make the readings views of the PeakStore!"
+				
+		spectrum = spectra_aggregate.spectra[0]
+		assert spectrum.__getstate__()["ms2peaks"] is None, "A spectrum in a PeakStore pickles its readings!"
+		unpickled = pickle.loads(pickle.dumps(spectrum))
+		assert np.array_equal(unpickled.ms2peaks, spectrum.ms2peaks) and not unpickled.ms2peaks.flags.writeable, "An unpickled spectrum doesn't get read-only readings from its PeakStore!"
+		assert pickle.loads(pickle.dumps(spectrum)).peak_store.readings is unpickled.peak_store.readings, "A PeakStore attaches to its block again every time it's unpickled!"
+		unpickled.sort_by_mass()
+		assert unpickled.__getstate__()["ms2peaks"] is not None, "A spectrum whose readings have been replaced still pickles as a reference to its PeakStore!"
+		
+		parallel = spectra_aggregate.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=mass_threshold, workers=2)
+		assert [tag_signature(spectrum_tags) for spectrum_tags in parallel] == [tag_signature(spectrum_tags) for spectrum_tags in serial], \
+				"find_sequence_tags gives different results in parallel with a PeakStore!"
+				
+		spectra_aggregate.unshare_peaks()
+		assert peak_store.name not in PeakStore.attached, "unshare_peaks leaves this process attached to the PeakStore's block!"
+		assert all([spectrum.peak_store is None and not np.shares_memory(spectrum.ms2peaks, peak_store.readings) if peak_store.readings is not None else spectrum.peak_store is None 
+						for spectrum in spectra_aggregate.spectra]), "unshare_peaks doesn't give spectra their own readings back!"
+		assert all([np.array_equal(np.array(spectrum.ms2peaks).reshape(-1, 2), peaks) for spectrum, peaks in zip(spectra_aggregate.spectra, readings)]), "unshare_peaks changes the readings!"
+		
+'''Tests that ToleranceSweep (and MassSpectraAggregate's sweep_sequence_tags) give exactly the same tags as filtering a copy of the spectrum 
+	and calling find_sequence_tags on it, for every configuration of a sweep, without changing the spectrum.'''
+def test_tolerance_sweep(mass_table=AA_mass_table):
+
+	spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(2, 4))]
+	for spectrum in spectra:
+		spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = 100 * np.random.random(spectrum.ms2peaks.shape[0])
+	readings = [np.array(spectrum.ms2peaks) for spectrum in spectra]
+	
+	configurations = [(MassSpectrum.STATIC_MASS_TOLERANCE, 0.01, 0.05), (MassSpectrum.STATIC_MASS_TOLERANCE, 0.001, 0.005), (MassSpectrum.MAX_PPM_MASS_TOLERANCE, 0.00001, 0.5),
+						(MassSpectrum.REL_PPM_MASS_TOLERANCE, 0.0001, 0.3)]
+						
+	def pipeline(spectrum, mass_tolerance_mode, mass_threshold, intensity_threshold):
+		filtered = copy.deepcopy(spectrum)
+		filtered.filter_intensity(intensity_threshold=intensity_threshold * filtered.max_intensity())
+		return filtered.find_sequence_tags(mass_tolerance_mode=mass_tolerance_mode, mass_threshold=mass_threshold)
+		
+	swept_tags = MassSpectraAggregate(spectra).sweep_sequence_tags(configurations, relative_intensity=True)
+	for configuration, spectra_tags in zip(configurations, swept_tags):
+		assert [tag_signature(spectrum_tags) for spectrum_tags in spectra_tags] == [tag_signature(pipeline(spectrum, *configuration)) for spectrum in spectra], \
+				"sweep_sequence_tags doesn't give the same tags as filtering and searching each configuration separately!"
+				
+	sweep = ToleranceSweep(spectra[0], [(MassSpectrum.STATIC_MASS_TOLERANCE, 0.001, None), (MassSpectrum.STATIC_MASS_TOLERANCE, 0.001, 0.0)])
+	assert tag_signature(sweep.find_sequence_tags(0)) == tag_signature(pipeline(spectra[0], MassSpectrum.STATIC_MASS_TOLERANCE, 0.001, 0.05)), \
+			"ToleranceSweep doesn't use filter_intensity's default intensity threshold!"
+	assert all([np.array_equal(spectrum.ms2peaks, peaks) and spectrum.mappings is None for spectrum, peaks in zip(spectra, readings)]), "sweep_sequence_tags changes the spectra!"
+	
+'''Tests that an aggregate using columns (and one using share_peaks) gives exactly the same maxima, filtered and sorted readings, mappings and tags
+	as one that works spectrum by spectrum, and keeps its spectra's readings as views of its store.'''
+def test_columnar_aggregate(mass_table=AA_mass_table):
+
+	spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(3, 6))]
+	for spectrum in spectra:
+		np.random.shuffle(spectrum.ms2peaks)
+		spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = 100 * np.random.random(spectrum.ms2peaks.shape[0])
+		spectrum.keep_mapping_history()
+		
+	for use_shared_memory in [None, True]:
+		plain, columnar = MassSpectraAggregate(copy.deepcopy(spectra)), MassSpectraAggregate(copy.deepcopy(spectra))
+		peak_store = columnar.use_columns() if use_shared_memory is None else columnar.share_peaks(use_shared_memory=use_shared_memory)
+		
+		assert columnar.max_mass_local() == plain.max_mass_local() and columnar.max_intensity_local() == plain.max_intensity_local(), \
+				"Columnar maxima are different to spectrum by spectrum maxima!"
+				
+		thresholds = [random.uniform(0, 30) for spectrum in spectra]
+		thresholds[0] = None
+		for aggregate in [plain, columnar]:
+			aggregate.filter_intensity_local(intensity_thresholds=thresholds)
+			aggregate.sort_by_mass()
+			aggregate.filter_intensity_global(intensity_threshold=10)
+			aggregate.normalise_intensity_global(new_max=50)
+			
+		for plain_spectrum, columnar_spectrum in zip(plain.spectra, columnar.spectra):
+			assert np.array_equal(plain_spectrum.ms2peaks, columnar_spectrum.ms2peaks), "Columnar filtering and sorting gives different readings!"
+			assert np.array_equal(plain_spectrum.mappings, columnar_spectrum.mappings) and len(plain_spectrum.mapping_history) == len(columnar_spectrum.mapping_history) \
+					and all([np.array_equal(plain_old, columnar_old) for plain_old, columnar_old in zip(plain_spectrum.mapping_history, columnar_spectrum.mapping_history)]), \
+					"Columnar filtering and sorting gives different mappings!"
+		assert all([spectrum.peak_store is columnar.peak_store and np.shares_memory(spectrum.ms2peaks, columnar.peak_store.readings) 
+						for spectrum in columnar.spectra if len(spectrum.ms2peaks) > 0]), "Columnar operations don't keep the readings in the aggregate's store!"
+		assert columnar.peak_store.is_shared() == (use_shared_memory is not None), "Columnar operations change the kind of store!"
+		
+		plain_tags = plain.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001)
+		columnar_tags = columnar.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001)
+		assert [tag_signature(spectrum_tags) for spectrum_tags in plain_tags] == [tag_signature(spectrum_tags) for spectrum_tags in columnar_tags], \
+				"Columnar spectra give different tags!"
+				
+		columnar.spectra[0].sort_by_mass() #spectrum by spectrum operations still work, but then the aggregate isn't columnar
+		columnar.spectra[0].ms2peaks = columnar.spectra[0].ms2peaks[::-1]
+		assert columnar.max_mass_local() == plain.max_mass_local(), "An aggregate is still treated as columnar after a spectrum's readings are replaced!"
+		columnar.unshare_peaks()
+		assert columnar.peak_store is None and all([spectrum.peak_store is None for spectrum in columnar.spectra]), "unshare_peaks doesn't free the aggregate's store!"
+		
+'''Tests that SpectrumViews (from MassSpectraAggregate's branch) give exactly the same readings, mappings and tags as doing the same filters, sorts
+	and normalisations to copies of the spectra, without changing the spectra they view, and that branches don't affect each other.'''
+def test_spectrum_views(mass_table=AA_mass_table):
+
+	spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(3, 6))]
+	for spectrum in spectra:
+		np.random.shuffle(spectrum.ms2peaks)
+		spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = 100 * np.random.random(spectrum.ms2peaks.shape[0])
+	readings = [np.array(spectrum.ms2peaks) for spectrum in spectra]
+	spectra_aggregate = MassSpectraAggregate(spectra)
+	
+	def first_pipeline(aggregate):
+		aggregate.filter_intensity_local(intensity_thresholds=[None] + [random.uniform(0, 30) for spectrum in aggregate.spectra[1:]])
+		aggregate.sort_by_mass()
+		aggregate.filter_intensity_global(intensity_threshold=10)
+		aggregate.normalise_intensity_global(new_max=50)
+		
+	def second_pipeline(aggregate):
+		aggregate.normalise_intensity_global(new_max=1000, exact=True)
+		aggregate.filter_intensity_global()
+		aggregate.filter_intensity_global(intensity_threshold=200)
+		
+	branches = []
+	for pipeline in [first_pipeline, second_pipeline]:
+		random_state = random.getstate()
+		copied = MassSpectraAggregate(copy.deepcopy(spectra))
+		pipeline(copied)
+		random.setstate(random_state) #so both get the same random thresholds
+		branch = spectra_aggregate.branch()
+		pipeline(branch)
+		branches.append((copied, branch))
+		
+	for copied, branch in branches:
+		for copied_spectrum, view in zip(copied.spectra, branch.spectra):
+			materialised = view.materialise()
+			assert np.array_equal(copied_spectrum.ms2peaks, materialised.ms2peaks) and np.array_equal(copied_spectrum.ms2peaks, view.ms2peaks), \
+					"A SpectrumView gives different readings to the same transforms on a copy of the spectrum!"
+			assert np.array_equal(copied_spectrum.mappings, materialised.mappings), "A SpectrumView gives different mappings to the same transforms on a copy of the spectrum!"
+			assert copied_spectrum.max_intensity() == view.max_intensity() and copied_spectrum.max_mass() == view.max_mass(), "A SpectrumView gives different maxima!"
+			assert not view.ms2peaks.flags.writeable, "A SpectrumView's materialised readings can be written to!"
+			assert view.ms2peaks is view.ms2peaks and view.peak_count() == len(copied_spectrum.ms2peaks), "A SpectrumView materialises its readings again without being changed!"
+		copied_tags = copied.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001)
+		branch_tags = branch.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001)
+		assert [tag_signature(spectrum_tags) for spectrum_tags in copied_tags] == [tag_signature(spectrum_tags) for spectrum_tags in branch_tags], \
+				"A SpectrumView gives different tags to the same transforms on a copy of the spectrum!"
+				
+	copied, branch = branches[0]
+	sub_branch = branch.branch()
+	sub_branch.filter_intensity_global(intensity_threshold=25)
+	assert all([isinstance(view, SpectrumView) and view.spectrum is spectrum for view, spectrum in zip(sub_branch.spectra, spectra)]), "Branching a branch doesn't give views of the same spectra!"
+	assert all([not np.array_equal(view.ms2peaks, parent.ms2peaks) for view, parent in zip(sub_branch.spectra, branch.spectra) if view.peak_count() != parent.peak_count()]), \
+			"A SpectrumView keeps its materialised readings after being changed!"
+	for method in [sub_branch.share_peaks, sub_branch.use_columns, sub_branch.unshare_peaks]:
+		try:
+			method()
+			assert False, "Moving the readings of SpectrumViews into a PeakStore doesn't raise an error!"
+		except ValueError:
+			pass
+	parallel = sub_branch.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001, workers=2)
+	assert [tag_signature(spectrum_tags) for spectrum_tags in parallel] == [tag_signature(view.find_sequence_tags(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001)) 
+				for view in sub_branch.spectra], "SpectrumViews give different tags in parallel!"
+	assert all([np.array_equal(copied_spectrum.ms2peaks, view.ms2peaks) for copied_spectrum, view in zip(copied.spectra, branch.spectra)]), "Changing a branch changes the branch it came from!"
+	
+	longest, longest_tags = copied.find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001, longest_only=True)
+	branch_longest, branch_longest_tags = branch.find_longest_tag(mass_tolerance_mode=MassSpectrum.STATIC_MASS_TOLERANCE, mass_threshold=0.001, longest_only=True)
+	assert longest == branch_longest and [tag_signature(spectrum_tags) for spectrum_tags in longest_tags] == [tag_signature(spectrum_tags) for spectrum_tags in branch_longest_tags], \
+			"A branch gives different longest tags to the same transforms on a copy of the spectra!"
+	assert all([np.array_equal(spectrum.ms2peaks, peaks) and spectrum.mappings is None for spectrum, peaks in zip(spectra, readings)]), "SpectrumViews change the spectra they view!"
+	
+'''Helper to write spectra out as the text of an .mgf (with peaks written exactly).'''
+def generate_mgf_text(spectra):
+	lines = []
+	for spectrum in spectra:
+		lines += ["BEGIN IONS", "TITLE=" + spectrum.id, "PEPMASS=" + repr(float(spectrum.parent_mass)), "CHARGE=1+", "SCANS=1"]
+		lines += [repr(float(mass)) + " " + repr(float(intensity)) for mass, intensity in spectrum.ms2peaks]
+		lines += ["END IONS", ""]
+	return "\n".join(lines) + "\n"
+	
+'''Tests that mgfParser's iter_spectra yields the same spectra as parse_file one at a time, without reading ahead of the spectrum it yields,
+	and that iter_search_results gives the same tags from them as searching an aggregate of them.'''
+def test_iter_mgf(mass_table=AA_mass_table):
+
+	spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(3, 6))]
+	for index, spectrum in enumerate(spectra):
+		spectrum.id, spectrum.parent_mass = "spectrum_%d" % index, random.uniform(500, 2000)
+		spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = 100 * np.random.random(spectrum.ms2peaks.shape[0])
+	text = generate_mgf_text(spectra)
+	
+	parsed = mgfParser.parse_file(io.StringIO(text)).spectra
+	assert [(spectrum.id, spectrum.parent_mass) for spectrum in parsed] == [(spectrum.id, spectrum.parent_mass) for spectrum in spectra] \
+			and all([np.array_equal(parsed_spectrum.ms2peaks, spectrum.ms2peaks) for parsed_spectrum, spectrum in zip(parsed, spectra)]), "parse_file doesn't give back the spectra written!"
+			
+	lines_read = [0]
+	def counting_lines():
+		for line in io.StringIO(text):
+			lines_read[0] += 1
+			yield line
+	streamed = mgfParser.iter_spectra(counting_lines())
+	first = next(streamed)
+	assert lines_read[0] == len(spectra[0].ms2peaks) + 6, "iter_spectra reads past the end of the spectrum it yields!"
+	streamed = [first] + list(streamed)
+	assert [spectrum.id for spectrum in streamed] == [spectrum.id for spectrum in parsed] \
+			and all([np.array_equal(streamed_spectrum.ms2peaks, spectrum.ms2peaks) for streamed_spectrum, spectrum in zip(streamed, parsed)]), "iter_spectra gives different spectra to parse_file!"
+	assert all([spectrum.mass_table_index is streamed[0].mass_table_index for spectrum in streamed]), "iter_spectra doesn't share one MassTableIndex!"
+	
+	for spectrum in streamed:
+		spectrum.sort_by_mass()
+	kwargs = {"mass_tolerance_mode" : MassSpectrum.STATIC_MASS_TOLERANCE, "mass_threshold" : 0.001}
+	expected = [tag_signature(spectrum_tags) for spectrum_tags in MassSpectraAggregate(streamed).find_sequence_tags(**kwargs)]
+	for workers in [1, 2]:
+		results = iter_search_results(iter(streamed), "find_sequence_tags", workers=workers, chunksize=2, **kwargs)
+		assert isinstance(results, types.GeneratorType) and [tag_signature(spectrum_tags) for spectrum_tags in results] == expected, \
+				"iter_search_results gives different tags to searching an aggregate!"
+				
+'''Tests that MassSpectrum's parse_peaks (used by both parsers) reads peaks exactly, in bulk or line by line when some lines are malformed,
+	and that the .ms parser gives back the readings written.'''
+def test_parse_peaks():
+
+	ms2peaks = np.random.random((random.randint(1, 50), 2)) * [2000, 100000]
+	lines = [repr(float(mass)) + " " + repr(float(intensity)) + "\n" for mass, intensity in ms2peaks]
+	assert np.array_equal(MassSpectrum.parse_peaks(lines), ms2peaks), "parse_peaks doesn't read peaks exactly!"
+	assert np.array_equal(MassSpectrum.parse_peaks([line.strip() + " 3\n" for line in lines]), ms2peaks), "parse_peaks doesn't ignore extra columns!"
+	
+	malformed = lines[:]
+	for bad_line in ["\n", "1.5\n", "abc def\n", "# comment\n", "2.5 three\n"]:
+		malformed.insert(random.randint(0, len(malformed)), bad_line)
+	assert np.array_equal(MassSpectrum.parse_peaks(malformed), ms2peaks), "parse_peaks doesn't skip malformed lines!"
+	assert MassSpectrum.parse_peaks([]).shape == (0,) and MassSpectrum.parse_peaks(["\n", "x\n"]).shape == (0,), "parse_peaks doesn't give an empty array for no peaks!"
+	
+	text = ">compound test\n>parentmass 500.5\n\n>ms2peaks\n" + "".join(malformed) + "\n>comments anything\n"
+	record = massSpectraParser.parse_file(io.StringIO(text))
+	assert np.array_equal(record["ms2peaks"], ms2peaks) and record["parentmass"] == 500.5 and record["comments"] == "anything", "The .ms parser doesn't give back the readings written!"
+	record = massSpectraParser.parse_file(io.StringIO(">ms2peaks " + lines[0] + "".join(lines[1:])))
+	assert np.array_equal(record["ms2peaks"], ms2peaks), "The .ms parser loses readings on the same line as the field name!"
+	
+'''Tests that SpectraCache gives back exactly what the parsers give, memory-mapped on warm loads, and that it throws away stale and corrupt entries 
+	and keeps itself under its maximum size.'''
+def test_spectra_cache(mass_table=AA_mass_table):
+
+	directory = tempfile.mkdtemp()
+	try:
+		spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(2, 4))]
+		for index, spectrum in enumerate(spectra):
+			spectrum.id, spectrum.parent_mass = "spectrum_%d" % index, random.uniform(500, 2000)
+			spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = 100 * np.random.random(spectrum.ms2peaks.shape[0])
+		with open(os.path.join(directory, "spectra.mgf"), 'w') as file:
+			file.write(generate_mgf_text(spectra))
+		with open(os.path.join(directory, "spectrum.ms"), 'w') as file:
+			file.write(">compound test\n>parentmass 500.5\n>ms2peaks\n" + "".join(["%r %r\n" % (mass, intensity) for mass, intensity in spectra[0].ms2peaks.tolist()]))
+			
+		cache = SpectraCache(directory=os.path.join(directory, "cache"))
+		uncached_mgf = mgfParser.load_files_from_dir(path=directory, cache=False)[0][1].spectra
+		uncached_ms = massSpectraParser.load_files_from_dir(path=directory, cache=False)[0][1]
+		for load in range(2): #first cold, then warm
+			cached_mgf = mgfParser.load_files_from_dir(path=directory, cache=cache)[0][1].spectra
+			cached_ms = massSpectraParser.load_files_from_dir(path=directory, cache=cache)[0][1]
+			assert [(spectrum.id, spectrum.parent_mass, spectrum.misc) for spectrum in cached_mgf] == [(spectrum.id, spectrum.parent_mass, spectrum.misc) for spectrum in uncached_mgf] \
+					and all([np.array_equal(cached.ms2peaks, uncached.ms2peaks) for cached, uncached in zip(cached_mgf, uncached_mgf)]), "SpectraCache gives different spectra to parsing the .mgf!"
+			assert {key : value for key, value in cached_ms.items() if key != "ms2peaks"} == {key : value for key, value in uncached_ms.items() if key != "ms2peaks"} \
+					and np.array_equal(cached_ms["ms2peaks"], uncached_ms["ms2peaks"]), "SpectraCache gives a different record to parsing the .ms!"
+		assert isinstance(cached_ms["ms2peaks"].base, np.memmap), "A warm load doesn't memory-map the readings!"
+		
+		cached_mgf[0].normalise_intensity(new_max=1) #entries are copy-on-write
+		assert np.array_equal(mgfParser.load_files_from_dir(path=directory, cache=cache)[0][1].spectra[0].ms2peaks, uncached_mgf[0].ms2peaks), "Changing cached readings changes the entry!"
+		
+		with open(os.path.join(directory, "spectrum.ms"), 'a') as file:
+			file.write("1.0 2.0\n")
+		assert len(massSpectraParser.load_files_from_dir(path=directory, cache=cache)[0][1]["ms2peaks"]) == len(uncached_ms["ms2peaks"]) + 1, "SpectraCache gives back a stale entry!"
+		
+		with open(cache.entry_path(os.path.join(directory, "spectra.mgf"), "mgf"), 'r+b') as file:
+			file.truncate(100)
+		assert len(mgfParser.load_files_from_dir(path=directory, cache=cache)[0][1].spectra) == len(spectra), "SpectraCache doesn't reparse a corrupt entry!"
+		
+		cache.max_size = os.path.getsize(cache.entry_path(os.path.join(directory, "spectrum.ms"), "ms"))
+		os.utime(os.path.join(directory, "spectrum.ms"), ns=(0, 0))
+		massSpectraParser.load_files_from_dir(path=directory, cache=cache)
+		assert os.listdir(cache.directory) == [os.path.basename(cache.entry_path(os.path.join(directory, "spectrum.ms"), "ms"))], \
+				"SpectraCache doesn't evict its least recently used entries to stay under its maximum size!"
+	finally:
+		shutil.rmtree(directory)
+		
+'''Tests that a SpectralLibrary packed from a directory gives back the same records and spectra as parsing the files, fetching them by id.'''
+def test_spectral_library(mass_table=AA_mass_table):
+
+	directory = tempfile.mkdtemp()
+	try:
+		spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(2, 4))]
+		for index, spectrum in enumerate(spectra):
+			spectrum.id, spectrum.parent_mass = "spectrum_%d" % index, random.uniform(500, 2000)
+			spectrum.ms2peaks[:, MassSpectrum.INTENSITY] = 100 * np.random.random(spectrum.ms2peaks.shape[0])
+			with open(os.path.join(directory, spectrum.id + ".ms"), 'w') as file:
+				file.write(">compound %s\n>parentmass %r\n>ms2peaks\n" % (spectrum.id, spectrum.parent_mass) + "".join(["%r %r\n" % tuple(peak) for peak in spectrum.ms2peaks.tolist()]))
+		with open(os.path.join(directory, "spectra.mgf"), 'w') as file:
+			file.write(generate_mgf_text(spectra))
+			
+		library = SpectralLibrary.pack(directory, os.path.join(directory, "library.spectra"))
+		library = SpectralLibrary(os.path.join(directory, "library.spectra"))
+		parsed = massSpectraParser.load_files_from_dir(path=directory, cache=False)
+		assert len(library) == 2 * len(spectra) and set(library.ids()) == set([spectrum.id + ".ms" for spectrum in spectra] + [spectrum.id for spectrum in spectra]), \
+				"A SpectralLibrary doesn't hold every spectrum in the directory!"
+		
+		for filename, record in parsed:
+			library_record = library.record(filename)
+			assert [name for name, _ in library.records(filename)] == [filename] and {key : value for key, value in library_record.items() if key != "ms2peaks"} == {key : value for key, value in record.items() if key != "ms2peaks"} \
+					and np.array_equal(library_record["ms2peaks"], record["ms2peaks"]), "A SpectralLibrary gives a different record to parsing the .ms!"
+		assert sorted([filename for filename, record in library.records("*.ms")]) == sorted([filename for filename, record in parsed]), "A SpectralLibrary doesn't match records by pattern!"
+		
+		for spectrum in mgfParser.load_files_from_dir(path=directory, cache=False)[0][1].spectra:
+			library_spectrum = library.spectrum(spectrum.id)
+			assert (library_spectrum.id, library_spectrum.parent_mass, library_spectrum.mass_table) == (spectrum.id, spectrum.parent_mass, spectrum.mass_table) \
+					and np.array_equal(library_spectrum.ms2peaks, spectrum.ms2peaks), "A SpectralLibrary gives a different spectrum to parsing the .mgf!"
+		assert library.spectrum("missing") is None and library.records("missing.ms") == [] and len(library.spectra().spectra) == len(library), "A SpectralLibrary finds spectra it doesn't have!"
+		
+		SpectraCache(directory=os.path.join(directory, "cache")).load(os.path.join(directory, "spectra.mgf"), "mgf", mgfParser.parse_file, mgfParser.pack_spectra, mgfParser.unpack_spectra)
+		try:
+			SpectralLibrary(SpectraCache(directory=os.path.join(directory, "cache")).entry_path(os.path.join(directory, "spectra.mgf"), "mgf"))
+			assert False, "A SpectralLibrary opens a packed file that isn't a library!"
+		except ValueError:
+			pass
+	finally:
+		shutil.rmtree(directory)
+		
+'''Tests that an MgfIndex finds spectra by title and by PEPMASS range, giving the same spectra as parsing the whole .mgf, and is rebuilt when the .mgf changes.'''
+def test_mgf_index(mass_table=AA_mass_table):
 
+	directory = tempfile.mkdtemp()
+	try:
+		spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(5, 10))]
+		for index, spectrum in enumerate(spectra):
+			spectrum.id, spectrum.parent_mass = "spectrum_%d" % index, random.uniform(500, 2000)
+		path = os.path.join(directory, "spectra.mgf")
+		with open(path, 'w') as file:
+			file.write(generate_mgf_text(spectra))
+		parsed = mgfParser.load_files_from_dir(path=directory, cache=False)[0][1].spectra
+		
+		mgf_index = MgfIndex.load(path)
+		assert os.path.exists(MgfIndex.index_path(path)) and len(mgf_index) == len(spectra), "MgfIndex doesn't index every block!"
+		mgf_index = MgfIndex.load(path) #from the sidecar this time
+		assert mgf_index.titles == [spectrum.id for spectrum in parsed] and mgf_index.parent_masses.tolist() == [spectrum.parent_mass for spectrum in parsed] \
+				and mgf_index.scans == ["1" for spectrum in parsed], "MgfIndex records the wrong fields!"
+		
+		for spectrum in random.sample(parsed, 3):
+			found = mgf_index.get_by_title(spectrum.id)
+			assert len(found) == 1 and found[0].id == spectrum.id and np.array_equal(found[0].ms2peaks, spectrum.ms2peaks), "MgfIndex reads the wrong spectrum for a title!"
+		lower, upper = sorted([random.uniform(500, 2000), random.uniform(500, 2000)])
+		assert [spectrum.id for spectrum in mgf_index.get_by_mass_range(lower, upper)] == [spectrum.id for spectrum in parsed if lower <= spectrum.parent_mass <= upper], \
+				"MgfIndex finds the wrong spectra for a mass range!"
+		assert mgf_index.get_by_title("missing") == [] and mgf_index.get_by_mass_range(0, 1) == [], "MgfIndex finds spectra that aren't there!"
+		
+		with open(path, 'a') as file:
+			file.write(generate_mgf_text([spectra[0]]))
+		assert len(MgfIndex.load(path)) == len(spectra) + 1 and len(MgfIndex.load(path).get_by_title(spectra[0].id)) == 2, "MgfIndex isn't rebuilt when the .mgf changes!"
+		
+		read_only = os.path.join(directory, "read_only")
+		os.mkdir(read_only)
+		read_only_path = shutil.copy(path, read_only)
+		if(hasattr(os, "geteuid") and os.geteuid() == 0): #permissions don't stop root writing, so the sidecar's place is taken by a directory instead
+			os.mkdir(MgfIndex.index_path(read_only_path))
+		os.chmod(read_only, 0o555)
+		builds = []
+		def counted_build(path, write=True):
+			builds.append(path)
+			return build(path, write=write)
+		build, MgfIndex.build = MgfIndex.build, staticmethod(counted_build)
+		try:
+			mgf_index = MgfIndex.load(read_only_path)
+		finally:
+			MgfIndex.build = staticmethod(build)
+		assert len(builds) == 1, "MgfIndex scans the .mgf again when its sidecar can't be written!"
+		assert len(mgf_index) == len(spectra) + 1 and len(mgf_index.get_by_title(spectra[0].id)) == 2, "MgfIndex can't be loaded when its sidecar can't be written!"
+		assert not any([name.endswith(".tmp") for name in os.listdir(read_only)]), "MgfIndex leaves a temporary file behind when its sidecar can't be written!"
+	finally:
+		if(os.path.isdir(os.path.join(directory, "read_only"))):
+			os.chmod(os.path.join(directory, "read_only"), 0o755)
+		shutil.rmtree(directory)
+		
+'''Tests that loading a directory over a pool of threads (and processes) gives the same results as loading it file by file, in the order of the glob.'''
+def test_concurrent_loading(mass_table=AA_mass_table):
+
+	directory = tempfile.mkdtemp()
+	try:
+		spectra = [generate_tag_spectrum(mass_table=mass_table, mass_threshold=0.001) for i in range(random.randint(5, 12))]
+		for index, spectrum in enumerate(spectra):
+			spectrum.id = "spectrum_%d" % index
+			with open(os.path.join(directory, spectrum.id + ".ms"), 'w') as file:
+				file.write(">compound %s\n>ms2peaks\n" % spectrum.id + "".join(["%r %r\n" % tuple(peak) for peak in spectrum.ms2peaks.tolist()]))
+			with open(os.path.join(directory, spectrum.id + ".mgf"), 'w') as file:
+				file.write(generate_mgf_text([spectrum]))
+				
+		def signature(records):
+			return [(filename, record["compound"], record["ms2peaks"].tolist()) for filename, record in records]
+		def mgf_signature(spectra_aggregates):
+			return [(filename, [(spectrum.id, spectrum.ms2peaks.tolist()) for spectrum in spectra_aggregate.spectra]) for filename, spectra_aggregate in spectra_aggregates]
+			
+		serial = massSpectraParser.load_files_from_dir(path=directory, cache=False, threads=1)
+		serial_mgf = mgfParser.load_files_from_dir(path=directory, cache=False, threads=1)
+		assert [filename for filename, record in serial] == [os.path.basename(filename) for filename in glob.glob(os.path.join(directory, "*.ms"))], "load_files_from_dir isn't in the order of the glob!"
+		for threads, processes in [(4, 0), (3, 2)]:
+			assert signature(massSpectraParser.load_files_from_dir(path=directory, cache=False, threads=threads, processes=processes)) == signature(serial) \
+					and mgf_signature(mgfParser.load_files_from_dir(path=directory, cache=False, threads=threads, processes=processes)) == mgf_signature(serial_mgf), \
+					"Loading files concurrently gives different results to loading them one by one!"
+		cache = SpectraCache(directory=os.path.join(directory, "cache"))
+		for load in range(2):
+			assert signature(massSpectraParser.load_files_from_dir(path=directory, cache=cache, threads=4, processes=load)) == signature(serial), \
+					"Loading files concurrently through a SpectraCache gives different results!"
+	finally:
+		shutil.rmtree(directory)
+		
 '''Run tests. They should be randomised, but they will give an indication of whether something is obviously wrong.'''
 def tests():
 	test_decompose_tag()
@@ -387,5 +1071,23 @@ def tests():
 	test_sort_by_mass()
 	test_filter_intensity()
 	test_normalise_intensity()
+	test_normalise_intensity_precision()
 	test_mass_tolerance_calculations()
-	test_find_longest_tag()
\ No newline at end of file
+	test_find_longest_tag()
+	test_edge_modes()
+	test_longest_tag_only()
+	test_iter_sequence_tags()
+	test_tag_graph()
+	test_mass_table_index()
+	test_multi_residue_gaps()
+	test_parallel_tag_search()
+	test_peak_store()
+	test_tolerance_sweep()
+	test_columnar_aggregate()
+	test_spectrum_views()
+	test_iter_mgf()
+	test_parse_peaks()
+	test_spectra_cache()
+	test_spectral_library()
+	test_mgf_index()
+	test_concurrent_loading()
\ No newline at end of file